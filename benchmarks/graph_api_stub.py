@@ -0,0 +1,78 @@
+"""
+Local stand-in for the WhatsApp Graph API, used by the benchmark harness.
+
+Accepts template sends on POST /{version}/{phone_number_id}/messages with a
+configurable latency and error rate, and remembers the last code sent to each
+number so the harness can verify it (GET /_codes/{phone_number})::
+
+    python -m benchmarks.graph_api_stub --port 9100 --latency-ms 120 --jitter-ms 40 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import random
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(latency_ms: float, jitter_ms: float, error_rate: float, throttle_rate: float) -> FastAPI:
+    app = FastAPI(title="Graph API stub")
+    codes: Dict[str, str] = {}
+    message_ids = itertools.count(1)
+
+    @app.post("/{version}/{phone_number_id}/messages")
+    async def send_message(version: str, phone_number_id: str, request: Request):
+        delay = max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        roll = random.random()
+        if roll < throttle_rate:
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": "1"},
+                content={"error": {"message": "Rate limit hit", "code": 130429}}
+            )
+        if roll < throttle_rate + error_rate:
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Service temporarily unavailable", "code": 2}}
+            )
+
+        body = await request.json()
+        components = body["template"]["components"]
+        codes[body["to"]] = components[0]["parameters"][0]["text"]
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": body["to"], "wa_id": body["to"].lstrip("+")}],
+            "messages": [{"id": f"wamid.stub{next(message_ids)}"}],
+        }
+
+    @app.get("/_codes/{phone_number}")
+    async def last_code(phone_number: str):
+        code = codes.get(phone_number)
+        if code is None:
+            return JSONResponse(status_code=404, content={"detail": "No code sent to this number"})
+        return {"code": code}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.graph_api_stub", description="Fake WhatsApp Graph API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="Standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of sends answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of sends answered with 429")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
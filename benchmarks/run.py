@@ -0,0 +1,320 @@
+"""
+Load-test harness for the OTP endpoints.
+
+Boots the Graph API stub and the app (python main.py) against the Postgres
+configured in the environment (the usual DB_* settings; a throwaway
+``docker run -e POSTGRES_PASSWORD=... -p 5432:5432 postgres:16`` is enough),
+migrates it, provisions a fresh admin, business and client, then drives
+/api/v1/otp/send (and /verify for each delivered code) open-loop at a fixed
+rate. Latency, throughput, errors and SQL statements per request (read from
+the Server-Timing header) are written to a JSON file for comparison between
+releases::
+
+    python -m benchmarks.run --rps 200 --duration 60 --workers 4 --stub-latency-ms 150
+
+Extra app settings can be passed as --set NAME=VALUE (e.g. --set OTP_STORE=redis).
+With --workers above 1 the idempotency store is turned off (the harness sends
+no Idempotency-Key); per-process backends picked with --set (OTP_STORE=memory,
+STATELESS_OTP_REPLAY_BACKEND=memory) make the app refuse to start.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import secrets
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_DB_TIMING = re.compile(r"(?:^|,\s*)db;dur=[\d.]+(?:;desc=\"(\d+)x\")?")
+
+
+@dataclass
+class Sample:
+    started: float
+    latency: float
+    status: int
+    db_queries: Optional[int] = None
+
+
+@dataclass
+class EndpointStats:
+    samples: List[Sample] = field(default_factory=list)
+
+    def summary(self, measured_seconds: float) -> Dict:
+        ok = [s for s in self.samples if 200 <= s.status < 300]
+        latencies = sorted(s.latency * 1000 for s in ok)
+        queries = [s.db_queries for s in ok if s.db_queries is not None]
+
+        errors: Dict[str, int] = {}
+        for s in self.samples:
+            if not 200 <= s.status < 300:
+                key = str(s.status) if s.status else "transport"
+                errors[key] = errors.get(key, 0) + 1
+
+        return {
+            "requests": len(self.samples),
+            "ok": len(ok),
+            "errors": errors,
+            "throughput_rps": round(len(ok) / measured_seconds, 2) if measured_seconds else 0.0,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": round(latencies[-1], 2) if latencies else None,
+            },
+            "db_queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return round(values[rank], 2)
+
+
+def db_queries(response: httpx.Response) -> Optional[int]:
+    header = response.headers.get("server-timing")
+    if header is None:
+        return None
+    match = _DB_TIMING.search(header)
+    if match is None:
+        return 0
+    return int(match.group(1) or 1)
+
+
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=ROOT, env=env)
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if process.poll() is not None:
+                    raise RuntimeError(f"The process serving {url} exited with status {process.returncode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+                await asyncio.sleep(0.2)
+
+
+async def provision(client: httpx.AsyncClient, admin_secret: str) -> str:
+    """Creates a fresh admin, business and client; returns the client API key."""
+    suffix = secrets.token_hex(4)
+    email, password = f"bench-{suffix}@example.com", secrets.token_urlsafe(16)
+
+    response = await client.post(
+        "/api/v1/admin/register", json={"email": email, "password": password},
+        headers={"X-Admin-Secret": admin_secret}
+    )
+    response.raise_for_status()
+    response = await client.post("/api/v1/token", json={"email": email, "password": password})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+
+    response = await client.post(
+        "/api/v1/admin/business",
+        json={"name": f"bench-{suffix}", "whatsapp_token": "bench-token-" + suffix, "phone_number_id": f"bench{suffix}"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    response.raise_for_status()
+    business_id = response.json()["id"]
+
+    response = await client.post(
+        f"/api/v1/business/{business_id}/clients", json={"name": f"bench-{suffix}", "scopes": "otp"}
+    )
+    response.raise_for_status()
+    return response.json()["api_key"]
+
+
+async def fetch_code(stub: httpx.AsyncClient, phone_number: str, timeout: float = 10.0) -> Optional[str]:
+    """Reads the code the stub received; polls because outbox mode delivers asynchronously."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = await stub.get(f"/_codes/{phone_number}")
+        if response.status_code == 200:
+            return response.json()["code"]
+        await asyncio.sleep(0.05)
+    return None
+
+
+async def run_load(args: argparse.Namespace, app_url: str, stub_url: str, api_key: str) -> Dict:
+    send_stats, verify_stats = EndpointStats(), EndpointStats()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    headers = {"X-API-Key": api_key}
+
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=30.0) as client, \
+            httpx.AsyncClient(base_url=stub_url, timeout=10.0) as stub:
+
+        async def timed(stats: EndpointStats, path: str, body: Dict) -> Optional[httpx.Response]:
+            started = time.monotonic()
+            try:
+                response = await client.post(path, json=body, headers=headers)
+            except httpx.HTTPError:
+                stats.samples.append(Sample(started, time.monotonic() - started, 0))
+                return None
+            stats.samples.append(Sample(started, time.monotonic() - started, response.status_code, db_queries(response)))
+            return response
+
+        async def flow(index: int) -> None:
+            # Distinct numbers so per-phone limits and active-OTP checks stay out of the way
+            phone_number = f"+1555{index % args.phones:07d}"
+            response = await timed(send_stats, "/api/v1/otp/send", {"phone_number": phone_number})
+            if response is None or response.status_code >= 300 or not args.verify:
+                return
+
+            code = await fetch_code(stub, phone_number)
+            if code is not None:
+                await timed(verify_stats, "/api/v1/otp/verify", {
+                    "otp_id": response.json()["otp_id"], "phone_number": phone_number, "otp_code": code
+                })
+
+        total = int(args.rps * (args.warmup + args.duration))
+        begin = time.monotonic()
+        tasks = []
+        for index in range(total):
+            delay = begin + index / args.rps - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(flow(index)))
+        await asyncio.gather(*tasks)
+
+    # Only requests started after the warm-up count
+    measured_from = begin + args.warmup
+    for stats in (send_stats, verify_stats):
+        stats.samples = [s for s in stats.samples if s.started >= measured_from]
+
+    return {
+        "send": send_stats.summary(args.duration),
+        "verify": verify_stats.summary(args.duration),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args: argparse.Namespace) -> Dict:
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    overrides = {
+        "APP_PORT": str(args.app_port),
+        "APP_HOST": "127.0.0.1",
+        "APP_WORKERS": str(args.workers),
+        "WHATSAPP_API_URL": stub_url,
+        "WHATSAPP_API_VERSION": "v0",
+        "WHATSAPP_HTTP2": "false",
+        "RATE_LIMIT_BACKEND": "none",
+        "TRACING_SERVER_TIMING": "true",
+    }
+    if args.workers > 1:
+        # The default memory store is per process, so main.py refuses several workers with it
+        overrides["IDEMPOTENCY_BACKEND"] = "none"
+    for item in args.set:
+        name, _, value = item.partition("=")
+        overrides[name.upper()] = value
+    env = {**os.environ, **overrides}
+
+    stub = start_process([
+        "-m", "benchmarks.graph_api_stub", "--port", str(args.stub_port),
+        "--latency-ms", str(args.stub_latency_ms), "--jitter-ms", str(args.stub_jitter_ms),
+        "--error-rate", str(args.stub_error_rate), "--throttle-rate", str(args.stub_throttle_rate),
+    ], env)
+    app = None
+    try:
+        subprocess.run([sys.executable, "-m", "src.database.migrate", "upgrade"], cwd=ROOT, env=env, check=True)
+        app = start_process(["main.py"], env)
+        await wait_until_up(stub_url + "/docs", stub)
+        await wait_until_up(app_url + "/", app)
+
+        async with httpx.AsyncClient(base_url=app_url, timeout=30.0) as client:
+            api_key = await provision(client, env["SUPER_ADMIN_SECRET"])
+
+        results = await run_load(args, app_url, stub_url, api_key)
+    finally:
+        if app is not None:
+            stop_process(app)
+        stop_process(stub)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "parameters": {
+            "rps": args.rps,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "workers": args.workers,
+            "connections": args.connections,
+            "verify": args.verify,
+            "stub_latency_ms": args.stub_latency_ms,
+            "stub_jitter_ms": args.stub_jitter_ms,
+            "stub_error_rate": args.stub_error_rate,
+            "stub_throttle_rate": args.stub_throttle_rate,
+            "settings": {k: v for k, v in overrides.items() if k not in ("APP_PORT", "APP_HOST")},
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="OTP endpoint load test")
+    parser.add_argument("--rps", type=float, default=50.0, help="Target send rate (requests per second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds of load excluded from the results")
+    parser.add_argument("--workers", type=int, default=1, help="APP_WORKERS for the app under test")
+    parser.add_argument("--connections", type=int, default=200, help="Max client connections to the app")
+    parser.add_argument("--phones", type=int, default=100_000, help="Distinct phone numbers to cycle through")
+    parser.add_argument("--no-verify", dest="verify", action="store_false", help="Only drive /otp/send")
+    parser.add_argument("--app-port", type=int, default=8800)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--stub-latency-ms", type=float, default=100.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Extra app setting")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(args))
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report["results"], indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import asyncio
+import logging
+import signal
+
+from src.config import settings
+from src.database import engine
+from src.services.wa import start_whatsapp_client, close_whatsapp_client
+from src.services.outbox import start_dispatchers, stop_dispatchers
+
+
+async def run() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await start_whatsapp_client()
+    start_dispatchers(settings.outbox_dispatchers)
+    try:
+        await stop.wait()
+    finally:
+        await stop_dispatchers()
+        await close_whatsapp_client()
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
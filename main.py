@@ -1,6 +1,59 @@
-from src.app import app
-from src.config import settings
+import logging
+import os
+import shutil
+import tempfile
+
+from src.config import process_local_state, settings, worker_count
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_metrics_dir() -> None:
+    """
+    Points prometheus_client at a clean directory shared by the workers, so
+    /metrics reports all of them. Must run before any worker imports the app.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path is None:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="wa-otp-metrics-")
+        return
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=settings.app_port)
\ No newline at end of file
+
+    logging.basicConfig(level=logging.INFO)
+
+    workers = worker_count()
+    local = process_local_state()
+    if workers > 1 and local:
+        # Codes, rate limit counters, replay and idempotency records would not be shared between workers
+        raise SystemExit(
+            f"{', '.join(local)} keeps state per process; use the redis (or sql) backends with more than one worker"
+        )
+    if settings.app_workers == 0 and local:
+        logger.warning(
+            "Starting a single worker because of %s; switch to shared backends to scale out", ", ".join(local)
+        )
+    if workers > 1 and settings.metrics_enabled:
+        prepare_metrics_dir()
+
+    # On SIGTERM uvicorn stops accepting connections and lets in-flight requests
+    # finish (up to APP_GRACEFUL_SHUTDOWN_TIMEOUT) before the lifespan shutdown
+    # closes clients and disposes the engine.
+    uvicorn.run(
+        "src.app:app",
+        host=settings.app_host,
+        port=settings.app_port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        backlog=settings.app_backlog,
+        timeout_keep_alive=settings.app_keepalive_timeout,
+        limit_concurrency=settings.app_limit_concurrency,
+        timeout_graceful_shutdown=settings.app_graceful_shutdown_timeout,
+        proxy_headers=True,
+    )
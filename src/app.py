@@ -2,37 +2,107 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from src.config import settings
 from src.database import engine
-from src.database.models import Base
-from src.routes import admin, otp, business, auth
+from src.database.migrate import check_schema_version, upgrade
+from src.database.partitions import start_partition_maintenance, stop_partition_maintenance
+from src.routes import admin, otp, business, auth, metrics
+from src.services.wa import start_whatsapp_client, close_whatsapp_client
+from src.services.outbox import start_dispatchers, stop_dispatchers
+from src.services.otp_store import start_otp_store, close_otp_store
+from src.services.rate_limit import start_rate_limiter
+from src.services.idempotency import start_idempotency_store
+from src.utils.admission import AdmissionMiddleware
+from src.utils.metrics import (
+    MetricsMiddleware,
+    instrument_engine,
+    mark_worker_dead,
+    start_event_loop_monitor,
+    stop_event_loop_monitor,
+)
+from src.utils.passwords import shutdown_password_hasher
+from src.utils import tracing
+from src.utils.redis import close_redis
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Database Initialization
-    async with engine.begin() as conn:
-        
-        await conn.run_sync(Base.metadata.create_all)
+    # Schema is managed by versioned migrations (python -m src.database.migrate upgrade),
+    # workers only check that the database is at the expected version.
+    if settings.db_auto_migrate:
+        await upgrade()
+    await check_schema_version()
+
+    if settings.metrics_enabled:
+        start_event_loop_monitor(settings.metrics_event_loop_interval)
+
+    # Exports sampled request traces when TRACING_EXPORTER is set
+    tracing.start_span_exporter()
+
+    # Creates upcoming otps partitions and drops expired ones when partitioning is enabled
+    start_partition_maintenance()
+
+    # Shared WhatsApp client, reused across requests for connection pooling
+    await start_whatsapp_client()
+
+    # Active OTP store (OTP_STORE), non-SQL stores also start their audit sink
+    await start_otp_store()
+    await start_rate_limiter()
+    if settings.idempotency_backend != "none":
+        await start_idempotency_store()
 
-    yield
+    # Outbox dispatchers can also run standalone via dispatcher.py
+    if settings.otp_delivery_mode == "outbox":
+        start_dispatchers(settings.outbox_dispatchers)
+
+    try:
+        yield
+    finally:
+        await stop_event_loop_monitor()
+        await tracing.stop_span_exporter()
+        await stop_partition_maintenance()
+        await stop_dispatchers()
+        await close_otp_store()
+        await close_whatsapp_client()
+        await close_redis()
+        shutdown_password_hasher()
+        await engine.dispose()
+        mark_worker_dead()
     
     
 app = FastAPI(title="WhatsApp OTP Service", version="1.0.0", lifespan=lifespan)
 
-# Enabled CORS 
+# Middleware added later wraps the middleware added before it
+
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+
+# Sheds load with 503 + Retry-After before it queues behind a saturated pool or WhatsApp
+if settings.admission_enabled:
+    app.add_middleware(AdmissionMiddleware)
+
+# Enabled CORS; added after admission so that its 503s carry CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+# Server-Timing header and sampled spans for every request
+app.add_middleware(tracing.TracingMiddleware)
+tracing.instrument_engine(engine)
+
 # Included routers
 app.include_router(admin.router)
 app.include_router(business.router)
 app.include_router(otp.router)
 app.include_router(auth.router)
+if settings.metrics_enabled:
+    app.include_router(metrics.router)
 
 
 @app.get("/")
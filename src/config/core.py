@@ -1,3 +1,7 @@
+import os
+from typing import Dict, List, Literal, Optional
+
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -15,8 +19,173 @@ class Settings(BaseSettings):
     db_user: str
     db_password: str
     app_port: int
+    app_host: str = "0.0.0.0"
+    app_workers: int = 0
+    app_backlog: int = 2048
+    app_keepalive_timeout: int = 5
+    app_limit_concurrency: Optional[int] = None
+    app_graceful_shutdown_timeout: int = 30
+
+    admin_token_cache_size: int = 1024
+    admin_token_revalidate_seconds: int = 60
+
+    metrics_enabled: bool = True
+    metrics_event_loop_interval: float = 0.5
+
+    tracing_server_timing: bool = True
+    tracing_sample_rate: float = 0.0
+    tracing_trust_upstream_sampling: bool = False
+    tracing_exporter: Literal["none", "file", "otlp"] = "none"
+    tracing_file: str = "traces.jsonl"
+    tracing_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+    tracing_service_name: str = "wa-otp-service"
+
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 8
+
+    db_auto_migrate: bool = False
+    db_profile: Literal["direct", "pgbouncer"] = "direct"
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 5.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = False
+    db_statement_cache_size: int = 500
+    db_application_name: str = "wa-otp-service"
+    db_jit: bool = False
+    db_echo: bool = False
+    db_slow_query_ms: float = 0.0
+
+    otp_partition_interval: Literal["none", "daily", "hourly"] = "none"
+    otp_partitions_ahead: int = 3
+    otp_retention_hours: int = 72
+    otp_archive_dir: Optional[str] = None
+    otp_maintenance_interval: float = 300.0
+
+    whatsapp_http2: bool = True
+    whatsapp_max_connections: int = 100
+    whatsapp_max_keepalive_connections: int = 20
+    whatsapp_keepalive_expiry: float = 30.0
+    whatsapp_connect_timeout: float = 5.0
+    whatsapp_read_timeout: float = 10.0
+    whatsapp_write_timeout: float = 5.0
+    whatsapp_pool_timeout: float = 5.0
+    whatsapp_max_attempts: int = 3
+    whatsapp_backoff_base: float = 0.2
+    whatsapp_backoff_max: float = 2.0
+    whatsapp_deadline: float = 10.0
+    whatsapp_breaker_threshold: int = 5
+    whatsapp_breaker_reset_timeout: float = 30.0
+    whatsapp_rate_per_number: float = 80.0
+    whatsapp_rate_burst: float = 10.0
+    whatsapp_rate_processes: int = 0
+    whatsapp_scheduler_concurrency: int = 100
+    whatsapp_business_weights: Dict[int, float] = {}
+
+    otp_delivery_mode: Literal["sync", "outbox"] = "sync"
+    outbox_dispatchers: int = 2
+    outbox_batch_size: int = 50
+    outbox_poll_interval: float = 0.5
+    outbox_lease_seconds: float = 30.0
+    outbox_max_attempts: int = 5
+    outbox_retry_delay: float = 5.0
+
+    otp_batch_concurrency: int = 20
+
+    client_cache_size: int = 10000
+    client_cache_ttl: float = 60.0
+    client_cache_negative_size: int = 10000
+    client_cache_negative_ttl: float = 10.0
+
+    phone_default_country_code: Optional[str] = None
+    phone_cache_size: int = 100_000
+
+    otp_store: Literal["sql", "memory", "redis"] = "sql"
+    otp_store_max_entries: int = 1_000_000
+    otp_store_grace_seconds: int = 3600
+    otp_id_block_size: int = 100
+    otp_audit_batch_size: int = 500
+    otp_audit_flush_interval: float = 0.5
+    otp_audit_queue_size: int = 100_000
+
+    rate_limit_backend: Literal["memory", "redis", "none"] = "memory"
+    rate_limit_shards: int = 64
+    rate_limit_phone_limit: int = 5
+    rate_limit_phone_window: float = 600.0
+    rate_limit_client_limit: int = 6000
+    rate_limit_client_window: float = 60.0
+    rate_limit_business_limit: int = 12000
+    rate_limit_business_window: float = 60.0
+
+    stateless_otp_enabled: bool = False
+    stateless_otp_step: int = 30
+    stateless_otp_valid_steps: int = 10
+    stateless_otp_replay_backend: Literal["memory", "redis"] = "memory"
+    stateless_otp_replay_max_entries: int = 100_000
+    stateless_otp_max_attempts: int = 5
+
+    admission_enabled: bool = True
+    admission_route_limits: Dict[str, int] = {
+        "/api/v1/otp/send": 200,
+        "/api/v1/otp/send/batch": 10,
+        "/api/v1/otp/verify": 400,
+    }
+    admission_priority_routes: List[str] = ["/api/v1/otp/verify"]
+    admission_queue_timeout: float = 0.5
+    admission_priority_queue_timeout: float = 2.0
+    admission_whatsapp_queue_limit: int = 1000
+    admission_retry_after: int = 1
+
+    idempotency_backend: Literal["memory", "redis", "none"] = "memory"
+    idempotency_ttl: int = 300
+    idempotency_pending_ttl: int = 30
+    idempotency_wait_timeout: float = 15.0
+    idempotency_max_entries: int = 100_000
+
+    redis_url: str = "redis://localhost:6379/0"
+    redis_max_connections: int = 100
+    redis_socket_timeout: float = 1.0
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8')
+
+    @model_validator(mode="after")
+    def check_outbox_store(self) -> "Settings":
+        # The memory and redis stores write OTP rows to Postgres through a
+        # best-effort audit queue; an outbox row that depends on it could be
+        # dropped after the send was already acknowledged
+        if self.otp_delivery_mode == "outbox" and self.otp_store != "sql":
+            raise ValueError("OTP_DELIVERY_MODE=outbox requires OTP_STORE=sql")
+        return self
     
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
+
+
+def process_local_state() -> List[str]:
+    """Configured backends that keep state per process and break with several workers."""
+    local = []
+    if settings.otp_store == "memory":
+        local.append("OTP_STORE=memory")
+    if settings.rate_limit_backend == "memory":
+        local.append("RATE_LIMIT_BACKEND=memory")
+    if settings.idempotency_backend == "memory":
+        local.append("IDEMPOTENCY_BACKEND=memory")
+    if settings.stateless_otp_enabled and settings.stateless_otp_replay_backend == "memory":
+        local.append("STATELESS_OTP_REPLAY_BACKEND=memory")
+    return local
+
+
+def worker_count() -> int:
+    """
+    APP_WORKERS, or when it is 0, one worker per CPU available to this process,
+    falling back to a single worker while any backend keeps per-process state.
+    """
+    if settings.app_workers > 0:
+        return settings.app_workers
+    if process_local_state():
+        return 1
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
@@ -1,17 +1,97 @@
+import logging
+import time
 from typing import AsyncGenerator
+from uuid import uuid4
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from ..config import settings
 
+logger = logging.getLogger(__name__)
+
 
 db_url = f"postgresql+asyncpg://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
 
-engine = create_async_engine(db_url, echo=True)
+
+def engine_options() -> dict:
+    """
+    Engine keyword arguments for the configured DB_PROFILE.
+
+    - direct: a local pool sized by DB_POOL_* with asyncpg's prepared statement
+      cache enabled.
+    - pgbouncer: for PgBouncer in transaction mode. PgBouncer does the pooling,
+      so the local pool is disabled, and prepared statements get unique names
+      and are not cached because consecutive transactions may land on
+      different server connections. PgBouncer refuses startup parameters it
+      does not track, so DB_JIT is not sent; set it on the server instead
+      (ALTER ROLE <db user> SET jit = off).
+    """
+    connect_args = {
+        "server_settings": {"application_name": settings.db_application_name},
+    }
+    options = {"echo": settings.db_echo, "pool_pre_ping": settings.db_pool_pre_ping}
+
+    if settings.db_profile == "pgbouncer":
+        connect_args.update({
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        })
+        options["poolclass"] = NullPool
+    else:
+        connect_args["prepared_statement_cache_size"] = settings.db_statement_cache_size
+        # JIT compilation only slows down the short OLTP queries we run
+        connect_args["server_settings"]["jit"] = "on" if settings.db_jit else "off"
+        options.update({
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout,
+            "pool_recycle": settings.db_pool_recycle,
+        })
+
+    options["connect_args"] = connect_args
+    return options
+
+
+engine = create_async_engine(db_url, **engine_options())
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+if settings.db_slow_query_ms > 0:
+    # Opt-in replacement for echo: only statements slower than the threshold are logged
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+        if elapsed_ms >= settings.db_slow_query_ms:
+            logger.warning("Slow query (%.1f ms): %s", elapsed_ms, statement)
+
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Request-scoped session. It is lazy: no pool connection is checked out until
+    the first statement runs, so requests that are rejected early or served
+    from caches never touch the pool. Use release_connection() to hand the
+    connection back before slow non-database work.
+    """
     async with async_session() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+async def release_connection(session: AsyncSession) -> None:
+    """
+    Ends the session's transaction so its connection goes back to the pool.
+
+    The session stays usable and checks out a connection again on its next
+    statement. Anything not committed is rolled back, so only call this
+    between units of work, e.g. after read-only lookups and before an
+    external API call.
+    """
+    if session.in_transaction():
+        await session.rollback()
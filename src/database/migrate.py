@@ -0,0 +1,150 @@
+"""
+Schema migration runner.
+
+Usage::
+
+    python -m src.database.migrate upgrade [--to VERSION]
+    python -m src.database.migrate current
+    python -m src.database.migrate history
+"""
+import argparse
+import asyncio
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..config import settings
+from .core import engine
+from .migrations import MIGRATIONS, LATEST_VERSION, Migration, Step
+from .partitions import is_partitioned
+
+# Arbitrary application-wide key, serializes concurrent upgrade runs
+MIGRATION_LOCK_ID = 4_815_162_342
+
+
+async def get_current_version(conn: AsyncConnection) -> int:
+    """Returns the applied schema version, 0 for an unmanaged database."""
+    if await conn.scalar(text("SELECT to_regclass('schema_migrations')")) is None:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_migrations"))
+
+
+async def _run_step(conn: AsyncConnection, step: Step) -> None:
+    if isinstance(step, str):
+        await conn.exec_driver_sql(step)
+    else:
+        await step(conn)
+
+
+async def _apply(migration: Migration) -> None:
+    record = text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)")
+    params = {"version": migration.version, "name": migration.name}
+
+    if migration.transactional:
+        async with engine.begin() as conn:
+            for statement in migration.statements:
+                await _run_step(conn, statement)
+            await conn.execute(record, params)
+        return
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for statement in migration.statements:
+            await _run_step(conn, statement)
+        await conn.execute(record, params)
+
+
+async def upgrade(target: Optional[int] = None) -> List[Migration]:
+    """
+    Applies pending migrations up to target (default: latest).
+
+    An advisory lock makes concurrent runs (e.g. several workers booting with
+    DB_AUTO_MIGRATE) wait for each other instead of racing. The lock is held on
+    an autocommit connection so it never blocks CREATE INDEX CONCURRENTLY.
+
+    :param target: Optional[int] - Version to stop at.
+    :return: List[Migration] - The migrations that were applied.
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            await lock_conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                " version INTEGER PRIMARY KEY,"
+                " name VARCHAR(255) NOT NULL,"
+                " applied_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL)"
+            ))
+            current = await get_current_version(lock_conn)
+
+            for migration in MIGRATIONS:
+                if current < migration.version <= target:
+                    await _apply(migration)
+                    applied.append(migration)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+    return applied
+
+
+async def check_schema_version() -> None:
+    """
+    Verifies the database is migrated to the version this code expects, and
+    that otps is partitioned if OTP_PARTITION_INTERVAL asks for it.
+
+    :raises RuntimeError: If the schema is behind or ahead of the code.
+    """
+    async with engine.connect() as conn:
+        current = await get_current_version(conn)
+        partitioned = await is_partitioned(conn)
+
+    if current != LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {current}, expected {LATEST_VERSION}. "
+            "Run `python -m src.database.migrate upgrade`."
+        )
+    if settings.otp_partition_interval != "none" and not partitioned:
+        raise RuntimeError(
+            f"OTP_PARTITION_INTERVAL is {settings.otp_partition_interval} but otps is not partitioned. "
+            "Run `python -m src.database.partitions convert`."
+        )
+
+
+async def _main(args: argparse.Namespace) -> None:
+    try:
+        if args.command == "upgrade":
+            for migration in await upgrade(args.to):
+                print(f"Applied {migration.version:04d}_{migration.name}")
+            async with engine.connect() as conn:
+                print(f"Schema is at version {await get_current_version(conn)}")
+        elif args.command == "current":
+            async with engine.connect() as conn:
+                print(await get_current_version(conn))
+        elif args.command == "history":
+            async with engine.connect() as conn:
+                current = await get_current_version(conn)
+            for migration in MIGRATIONS:
+                mark = "x" if migration.version <= current else " "
+                print(f"[{mark}] {migration.version:04d}_{migration.name}")
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.database.migrate", description="Database schema migrations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    upgrade_parser = subparsers.add_parser("upgrade", help="Apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, default=None, help="Target version (default: latest)")
+    subparsers.add_parser("current", help="Print the applied schema version")
+    subparsers.add_parser("history", help="List migrations and whether they are applied")
+
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Versioned schema migrations.
+
+Every module in this package named ``v<NNNN>_<name>.py`` is one migration and
+defines:
+
+- ``UPGRADE``: list of steps, executed in order. A step is a SQL statement, or
+  an async function taking the migration's AsyncConnection for data changes
+  that need application code (e.g. the phone number normalizer).
+- ``TRANSACTIONAL``: whether the statements run in a single transaction. Set it
+  to False for statements that cannot run inside one, such as
+  ``CREATE INDEX CONCURRENTLY``; those run in autocommit mode and must be safe
+  to re-run (``IF [NOT] EXISTS``) because a failure leaves them half applied.
+
+Apply them with ``python -m src.database.migrate upgrade``.
+"""
+import importlib
+import pkgutil
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Union
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+_MODULE_PATTERN = re.compile(r"^v(\d{4})_(\w+)$")
+
+Step = Union[str, Callable[[AsyncConnection], Awaitable[None]]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    statements: List[Step]
+    transactional: bool
+
+
+def load_migrations() -> List[Migration]:
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        match = _MODULE_PATTERN.match(module_info.name)
+        if not match:
+            continue
+
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        migrations.append(Migration(
+            version=int(match.group(1)),
+            name=match.group(2),
+            statements=list(module.UPGRADE),
+            transactional=getattr(module, "TRANSACTIONAL", True),
+        ))
+
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if versions != list(range(1, len(versions) + 1)):
+        raise RuntimeError(f"Migration versions must be contiguous from 1, got {versions}")
+    return migrations
+
+
+MIGRATIONS = load_migrations()
+LATEST_VERSION = MIGRATIONS[-1].version if MIGRATIONS else 0
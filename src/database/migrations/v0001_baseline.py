@@ -0,0 +1,99 @@
+"""
+Baseline schema, identical to what Base.metadata.create_all used to produce.
+
+Every statement is guarded so databases created by the old create_all at
+startup are adopted as-is.
+"""
+
+UPGRADE = [
+    """
+    DO $$ BEGIN
+        CREATE TYPE user_status AS ENUM ('VERIFIED', 'NOT_VERIFIED');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    DO $$ BEGIN
+        CREATE TYPE delivery_status AS ENUM ('PENDING', 'SENT', 'FAILED');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS admins (
+        id SERIAL NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_admins_email ON admins (email)",
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL NOT NULL,
+        phone_number VARCHAR(255) NOT NULL,
+        status user_status DEFAULT 'NOT_VERIFIED' NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        updated_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_users_phone_number ON users (phone_number)",
+    """
+    CREATE TABLE IF NOT EXISTS businesses (
+        id SERIAL NOT NULL,
+        admin_id INTEGER NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        whatsapp_api_token VARCHAR(255) NOT NULL,
+        phone_number_id VARCHAR NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY (admin_id) REFERENCES admins (id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS clients (
+        id SERIAL NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        business_id INTEGER NOT NULL,
+        scopes VARCHAR(255) NOT NULL,
+        api_key VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY (business_id) REFERENCES businesses (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_clients_api_key ON clients (api_key)",
+    """
+    CREATE TABLE IF NOT EXISTS otps (
+        id SERIAL NOT NULL,
+        user_id INTEGER NOT NULL,
+        client_id INTEGER NOT NULL,
+        otp_code VARCHAR(10) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        is_used BOOLEAN NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_otps_otp_code ON otps (otp_code)",
+    "CREATE INDEX IF NOT EXISTS ix_otps_is_used ON otps (is_used)",
+    """
+    CREATE TABLE IF NOT EXISTS otp_deliveries (
+        id SERIAL NOT NULL,
+        otp_id INTEGER NOT NULL,
+        status delivery_status DEFAULT 'PENDING' NOT NULL,
+        attempts INTEGER DEFAULT '0' NOT NULL,
+        last_error TEXT,
+        next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+        updated_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        UNIQUE (otp_id),
+        FOREIGN KEY (otp_id) REFERENCES otps (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_otp_deliveries_status ON otp_deliveries (status)",
+]
@@ -0,0 +1,35 @@
+"""
+Merge users that share a phone number into the oldest row.
+
+get_or_create_user used to SELECT then INSERT, so concurrent sends could create
+duplicates. They have to be merged before phone_number can become unique.
+"""
+
+UPGRADE = [
+    """
+    UPDATE users
+    SET status = 'VERIFIED'
+    WHERE id IN (
+        SELECT min(id) FROM users
+        GROUP BY phone_number
+        HAVING count(*) > 1 AND bool_or(status = 'VERIFIED')
+    )
+    """,
+    """
+    WITH ranked AS (
+        SELECT id, min(id) OVER (PARTITION BY phone_number) AS keep_id FROM users
+    )
+    UPDATE otps
+    SET user_id = ranked.keep_id
+    FROM ranked
+    WHERE otps.user_id = ranked.id AND ranked.id <> ranked.keep_id
+    """,
+    """
+    WITH ranked AS (
+        SELECT id, min(id) OVER (PARTITION BY phone_number) AS keep_id FROM users
+    )
+    DELETE FROM users
+    USING ranked
+    WHERE users.id = ranked.id AND ranked.id <> ranked.keep_id
+    """,
+]
@@ -0,0 +1,51 @@
+"""
+Indexes for the queries in src/services/otp.py and src/services/outbox.py.
+
+- users.phone_number becomes unique (one user per number, ON CONFLICT target).
+- otps (user_id, client_id, otp_code) serves verify by phone number.
+- otps (user_id, client_id, expires_at) WHERE NOT is_used serves the
+  active-OTP checks on send and only holds live codes.
+- otp_deliveries (next_attempt_at) WHERE status = 'PENDING' serves the
+  dispatcher claim query.
+- The global otp_code index and the boolean is_used/status indexes are
+  superseded and only cost writes, so they are dropped.
+
+Everything is built CONCURRENTLY, so this migration runs outside a transaction.
+A failed concurrent build (e.g. duplicates inserted after v0002 ran) leaves an
+INVALID index behind that IF NOT EXISTS would skip on the next run, so each
+build first drops a leftover invalid index of the same name.
+"""
+
+TRANSACTIONAL = False
+
+
+def _drop_invalid_index(name: str) -> str:
+    """DROP INDEX for an index left INVALID by a failed concurrent build; no-op otherwise."""
+    return f"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_index
+            WHERE indexrelid = to_regclass('{name}') AND NOT indisvalid
+        ) THEN
+            DROP INDEX {name};
+        END IF;
+    END $$
+    """
+
+
+UPGRADE = [
+    _drop_invalid_index("ux_users_phone_number"),
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_users_phone_number ON users (phone_number)",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_users_phone_number",
+    "ALTER INDEX IF EXISTS ux_users_phone_number RENAME TO ix_users_phone_number",
+    _drop_invalid_index("ix_otps_user_client_code"),
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_otps_user_client_code ON otps (user_id, client_id, otp_code)",
+    _drop_invalid_index("ix_otps_active"),
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_otps_active ON otps (user_id, client_id, expires_at) WHERE NOT is_used",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_otps_otp_code",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_otps_is_used",
+    _drop_invalid_index("ix_otp_deliveries_due"),
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_otp_deliveries_due ON otp_deliveries (next_attempt_at) WHERE status = 'PENDING'",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_otp_deliveries_status",
+]
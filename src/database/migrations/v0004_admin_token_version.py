@@ -0,0 +1,10 @@
+"""
+Add admins.token_version.
+
+Admin JWTs carry the version they were issued with; bumping it revokes every
+token issued before.
+"""
+
+UPGRADE = [
+    "ALTER TABLE admins ADD COLUMN IF NOT EXISTS token_version INTEGER DEFAULT 0 NOT NULL",
+]
@@ -0,0 +1,10 @@
+"""
+Add clients.otp_secret.
+
+Clients with a secret get stateless OTPs derived from it (see
+src/services/stateless_otp.py); NULL keeps the stored-OTP flow.
+"""
+
+UPGRADE = [
+    "ALTER TABLE clients ADD COLUMN IF NOT EXISTS otp_secret VARCHAR(64)",
+]
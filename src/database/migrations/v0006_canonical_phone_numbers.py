@@ -0,0 +1,86 @@
+"""
+Bring stored phone numbers to the E.164 form the API now normalizes to.
+
+Numbers used to be stored as typed, so 14155550123 and +14155550123 were two
+users. Every stored number is run through normalize_phone_number (honouring
+PHONE_DEFAULT_COUNTRY_CODE, so set it as the API will run with it). Rows whose
+canonical form differs are merged into the user that already has it, or into
+the oldest of the rows that share it, with the same steps as v0002; the
+survivor gets the canonical number. Numbers the normalizer rejects are left as
+they are and reported.
+"""
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.exceptions.phone import InvalidPhoneNumberError
+from src.utils.phone import normalize_phone_number
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+
+async def canonicalize_phone_numbers(conn: AsyncConnection) -> None:
+    # canonical number -> ids of the rows that normalize to it but store something else
+    pending = {}
+    invalid = []
+
+    last_id = 0
+    while True:
+        rows = (await conn.execute(
+            text("SELECT id, phone_number FROM users WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE}
+        )).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        for row in rows:
+            try:
+                canonical = normalize_phone_number(row.phone_number)
+            except InvalidPhoneNumberError:
+                invalid.append(row.id)
+                continue
+            if canonical != row.phone_number:
+                pending.setdefault(canonical, []).append(row.id)
+
+    if invalid:
+        logger.warning(
+            "%d users have phone numbers that cannot be normalized and were left unchanged (ids: %s%s)",
+            len(invalid), ", ".join(map(str, invalid[:20])), ", ..." if len(invalid) > 20 else ""
+        )
+    if not pending:
+        return
+
+    existing = dict((await conn.execute(
+        text("SELECT phone_number, id FROM users WHERE phone_number = ANY(:numbers)"),
+        {"numbers": list(pending)}
+    )).all())
+
+    merges, renames = [], []
+    for canonical, ids in pending.items():
+        keep_id = existing.get(canonical)
+        if keep_id is None:
+            keep_id = min(ids)
+            renames.append({"id": keep_id, "phone_number": canonical})
+        merges.extend({"id": user_id, "keep_id": keep_id} for user_id in ids if user_id != keep_id)
+
+    if merges:
+        await conn.execute(text("CREATE TEMPORARY TABLE user_merges (id INTEGER, keep_id INTEGER) ON COMMIT DROP"))
+        await conn.execute(text("INSERT INTO user_merges (id, keep_id) VALUES (:id, :keep_id)"), merges)
+        await conn.execute(text(
+            "UPDATE users SET status = 'VERIFIED' "
+            "WHERE id IN (SELECT m.keep_id FROM user_merges m JOIN users u ON u.id = m.id WHERE u.status = 'VERIFIED')"
+        ))
+        await conn.execute(text("UPDATE otps SET user_id = m.keep_id FROM user_merges m WHERE otps.user_id = m.id"))
+        await conn.execute(text("DELETE FROM users USING user_merges m WHERE users.id = m.id"))
+
+    if renames:
+        await conn.execute(text("UPDATE users SET phone_number = :phone_number WHERE id = :id"), renames)
+
+
+UPGRADE = [
+    canonicalize_phone_numbers,
+]
@@ -0,0 +1,22 @@
+"""
+Range-partition otps on created_at when OTP_PARTITION_INTERVAL is set.
+
+With the interval at none (the default) this migration changes nothing. A
+database can be converted later with ``python -m src.database.partitions
+convert``; until then the app refuses to start with the interval set.
+"""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.config import settings
+from src.database.partitions import convert_to_partitioned, is_partitioned
+
+
+async def partition_otps(conn: AsyncConnection) -> None:
+    if settings.otp_partition_interval == "none" or await is_partitioned(conn):
+        return
+    await convert_to_partitioned(conn, settings.otp_partition_interval)
+
+
+UPGRADE = [
+    partition_otps,
+]
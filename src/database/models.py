@@ -1,7 +1,7 @@
-from typing import List
+from typing import List, Optional
 import enum
 
-from sqlalchemy import String, ForeignKey, BigInteger, Enum, Boolean, DateTime, func
+from sqlalchemy import String, ForeignKey, BigInteger, Enum, Boolean, DateTime, Index, Integer, Text, func, text
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -21,6 +21,7 @@ class Admin(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     email: Mapped[str] = mapped_column(String(255), unique=True, index=True, nullable=False)
     password: Mapped[str] = mapped_column(String(255), nullable=False)
+    token_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
     created_at: Mapped[DateTime] = mapped_column(DateTime(), server_default=func.now())
 
     businesses: Mapped[List["Business"]] = relationship(
@@ -52,6 +53,7 @@ class Client(Base):
     business_id: Mapped[int] = mapped_column(ForeignKey("businesses.id", ondelete="CASCADE"))
     scopes: Mapped[str] = mapped_column(String(255))
     api_key: Mapped[str] = mapped_column(String(255), unique=True, index=True, nullable=False)
+    otp_secret: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime(), server_default=func.now())
 
     business: Mapped["Business"] = relationship(back_populates="clients")
@@ -69,7 +71,7 @@ class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    phone_number: Mapped[str] = mapped_column(String(255), index=True, nullable=False)
+    phone_number: Mapped[str] = mapped_column(String(255), unique=True, index=True, nullable=False)
     status: Mapped[UserStatus] = mapped_column(Enum(UserStatus, name="user_status"), server_default=UserStatus.NOT_VERIFIED.name)
     created_at: Mapped[DateTime] = mapped_column(DateTime(), server_default=func.now())
     updated_at: Mapped[DateTime] = mapped_column(DateTime(), nullable=True, server_onupdate=func.now())
@@ -81,14 +83,45 @@ class User(Base):
 
 class OTP(Base):
     __tablename__ = "otps"
+    __table_args__ = (
+        Index("ix_otps_user_client_code", "user_id", "client_id", "otp_code"),
+        Index("ix_otps_active", "user_id", "client_id", "expires_at", postgresql_where=text("NOT is_used")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
     client_id: Mapped[int] = mapped_column(ForeignKey("clients.id", ondelete="CASCADE"))
-    otp_code: Mapped[str] = mapped_column(String(10), index=True, nullable=False)
+    otp_code: Mapped[str] = mapped_column(String(10), nullable=False)
     created_at: Mapped[DateTime] = mapped_column(DateTime(), server_default=func.now())
     expires_at: Mapped[DateTime] = mapped_column(DateTime(), nullable=False)
-    is_used: Mapped[bool] = mapped_column(Boolean(), default=False, index=True)
+    is_used: Mapped[bool] = mapped_column(Boolean(), default=False)
 
     user: Mapped["User"] = relationship(back_populates="otps")
-    client: Mapped["Client"] = relationship(back_populates="otps")
\ No newline at end of file
+    client: Mapped["Client"] = relationship(back_populates="otps")
+    delivery: Mapped[Optional["OTPDelivery"]] = relationship(
+        back_populates="otp", cascade="all, delete-orphan"
+    )
+
+
+class DeliveryStatus(enum.Enum):
+    PENDING = "PENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
+
+
+class OTPDelivery(Base):
+    __tablename__ = "otp_deliveries"
+    __table_args__ = (
+        Index("ix_otp_deliveries_due", "next_attempt_at", postgresql_where=text("status = 'PENDING'")),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    otp_id: Mapped[int] = mapped_column(ForeignKey("otps.id", ondelete="CASCADE"), unique=True, nullable=False)
+    status: Mapped[DeliveryStatus] = mapped_column(Enum(DeliveryStatus, name="delivery_status"), server_default=DeliveryStatus.PENDING.name)
+    attempts: Mapped[int] = mapped_column(Integer(), server_default="0", nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(Text(), nullable=True)
+    next_attempt_at: Mapped[DateTime] = mapped_column(DateTime(), nullable=False)
+    created_at: Mapped[DateTime] = mapped_column(DateTime(), server_default=func.now())
+    updated_at: Mapped[DateTime] = mapped_column(DateTime(), nullable=True, server_onupdate=func.now())
+
+    otp: Mapped["OTP"] = relationship(back_populates="delivery")
\ No newline at end of file
@@ -0,0 +1,373 @@
+"""
+Time-based range partitioning of the otps table on created_at.
+
+Partitioning is optional (OTP_PARTITION_INTERVAL=daily|hourly). Converting the
+table is a one-off, locking operation meant for a maintenance window; migration
+0007 does it when the interval is set at upgrade time, and the app refuses to
+start while the interval is set on an unconverted table. To enable partitioning
+on a database that is already past 0007::
+
+    python -m src.database.partitions convert
+    python -m src.database.partitions maintain
+
+``maintain`` (also run periodically by the app) creates upcoming partitions and
+detaches and drops (optionally archiving to gzipped CSV first) partitions older
+than OTP_RETENTION_HOURS. Dropping a partition is far cheaper than DELETEs.
+Rows that land in the default partition because maintenance fell behind are
+moved into their partition when it is created, and deleted from it once they
+are past retention.
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..config import settings
+from .core import engine
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "otps"
+LEGACY_PARTITION = "otps_legacy"
+DEFAULT_PARTITION = "otps_default"
+
+# Only one worker runs maintenance at a time; the others skip the round
+MAINTENANCE_LOCK_ID = 4_815_162_343
+
+_INTERVALS = {
+    "daily": (timedelta(days=1), "%Y%m%d"),
+    "hourly": (timedelta(hours=1), "%Y%m%d%H"),
+}
+_BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+_maintenance_task: Optional[asyncio.Task] = None
+
+
+def period_start(moment: datetime, interval: str) -> datetime:
+    if interval == "hourly":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(start: datetime, interval: str) -> str:
+    return f"{PARENT_TABLE}_p{start.strftime(_INTERVALS[interval][1])}"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    value = value.strip("'")
+    if value.upper() == "MINVALUE":
+        return None
+    return datetime.fromisoformat(value)
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    relkind = await conn.scalar(text(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"
+    ), {"name": PARENT_TABLE})
+    return relkind == "p"
+
+
+async def list_partitions(conn: AsyncConnection) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """
+    Lists the range partitions of otps with their bounds.
+
+    :return: List of (name, lower bound or None for MINVALUE, upper bound) ordered
+        by upper bound. The default partition is not included.
+    """
+    result = await conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:name)"
+    ), {"name": PARENT_TABLE})
+
+    partitions = []
+    for name, bound in result:
+        match = _BOUND_PATTERN.search(bound)
+        if match is None:
+            continue
+        partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+
+    partitions.sort(key=lambda p: p[2])
+    return partitions
+
+
+async def convert_to_partitioned(conn: AsyncConnection, interval: str) -> None:
+    """
+    Turns the plain otps table into a range-partitioned one.
+
+    The existing table is kept as-is and attached as the otps_legacy partition
+    covering everything up to the end of the current period, so no rows are
+    copied. It is dropped by retention like any other partition. Postgres cannot
+    enforce a foreign key to a partitioned table through id alone, so the
+    otp_deliveries -> otps constraint is dropped.
+
+    Runs in the caller's transaction and takes ACCESS EXCLUSIVE locks.
+    """
+    if await is_partitioned(conn):
+        raise RuntimeError("otps is already partitioned")
+
+    now = await conn.scalar(text("SELECT localtimestamp"))
+    step = _INTERVALS[interval][0]
+    legacy_upper = period_start(now, interval) + step
+
+    statements = [
+        "ALTER TABLE otp_deliveries DROP CONSTRAINT IF EXISTS otp_deliveries_otp_id_fkey",
+        f"ALTER TABLE otps RENAME TO {LEGACY_PARTITION}",
+        f"ALTER TABLE {LEGACY_PARTITION} RENAME CONSTRAINT otps_pkey TO {LEGACY_PARTITION}_pkey",
+        f"ALTER INDEX IF EXISTS ix_otps_user_client_code RENAME TO {LEGACY_PARTITION}_user_client_code_idx",
+        f"ALTER INDEX IF EXISTS ix_otps_active RENAME TO {LEGACY_PARTITION}_active_idx",
+        """
+        CREATE TABLE otps (
+            id INTEGER NOT NULL DEFAULT nextval('otps_id_seq'),
+            user_id INTEGER NOT NULL,
+            client_id INTEGER NOT NULL,
+            otp_code VARCHAR(10) NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL,
+            expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            is_used BOOLEAN NOT NULL,
+            PRIMARY KEY (id, created_at),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+        """,
+        "ALTER SEQUENCE otps_id_seq OWNED BY otps.id",
+        "CREATE INDEX ix_otps_user_client_code ON otps (user_id, client_id, otp_code)",
+        "CREATE INDEX ix_otps_active ON otps (user_id, client_id, expires_at) WHERE NOT is_used",
+        f"ALTER TABLE otps ATTACH PARTITION {LEGACY_PARTITION} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{legacy_upper.isoformat(sep=' ')}')",
+        # Safety net so inserts never fail if maintenance falls behind
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF otps DEFAULT",
+    ]
+    for statement in statements:
+        await conn.exec_driver_sql(statement)
+
+
+async def ensure_partitions(conn: AsyncConnection, interval: str, ahead: int) -> List[str]:
+    """
+    Creates the partitions for the current period and the next `ahead` ones.
+
+    :return: List[str] - Names of the partitions that were created.
+    """
+    now = await conn.scalar(text("SELECT localtimestamp"))
+    step = _INTERVALS[interval][0]
+    existing = await list_partitions(conn)
+
+    created = []
+    start = period_start(now, interval)
+    for _ in range(ahead + 1):
+        end = start + step
+        overlaps = any(
+            (lower is None or lower < end) and start < upper
+            for _, lower, upper in existing
+        )
+        if not overlaps:
+            name = partition_name(start, interval)
+            await _create_partition(conn, name, start, end)
+            created.append(name)
+        start = end
+
+    return created
+
+
+async def _default_has_rows(conn: AsyncConnection, start: Optional[datetime], end: datetime) -> bool:
+    if await conn.scalar(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}) is None:
+        return False
+    return await conn.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        "WHERE (CAST(:start AS timestamp) IS NULL OR created_at >= :start) AND created_at < :end)"
+    ), {"start": start, "end": end})
+
+
+async def _create_partition(conn: AsyncConnection, name: str, start: datetime, end: datetime) -> None:
+    """
+    Creates the partition for [start, end).
+
+    Postgres refuses to create a partition while the default partition holds
+    rows in its range, so those rows are moved: the default partition is
+    detached, the new partition created and filled from it, and the default
+    attached again, all in one transaction.
+    """
+    bounds = f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+    if not await _default_has_rows(conn, start, end):
+        await conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF otps {bounds}")
+        return
+
+    # The maintenance connection is in autocommit mode, so move on a transactional one
+    async with engine.begin() as tx:
+        await tx.exec_driver_sql(f"ALTER TABLE otps DETACH PARTITION {DEFAULT_PARTITION}")
+        await tx.exec_driver_sql(f"CREATE TABLE {name} PARTITION OF otps {bounds}")
+        moved = await tx.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), {"start": start, "end": end})
+        await tx.exec_driver_sql(f"ALTER TABLE otps ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    logger.info("Moved %d rows from %s to %s", moved.rowcount, DEFAULT_PARTITION, name)
+
+
+async def archive_partition(
+    conn: AsyncConnection, name: str, archive_dir: str, before: Optional[datetime] = None
+) -> str:
+    """
+    Streams a partition, or only its rows created before `before`, to a gzipped
+    CSV file with COPY.
+
+    :return: str - Path of the archive file.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    suffix = "" if before is None else f"_before_{before.strftime('%Y%m%d%H%M%S')}"
+    path = os.path.join(archive_dir, f"{name}{suffix}.csv.gz")
+
+    raw = await conn.get_raw_connection()
+    with gzip.open(path, "wb") as archive:
+        async def write(chunk: bytes) -> None:
+            await asyncio.to_thread(archive.write, chunk)
+
+        if before is None:
+            await raw.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+        else:
+            await raw.driver_connection.copy_from_query(
+                f"SELECT * FROM {name} WHERE created_at < $1", before,
+                output=write, format="csv", header=True
+            )
+
+    return path
+
+
+async def drop_expired_partitions(
+    conn: AsyncConnection, retention: timedelta, archive_dir: Optional[str] = None
+) -> List[str]:
+    """
+    Detaches and drops partitions whose whole range is older than the retention
+    window, and deletes expired rows from the default partition.
+
+    :return: List[str] - Names of the dropped partitions.
+    """
+    now = await conn.scalar(text("SELECT localtimestamp"))
+    cutoff = now - retention
+
+    dropped = []
+    for name, _, upper in await list_partitions(conn):
+        if upper is None or upper > cutoff:
+            continue
+
+        if archive_dir:
+            path = await archive_partition(conn, name, archive_dir)
+            logger.info("Archived partition %s to %s", name, path)
+
+        await conn.exec_driver_sql(f"ALTER TABLE otps DETACH PARTITION {name}")
+        await conn.exec_driver_sql(f"DROP TABLE {name}")
+        dropped.append(name)
+
+    # Stragglers in the default partition are few, a DELETE is fine for them
+    if await _default_has_rows(conn, None, cutoff):
+        if archive_dir:
+            path = await archive_partition(conn, DEFAULT_PARTITION, archive_dir, before=cutoff)
+            logger.info("Archived expired rows of %s to %s", DEFAULT_PARTITION, path)
+        expired = await conn.execute(
+            text(f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff"), {"cutoff": cutoff}
+        )
+        logger.info("Deleted %d expired rows from %s", expired.rowcount, DEFAULT_PARTITION)
+
+    if dropped:
+        # Deliveries are no longer tied to otps by a foreign key, expire them too
+        await conn.execute(
+            text("DELETE FROM otp_deliveries WHERE created_at < :cutoff"), {"cutoff": cutoff}
+        )
+
+    return dropped
+
+
+async def run_maintenance() -> None:
+    """Creates upcoming partitions and applies retention, if this worker wins the lock."""
+    interval = settings.otp_partition_interval
+    if interval == "none":
+        return
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not await conn.scalar(text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}):
+            return
+
+        try:
+            if not await is_partitioned(conn):
+                logger.warning("OTP_PARTITION_INTERVAL is %s but otps is not partitioned", interval)
+                return
+
+            created = await ensure_partitions(conn, interval, settings.otp_partitions_ahead)
+            dropped = await drop_expired_partitions(
+                conn, timedelta(hours=settings.otp_retention_hours), settings.otp_archive_dir
+            )
+            if created or dropped:
+                logger.info("Partition maintenance: created %s, dropped %s", created, dropped)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+
+
+async def _maintenance_loop() -> None:
+    while True:
+        try:
+            await run_maintenance()
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        await asyncio.sleep(settings.otp_maintenance_interval)
+
+
+def start_partition_maintenance() -> None:
+    global _maintenance_task
+
+    if settings.otp_partition_interval != "none" and _maintenance_task is None:
+        _maintenance_task = asyncio.create_task(_maintenance_loop())
+
+
+async def stop_partition_maintenance() -> None:
+    global _maintenance_task
+
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
+
+
+async def _main(args: argparse.Namespace) -> None:
+    interval = settings.otp_partition_interval
+    try:
+        if args.command == "convert":
+            if interval == "none":
+                raise SystemExit("Set OTP_PARTITION_INTERVAL to daily or hourly first")
+            async with engine.begin() as conn:
+                await convert_to_partitioned(conn, interval)
+            print(f"otps is now partitioned {interval}")
+            await run_maintenance()
+        elif args.command == "maintain":
+            await run_maintenance()
+        elif args.command == "list":
+            async with engine.connect() as conn:
+                for name, lower, upper in await list_partitions(conn):
+                    print(f"{name}: {lower or 'MINVALUE'} -> {upper}")
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.database.partitions", description="OTP table partitioning")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("convert", help="Convert otps to a partitioned table (takes exclusive locks)")
+    subparsers.add_parser("maintain", help="Create upcoming partitions and apply retention")
+    subparsers.add_parser("list", help="List otps partitions and their bounds")
+
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
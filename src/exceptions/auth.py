@@ -0,0 +1,3 @@
+class PasswordHasherBusyError(Exception):
+    """Raised when the password hashing pool and its queue are full."""
+    pass
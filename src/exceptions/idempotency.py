@@ -0,0 +1,7 @@
+class IdempotencyKeyReusedError(Exception):
+    """Raised when an Idempotency-Key is replayed with a different request."""
+    pass
+
+class IdempotencyInProgressError(Exception):
+    """Raised when another worker is still processing a request with the same Idempotency-Key."""
+    pass
@@ -16,4 +16,12 @@ class InvalidOTPError(OTPVerificationError):
 
 class ClientValidationError(OTPVerificationError):
     """Raised when client validation fails."""
-    pass
\ No newline at end of file
+    pass
+
+class OTPRateLimitError(Exception):
+    """Raised when an OTP send is refused by a rate limit."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {scope}")
+        self.scope = scope
+        self.retry_after = retry_after
\ No newline at end of file
@@ -0,0 +1,3 @@
+class InvalidPhoneNumberError(ValueError):
+    """Raised when a phone number cannot be brought to E.164 form."""
+    pass
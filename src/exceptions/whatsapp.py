@@ -0,0 +1,17 @@
+from typing import Optional
+
+
+class WhatsAppSendError(Exception):
+    """Raised when the Graph API does not accept a message."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class WhatsAppUnavailableError(WhatsAppSendError):
+    """Raised without calling the Graph API while a sender's circuit breaker is open."""
+
+    def __init__(self, phone_number_id: str, retry_after: float):
+        super().__init__(f"WhatsApp sending is paused for {phone_number_id}, the number is throttled or failing")
+        self.phone_number_id = phone_number_id
+        self.retry_after = retry_after
@@ -8,6 +8,7 @@ from src.services.business import add_business
 from src.schemas.admin import AdminCreateRequest, AdminCreateResponse
 from src.schemas.business import BusinessCreateRequest, BusinessCreateResponse
 from src.config import settings
+from src.exceptions.auth import PasswordHasherBusyError
 from src.utils.auth import get_current_admin
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
@@ -24,6 +25,8 @@ async def register_admin(
     try:
         new_admin: Admin = await add_admin(session, admin.email, admin.password)
         return AdminCreateResponse(email=new_admin.email, created_at=new_admin.created_at)
+    except PasswordHasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except ValueError as e:
         raise HTTPException(status_code=409, detail=str(e))
     
@@ -1,8 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_session
-from src.schemas.client import ClientCreateRequest, ClientCreateResponse
-from src.services.client import create_client_to_business
+from src.schemas.client import (
+    ClientCreateRequest,
+    ClientCreateResponse,
+    ClientStatelessOTPRequest,
+    ClientStatelessOTPResponse,
+)
+from src.services.client import create_client_to_business, set_client_stateless_otp
+from src.utils.auth import get_current_admin
 
 
 router = APIRouter(prefix="/api/v1/business", tags=["business"])
@@ -14,14 +20,37 @@ async def create_client(
     session: AsyncSession = Depends(get_session)
 ):
     try:
-        new_client = await create_client_to_business(session, id, client.name, client.scopes)
+        new_client = await create_client_to_business(
+            session, id, client.name, client.scopes, stateless_otp=client.stateless_otp
+        )
         return ClientCreateResponse(
             id=new_client.id,
             name=new_client.name,
             business_id=new_client.business_id,
             scopes=new_client.scopes,
             api_key=new_client.api_key,
+            stateless_otp=new_client.otp_secret is not None,
             created_at=new_client.created_at
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.put("/{id}/clients/{client_id}/stateless-otp", response_model=ClientStatelessOTPResponse)
+async def update_client_stateless_otp(
+    id: int,
+    client_id: int,
+    request: ClientStatelessOTPRequest,
+    session: AsyncSession = Depends(get_session),
+    admin = Depends(get_current_admin)
+):
+    try:
+        client = await set_client_stateless_otp(session, admin.id, id, client_id, request.enabled)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return ClientStatelessOTPResponse(
+        id=client.id,
+        business_id=client.business_id,
+        stateless_otp=client.otp_secret is not None
+    )
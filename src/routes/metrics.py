@@ -0,0 +1,9 @@
+from fastapi import APIRouter, Response
+
+from src.utils.metrics import CONTENT_TYPE_LATEST, render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
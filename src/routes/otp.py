@@ -1,35 +1,130 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+import math
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import settings
 from src.database import get_session
-from src.database.models import UserStatus
 from src.schemas.otp import *
 from src.services.otp import *
 from src.exceptions.otp import *
+from src.exceptions.idempotency import IdempotencyInProgressError, IdempotencyKeyReusedError
+from src.exceptions.whatsapp import WhatsAppUnavailableError
+from src.services.idempotency import IdempotentResponse, idempotent, request_fingerprint, scoped_key
 
 router = APIRouter(prefix="/api/v1/otp", tags=["OTP"])
 
-@router.post("/send", response_model=OTPSendResponse, status_code=201)
+
+def rate_limited(error: OTPRateLimitError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
+
+def whatsapp_unavailable(error: WhatsAppUnavailableError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
+
+@router.post(
+    "/send",
+    response_model=OTPSendResponse,
+    status_code=201,
+    responses={202: {"model": OTPSendResponse, "description": "OTP queued for delivery (outbox mode)"}}
+)
 async def send_otp_handler(
     request: OTPSendRequest,
+    response: Response,
     x_api_key: str = Header(...),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
     session: AsyncSession = Depends(get_session)
 ):
-    try:
+    fingerprint = request_fingerprint(request.phone_number, request.length)
+
+    async def send() -> IdempotentResponse:
         otp_record = await OTPService.send_otp(
             session, 
             x_api_key, 
             request.phone_number, 
             request.length
         )
-        return OTPSendResponse(
+
+        # Outbox mode only queues the message, delivery happens in the dispatchers
+        if settings.otp_delivery_mode == "outbox":
+            body = OTPSendResponse(
+                message="OTP queued for delivery",
+                otp_id=otp_record.id,
+                expires_at=otp_record.expires_at
+            )
+            return IdempotentResponse(fingerprint, 202, body.model_dump(mode="json"))
+
+        body = OTPSendResponse(
             message="OTP sent successfully",
             otp_id=otp_record.id,
             expires_at=otp_record.expires_at
         )
+        return IdempotentResponse(fingerprint, 201, body.model_dump(mode="json"))
+
+    try:
+        # Repeats of a key within the window get the original response, no new code
+        if idempotency_key is not None and settings.idempotency_backend != "none":
+            result, replayed = await idempotent(scoped_key(x_api_key, idempotency_key), fingerprint, send)
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+        else:
+            result = await send()
+    except OTPRateLimitError as e:
+        raise rate_limited(e)
+    except WhatsAppUnavailableError as e:
+        raise whatsapp_unavailable(e)
+    except IdempotencyKeyReusedError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    response.status_code = result.status_code
+    return OTPSendResponse(**result.body)
+
+
+@router.post("/send/batch", response_model=OTPBatchSendResponse)
+async def send_otp_batch_handler(
+    request: OTPBatchSendRequest,
+    x_api_key: str = Header(...),
+    session: AsyncSession = Depends(get_session)
+):
+    try:
+        results = await OTPService.send_otp_batch(
+            session,
+            x_api_key,
+            request.phone_numbers,
+            request.length
+        )
+    except OTPRateLimitError as e:
+        raise rate_limited(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    items = [
+        OTPBatchItemResult(
+            phone_number=result.phone_number,
+            success=result.error is None,
+            otp_id=result.otp_id,
+            expires_at=result.expires_at,
+            error=result.error
+        )
+        for result in results
+    ]
+    sent = sum(item.success for item in items)
+    return OTPBatchSendResponse(sent=sent, failed=len(items) - sent, results=items)
+
 
 @router.post("/verify", tags=["OTP"], response_model=OTPVerifyResponse)
 async def verify_otp_handler(
@@ -44,13 +139,14 @@ async def verify_otp_handler(
         except Exception as e:
             raise ClientValidationError("Invalid client or API key") from e
             
-        # Verify OTP with detailed error tracking
+        # Consume the OTP and verify the user in a single statement
         try:
-            otp = await OTPService.verify_otp(
+            await OTPService.verify_otp(
                 session,
                 request.phone_number,
                 request.otp_code,
-                client
+                client,
+                otp_id=request.otp_id
             )
         except OTPExpiredError as e:
             raise HTTPException(status_code=400, detail="OTP has expired. Please request a new one.")
@@ -58,17 +154,8 @@ async def verify_otp_handler(
             raise HTTPException(status_code=400, detail="OTP has already been used.")
         except InvalidOTPError as e:
             raise HTTPException(status_code=400, detail="Invalid OTP or phone number.")
-            
-        # Update statuses - avoid nested transaction with async with
-        await OTPService.update_otp_status(session, otp.otp_code, True)
-        await session.execute(
-            update(User)
-            .where(User.id == otp.user_id)
-            .values(status=UserStatus.VERIFIED)
-        )
-        
-        # Commit changes
-        await session.commit()
+        except OTPRateLimitError as e:
+            raise rate_limited(e)
         
         return OTPVerifyResponse(message="OTP verified successfully")
         
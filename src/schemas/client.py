@@ -4,6 +4,7 @@ from datetime import datetime
 class ClientCreateRequest(BaseModel):
     name: str
     scopes: str 
+    stateless_otp: bool = False
 
 class ClientCreateResponse(BaseModel):
     id: int
@@ -11,7 +12,18 @@ class ClientCreateResponse(BaseModel):
     business_id: int
     scopes: str
     api_key: str
+    stateless_otp: bool = False
     created_at: datetime
 
     class Config:
         from_attributes = True
+
+
+class ClientStatelessOTPRequest(BaseModel):
+    enabled: bool
+
+
+class ClientStatelessOTPResponse(BaseModel):
+    id: int
+    business_id: int
+    stateless_otp: bool
@@ -1,15 +1,22 @@
-from pydantic import BaseModel, Field
+from pydantic import AfterValidator, BaseModel, Field, model_validator
 from datetime import datetime
-from typing import Literal
+from typing import Annotated, List, Literal, Optional
+
+from src.utils.phone import normalize_phone_number
+
+MAX_BATCH_SIZE = 500
+
+# Accepted with separators and with or without the +; handlers get E.164
+PhoneNumber = Annotated[str, Field(min_length=4, max_length=32), AfterValidator(normalize_phone_number)]
 
 class OTPSendRequest(BaseModel):
-    phone_number: str = Field(..., min_length=10, max_length=15, pattern=r"^\+?\d+$")
+    phone_number: PhoneNumber
     length: int = Field(6, ge=4, le=10)
     
     class Config:
         schema_extra = {
             "example": {
-                "phone_number": "+1234567890",
+                "phone_number": "+14155550123",
                 "length": 6
             }
         }
@@ -27,17 +34,55 @@ class OTPSendResponse(BaseModel):
                 "expires_at": "2022-01-01T00:00:00"
             }
         }
+
+class OTPBatchSendRequest(BaseModel):
+    phone_numbers: List[PhoneNumber] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+    length: int = Field(6, ge=4, le=10)
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "phone_numbers": ["+14155550123", "+447700900123"],
+                "length": 6
+            }
+        }
+
+class OTPBatchItemResult(BaseModel):
+    phone_number: str
+    success: bool
+    otp_id: Optional[int] = None
+    expires_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class OTPBatchSendResponse(BaseModel):
+    sent: int
+    failed: int
+    results: List[OTPBatchItemResult]
         
 class OTPVerifyRequest(BaseModel):
-    phone_number: str = Field(..., min_length=10, max_length=15, pattern=r"^\+?\d+$")
+    phone_number: Optional[PhoneNumber] = None
+    # Stateless otp_ids (time step * 100 + length) do not fit in int4, so allow int8
+    otp_id: Optional[int] = Field(None, ge=1, le=2 ** 63 - 1)
     otp_code: str = Field(..., min_length=4, max_length=10)
     
+    @model_validator(mode="after")
+    def check_identifier(self) -> "OTPVerifyRequest":
+        if self.otp_id is None and self.phone_number is None:
+            raise ValueError("Either otp_id or phone_number is required")
+        return self
+    
     class Config:
         schema_extra = {
-            "example": {
-                "phone_number": "+1234567890",
-                "otp_code": "1234"
-            }
+            "examples": [
+                {
+                    "otp_id": 1,
+                    "otp_code": "1234"
+                },
+                {
+                    "phone_number": "+14155550123",
+                    "otp_code": "1234"
+                }
+            ]
         }
         
 class OTPVerifyResponse(BaseModel):
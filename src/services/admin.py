@@ -1,11 +1,9 @@
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from passlib.context import CryptContext
-from sqlalchemy import select
+from sqlalchemy import select, update
 from typing import Optional
 from src.database.models import Admin
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from src.utils.passwords import hash_password
 
 async def add_admin(session: AsyncSession, email: str, password: str) -> Admin:
     """
@@ -16,8 +14,9 @@ async def add_admin(session: AsyncSession, email: str, password: str) -> Admin:
     :param password: str - Plaintext password (hashed before storing).
     :return: Admin - The created admin instance.
     :raises ValueError: If the email is already registered.
+    :raises PasswordHasherBusyError: If the password hashing pool is saturated.
     """
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await hash_password(password)
     admin = Admin(email=email, password=hashed_password)
     session.add(admin)
 
@@ -44,3 +43,33 @@ async def get_admin(session: AsyncSession, email: str) -> Optional[Admin]:
     stmt = select(Admin).where(Admin.email == email)
     result = await session.execute(stmt)
     return result.scalar_one_or_none()
+
+async def get_admin_token_version(session: AsyncSession, admin_id: int) -> Optional[int]:
+    """
+    Fetches the current token version of an admin.
+
+    :param session: AsyncSession - SQLAlchemy session.
+    :param admin_id: int - Admin ID.
+    :return: Optional[int] - The token version, or None if the admin no longer exists.
+    """
+    stmt = select(Admin.token_version).where(Admin.id == admin_id)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+async def revoke_admin_tokens(session: AsyncSession, admin_id: int) -> Optional[int]:
+    """
+    Revokes every token issued to an admin so far by bumping its token version.
+
+    :param session: AsyncSession - SQLAlchemy session.
+    :param admin_id: int - Admin ID.
+    :return: Optional[int] - The new token version, or None if the admin does not exist.
+    """
+    stmt = (
+        update(Admin)
+        .where(Admin.id == admin_id)
+        .values(token_version=Admin.token_version + 1)
+        .returning(Admin.token_version)
+    )
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.scalar_one_or_none()
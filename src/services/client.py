@@ -1,18 +1,101 @@
 import secrets
+from dataclasses import dataclass
+from typing import Optional
 
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import joinedload
 
+from src.config import settings
 from src.database.models import Client, Business
+from src.utils.cache import TTLCache
+
+
+@dataclass(frozen=True)
+class ClientCredentials:
+    """Everything the OTP hot path needs about a client, detached from any session."""
+    id: int
+    business_id: int
+    scopes: str
+    phone_number_id: Optional[str]
+    whatsapp_api_token: Optional[str]
+    otp_secret: Optional[str] = None
+
+
+# Resolved credentials and known-unknown keys are cached separately so that a
+# flood of guessed keys cannot evict real clients from the positive cache.
+_credentials_cache: TTLCache[str, ClientCredentials] = TTLCache(
+    settings.client_cache_size, settings.client_cache_ttl
+)
+_unknown_keys_cache: TTLCache[str, bool] = TTLCache(
+    settings.client_cache_negative_size, settings.client_cache_negative_ttl
+)
 
 
 def generate_api_key() -> str:
     return secrets.token_hex(32)
 
 
-async def create_client_to_business(session: AsyncSession, business_id: int, name: str, scopes: str) -> Client:
+def generate_otp_secret() -> str:
+    return secrets.token_hex(32)
+
+
+def invalidate_client_cache(*api_keys: str) -> None:
+    """Drops cached credentials (and negative entries) for the given API keys."""
+    for api_key in api_keys:
+        _credentials_cache.pop(api_key)
+        _unknown_keys_cache.pop(api_key)
+
+
+async def resolve_client_credentials(session: AsyncSession, api_key: str) -> Optional[ClientCredentials]:
+    """
+    Resolves an API key to client and business credentials, using the in-process cache.
+
+    :param session: AsyncSession - SQLAlchemy session.
+    :param api_key: str - Client API key.
+    :return: Optional[ClientCredentials] - The credentials, or None if the key is unknown.
+    """
+    credentials = _credentials_cache.get(api_key)
+    if credentials is not None:
+        return credentials
+
+    if _unknown_keys_cache.get(api_key):
+        return None
+
+    result = await session.execute(
+        select(
+            Client.id,
+            Client.business_id,
+            Client.scopes,
+            Client.otp_secret,
+            Business.phone_number_id,
+            Business.whatsapp_api_token
+        )
+        .outerjoin(Business, Business.id == Client.business_id)
+        .where(Client.api_key == api_key)
+    )
+    row = result.one_or_none()
+
+    if row is None:
+        _unknown_keys_cache.set(api_key, True)
+        return None
+
+    credentials = ClientCredentials(
+        id=row.id,
+        business_id=row.business_id,
+        scopes=row.scopes,
+        phone_number_id=row.phone_number_id,
+        whatsapp_api_token=row.whatsapp_api_token,
+        otp_secret=row.otp_secret
+    )
+    _credentials_cache.set(api_key, credentials)
+    return credentials
+
+
+async def create_client_to_business(
+    session: AsyncSession, business_id: int, name: str, scopes: str, stateless_otp: bool = False
+) -> Client:
     # Check if the business exists
     stmt = select(Business).where(Business.id == business_id)
     result = await session.execute(stmt)
@@ -23,12 +106,14 @@ async def create_client_to_business(session: AsyncSession, business_id: int, nam
 
     # Generate API key
     api_key = generate_api_key()
-    new_client = Client(business_id=business_id, name=name, scopes=scopes, api_key=api_key)
+    otp_secret = generate_otp_secret() if stateless_otp else None
+    new_client = Client(business_id=business_id, name=name, scopes=scopes, api_key=api_key, otp_secret=otp_secret)
     session.add(new_client)
 
     try:
         await session.commit()
         await session.refresh(new_client)
+        invalidate_client_cache(api_key)
         return new_client
 
     except IntegrityError as e:
@@ -71,17 +156,50 @@ async def update_client(session: AsyncSession, client_id: int, scopes: str, api_
     if client is None:
         raise ValueError("Client not found.")
 
+    old_api_key = client.api_key
     client.scopes = scopes
     client.api_key = api_key
 
     try:
         await session.commit()
+        invalidate_client_cache(old_api_key, api_key)
         return client
     except IntegrityError:
         await session.rollback()
         raise ValueError("Error updating client.")
 
 
+async def set_client_stateless_otp(
+    session: AsyncSession, admin_id: int, business_id: int, client_id: int, enabled: bool
+) -> Client:
+    """
+    Opts a client in or out of stateless OTPs. Enabling always issues a new
+    secret, which invalidates codes derived from the previous one.
+
+    :param session: AsyncSession - SQLAlchemy session.
+    :param admin_id: int - Admin making the change; must own the business.
+    :param business_id: int - Business the client belongs to.
+    :param client_id: int - Client ID.
+    :param enabled: bool - Whether the client uses stateless OTPs.
+    :return: Client - The updated client.
+    :raises ValueError: If the client does not exist or the business is not the admin's.
+    """
+    result = await session.execute(
+        select(Client)
+        .join(Business, Business.id == Client.business_id)
+        .filter(Client.id == client_id, Client.business_id == business_id, Business.admin_id == admin_id)
+    )
+    client = result.scalar_one_or_none()
+
+    if client is None:
+        raise ValueError("Client not found.")
+
+    client.otp_secret = generate_otp_secret() if enabled else None
+    await session.commit()
+    invalidate_client_cache(client.api_key)
+    return client
+
+
 async def delete_client(session: AsyncSession, client_id: int) -> bool:
     result = await session.execute(select(Client).filter(Client.id == client_id))
     client = result.scalar_one_or_none()
@@ -89,6 +207,8 @@ async def delete_client(session: AsyncSession, client_id: int) -> bool:
     if client is None:
         raise ValueError("Client not found.")
 
+    api_key = client.api_key
     await session.delete(client)
     await session.commit()
+    invalidate_client_cache(api_key)
     return True
@@ -0,0 +1,204 @@
+"""
+Idempotency-Key support for OTP sends.
+
+The first request with a given key runs; its successful response is stored for
+IDEMPOTENCY_TTL seconds and returned to every repeat. Duplicates arriving while
+the first one is still running wait for it instead of sending another message:
+in-process through a shared future, across workers (redis backend) through a
+pending marker that the other workers poll. Failed requests are not stored, so
+the client can retry them.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.config import settings
+from src.exceptions.idempotency import IdempotencyInProgressError, IdempotencyKeyReusedError
+from src.utils.cache import TTLCache
+from src.utils.redis import start_redis
+
+
+@dataclass(frozen=True)
+class IdempotentResponse:
+    fingerprint: str
+    status_code: int
+    body: Dict[str, Any]
+
+
+def request_fingerprint(*parts: Any) -> str:
+    return hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()
+
+
+def scoped_key(api_key: str, idempotency_key: str) -> str:
+    """Keys are per client, so two clients can use the same key independently."""
+    return f"{hashlib.sha256(api_key.encode()).hexdigest()[:32]}:{idempotency_key}"
+
+
+class IdempotencyStore(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Optional[IdempotentResponse]:
+        """The stored response, or None if there is none (or it is still pending)."""
+
+    @abstractmethod
+    async def reserve(self, key: str) -> bool:
+        """Marks the key as in progress; False if another request already holds or completed it."""
+
+    @abstractmethod
+    async def save(self, key: str, response: IdempotentResponse) -> None:
+        """Stores the response for IDEMPOTENCY_TTL seconds."""
+
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        """Drops the in-progress marker after a failed request."""
+
+    async def start(self) -> None:
+        pass
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Per-process; in-flight duplicates are already coalesced by idempotent()
+    itself. It only guarantees anything with a single worker, so main.py keeps
+    the app on one worker while this backend is configured.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._responses: TTLCache[str, IdempotentResponse] = TTLCache(max_entries, ttl)
+
+    async def get(self, key: str) -> Optional[IdempotentResponse]:
+        return self._responses.get(key)
+
+    async def reserve(self, key: str) -> bool:
+        return self._responses.get(key) is None
+
+    async def save(self, key: str, response: IdempotentResponse) -> None:
+        self._responses.set(key, response)
+
+    async def release(self, key: str) -> None:
+        pass
+
+
+class RedisIdempotencyStore(IdempotencyStore):
+    PREFIX = "idem:"
+    PENDING = "pending"
+
+    def __init__(self, ttl: int, pending_ttl: int):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self._redis = None
+
+    async def start(self) -> None:
+        self._redis = await start_redis()
+
+    async def get(self, key: str) -> Optional[IdempotentResponse]:
+        value = await self._redis.get(self.PREFIX + key)
+        if value is None or value == self.PENDING:
+            return None
+        return IdempotentResponse(**json.loads(value))
+
+    async def reserve(self, key: str) -> bool:
+        # The pending marker expires on its own if the worker dies mid-request
+        return bool(await self._redis.set(self.PREFIX + key, self.PENDING, nx=True, ex=self.pending_ttl))
+
+    async def save(self, key: str, response: IdempotentResponse) -> None:
+        await self._redis.set(self.PREFIX + key, json.dumps(asdict(response)), ex=self.ttl)
+
+    async def release(self, key: str) -> None:
+        await self._redis.delete(self.PREFIX + key)
+
+
+# Requests currently running in this process, by scoped key
+_in_flight: Dict[str, "asyncio.Future[IdempotentResponse]"] = {}
+
+_store: Optional[IdempotencyStore] = None
+
+
+def _check(response: IdempotentResponse, fingerprint: str) -> IdempotentResponse:
+    if response.fingerprint != fingerprint:
+        raise IdempotencyKeyReusedError("Idempotency-Key was already used for a different request")
+    return response
+
+
+async def _wait_for_other_worker(store: IdempotencyStore, key: str) -> IdempotentResponse:
+    deadline = time.monotonic() + settings.idempotency_wait_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        response = await store.get(key)
+        if response is not None:
+            return response
+    raise IdempotencyInProgressError("A request with this Idempotency-Key is still in progress")
+
+
+async def idempotent(
+    key: str,
+    fingerprint: str,
+    handler: Callable[[], Awaitable[IdempotentResponse]]
+) -> Tuple[IdempotentResponse, bool]:
+    """
+    Runs handler at most once per key within the TTL.
+
+    :return: Tuple[IdempotentResponse, bool] - The response and whether it was replayed.
+    :raises IdempotencyKeyReusedError: If the key was used with a different fingerprint.
+    :raises IdempotencyInProgressError: If another worker holds the key for too long.
+    """
+    pending = _in_flight.get(key)
+    if pending is not None:
+        return _check(await asyncio.shield(pending), fingerprint), True
+
+    future: "asyncio.Future[IdempotentResponse]" = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        store = get_idempotency_store()
+        stored = await store.get(key)
+        if stored is not None:
+            future.set_result(stored)
+            return _check(stored, fingerprint), True
+
+        if not await store.reserve(key):
+            response = await _wait_for_other_worker(store, key)
+            future.set_result(response)
+            return _check(response, fingerprint), True
+
+        try:
+            response = await handler()
+        except BaseException:
+            await store.release(key)
+            raise
+        await store.save(key, response)
+        future.set_result(response)
+        return response, False
+    except BaseException as e:
+        if not future.done():
+            # Duplicates waiting on this request get the same error
+            if not isinstance(e, Exception):
+                e = IdempotencyInProgressError("The original request with this Idempotency-Key was interrupted")
+            future.set_exception(e)
+            future.exception()
+        raise
+    finally:
+        _in_flight.pop(key, None)
+
+
+def create_idempotency_store() -> IdempotencyStore:
+    if settings.idempotency_backend == "redis":
+        return RedisIdempotencyStore(settings.idempotency_ttl, settings.idempotency_pending_ttl)
+    return MemoryIdempotencyStore(settings.idempotency_max_entries, settings.idempotency_ttl)
+
+
+async def start_idempotency_store() -> IdempotencyStore:
+    global _store
+
+    if _store is None:
+        _store = create_idempotency_store()
+        await _store.start()
+    return _store
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    if _store is None:
+        raise RuntimeError("Idempotency store is not started. Call start_idempotency_store() first.")
+    return _store
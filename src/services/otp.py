@@ -1,21 +1,30 @@
+import asyncio
 import random
-from typing import Optional
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 
 from sqlalchemy import update
-from sqlalchemy.orm import selectinload
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from datetime import datetime, timedelta
 
-from src.database.models import OTP, Client, Business, User
+from src.config import settings
+from src.database import release_connection
+from src.database.models import OTP, Business
+from src.services import stateless_otp
+from src.services.client import ClientCredentials, resolve_client_credentials
+from src.services.otp_store import IssuedOTP, get_otp_store
+from src.services.rate_limit import get_rate_limiter, send_rules
 from src.services.wa import send_whatsapp_template
-from src.services.user import get_or_create_user
+from src.services.wa_scheduler import PRIORITY_BULK, PRIORITY_OTP
+from src.utils.metrics import OTP_EXPIRED, OTP_SENT, OTP_VERIFIED
+from src.utils.tracing import span
 from src.exceptions.otp import *
+from src.exceptions.whatsapp import WhatsAppUnavailableError
 
 
 EXPIRATION_MINUTES = 5
-MAX_OTP_ATTEMPTS = 3
 
 def generate_otp(length: int = 6) -> str:
     """
@@ -26,6 +35,15 @@ def generate_otp(length: int = 6) -> str:
     random.shuffle(digits)
     return ''.join(map(str, digits[:length]))
 
+
+@dataclass
+class BatchSendResult:
+    phone_number: str
+    otp_id: Optional[int] = None
+    expires_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+
 class OTPService:
     @staticmethod
     async def send_otp(
@@ -33,55 +51,73 @@ class OTPService:
         api_key: str, 
         phone_number: str, 
         length: int = 6
-    ) -> OTP:
+    ) -> IssuedOTP:
         """
         Comprehensive OTP sending process with detailed error handling.
         """
         try:
-            # Validate input
-            if not phone_number or len(phone_number) < 10:
+            # Validate input; the schema has already normalized it to E.164
+            if not phone_number:
                 raise ValueError("Invalid phone number")
 
-            # Validate client and business in a single query for efficiency
-            stmt = (
-                select(Client)
-                .options(selectinload(Client.business))
-                .where(Client.api_key == api_key)
-            )
-            result = await session.execute(stmt)
-            client = result.scalar_one_or_none()
+            client = await OTPService._get_client_with_business(session, api_key)
 
-            if not client:
-                raise ValueError("Invalid API key")
-            
-            if not client.business:
-                raise ValueError("No business associated with client")
+            # Rate limits are enforced before anything is stored or sent
+            await OTPService._enforce_rate_limits(client, phone_number)
+
+            if OTPService._is_stateless(client):
+                await release_connection(session)
+                return await OTPService._send_stateless_otp(client, phone_number, length)
 
             # Generate and send OTP
             otp_code = generate_otp(length)
+
+            # In outbox mode the dispatch workers deliver the message, so the
+            # request only has to commit the OTP and its pending delivery.
+            if settings.otp_delivery_mode == "outbox":
+                with span("store"):
+                    otp_record = await get_otp_store().issue(
+                        session,
+                        client.id,
+                        phone_number,
+                        otp_code,
+                        OTPService._expires_at(),
+                        enqueue_delivery=True
+                    )
+                OTP_SENT.labels(client.id).inc()
+                return otp_record
             
+            # Don't hold a pool connection while waiting on Meta
+            await release_connection(session)
+
             # Send WhatsApp message
             try:
                 await OTPService._send_otp_via_whatsapp(
                     phone_number, 
                     otp_code, 
-                    client.business.phone_number_id, 
-                    client.business.whatsapp_api_token
+                    client.phone_number_id, 
+                    client.whatsapp_api_token,
+                    business_id=client.business_id
                 )
+            except WhatsAppUnavailableError:
+                raise
             except Exception as wa_error:
                 raise ValueError(f"WhatsApp sending error: {wa_error}")
 
             # Create OTP record
-            otp_record = await OTPService._create_otp_record(
-                session, 
-                phone_number, 
-                otp_code, 
-                client.id
-            )
+            with span("store"):
+                otp_record = await get_otp_store().issue(
+                    session, 
+                    client.id,
+                    phone_number, 
+                    otp_code, 
+                    OTPService._expires_at()
+                )
+            OTP_SENT.labels(client.id).inc()
 
             return otp_record
 
-        except ValueError as ve:
+        except (ValueError, OTPRateLimitError, WhatsAppUnavailableError):
             raise
         except SQLAlchemyError as se:
             await session.rollback()
@@ -91,67 +127,215 @@ class OTPService:
             raise ValueError(f"OTP sending failed: {e}")
 
     @staticmethod
-    async def _create_otp_record(
-        session: AsyncSession, 
-        phone_number: str, 
-        otp_code: str, 
-        client_id: int
-    ) -> OTP:
+    async def send_otp_batch(
+        session: AsyncSession,
+        api_key: str,
+        phone_numbers: List[str],
+        length: int = 6
+    ) -> List[BatchSendResult]:
         """
-        Create OTP record with additional safeguards.
+        Send OTPs to many phone numbers with a single client lookup.
+
+        WhatsApp messages go out concurrently (bounded by OTP_BATCH_CONCURRENCY),
+        then the delivered codes are stored in one bulk call to the OTP store
+        (bulk statements in one transaction for the SQL store). Failures are
+        reported per item.
         """
-        try:
-            # Get or create user with a single query
-            user = await get_or_create_user(session, phone_number)
-            
-            # Check existing non-expired OTPs
-            existing_otps_count = await session.scalar(
-                select(select(OTP)
-                    .where(
-                        OTP.user_id == user.id, 
-                        OTP.client_id == client_id,
-                        OTP.expires_at > datetime.utcnow()
+        client = await OTPService._get_client_with_business(session, api_key)
+
+        results: Dict[str, BatchSendResult] = {}
+        unique_numbers: List[str] = []
+        for phone_number in phone_numbers:
+            if phone_number in results:
+                continue
+            results[phone_number] = BatchSendResult(phone_number=phone_number)
+            unique_numbers.append(phone_number)
+
+        # Each number is counted against its phone limit and the tenant limits in
+        # one acquire, so the tenant is only charged for numbers that pass
+        tenant_refusals: List[OTPRateLimitError] = []
+
+        async def allowed(phone_number: str) -> bool:
+            try:
+                await OTPService._enforce_rate_limits(client, phone_number)
+                return True
+            except OTPRateLimitError as e:
+                results[phone_number].error = str(e)
+                if e.scope != "phone":
+                    tenant_refusals.append(e)
+                return False
+
+        outcomes = await asyncio.gather(*(allowed(p) for p in unique_numbers))
+        unique_numbers = [p for p, ok in zip(unique_numbers, outcomes) if ok]
+        if not unique_numbers and tenant_refusals:
+            # Nothing goes out until the tenant window moves on; answer with a 429
+            raise min(tenant_refusals, key=lambda e: e.retry_after)
+
+        stateless = OTPService._is_stateless(client)
+        issued: Dict[str, IssuedOTP] = {}
+        if stateless:
+            codes = {}
+            for phone_number in list(unique_numbers):
+                try:
+                    otp_id, code, code_expires_at = await stateless_otp.issue(
+                        client.id, client.otp_secret, phone_number, length
                     )
-                    .exists()
+                except OTPRateLimitError as e:
+                    results[phone_number].error = str(e)
+                    unique_numbers.remove(phone_number)
+                    continue
+                codes[phone_number] = code
+                issued[phone_number] = IssuedOTP(id=otp_id, expires_at=code_expires_at)
+        else:
+            codes = {phone_number: generate_otp(length) for phone_number in unique_numbers}
+
+        if settings.otp_delivery_mode == "outbox" and not stateless:
+            delivered = unique_numbers
+        else:
+            await release_connection(session)
+            semaphore = asyncio.Semaphore(settings.otp_batch_concurrency)
+
+            async def deliver(phone_number: str) -> bool:
+                async with semaphore:
+                    try:
+                        await OTPService._send_otp_via_whatsapp(
+                            phone_number,
+                            codes[phone_number],
+                            client.phone_number_id,
+                            client.whatsapp_api_token,
+                            business_id=client.business_id,
+                            priority=PRIORITY_BULK
+                        )
+                        return True
+                    except Exception as wa_error:
+                        results[phone_number].error = f"WhatsApp sending error: {wa_error}"
+                        return False
+
+            outcomes = await asyncio.gather(*(deliver(p) for p in unique_numbers))
+            delivered = [p for p, ok in zip(unique_numbers, outcomes) if ok]
+
+        if not delivered:
+            return [results[p] for p in phone_numbers]
+
+        if stateless:
+            for p in delivered:
+                results[p].otp_id = issued[p].id
+                results[p].expires_at = issued[p].expires_at
+            OTP_SENT.labels(client.id).inc(len(delivered))
+            return [results[p] for p in phone_numbers]
+
+        expires_at = OTPService._expires_at()
+        try:
+            with span("store"):
+                issued = await get_otp_store().issue_many(
+                    session,
+                    client.id,
+                    {p: codes[p] for p in delivered},
+                    expires_at,
+                    enqueue_delivery=settings.otp_delivery_mode == "outbox"
                 )
-            )
+        except Exception as e:
+            error = f"Database error: {e}" if isinstance(e, SQLAlchemyError) else f"OTP record creation error: {e}"
+            for p in delivered:
+                results[p].error = error
+            return [results[p] for p in phone_numbers]
 
-            if existing_otps_count >= MAX_OTP_ATTEMPTS:
-                raise ValueError(f"Maximum {MAX_OTP_ATTEMPTS} active OTPs exceeded")
+        for p in delivered:
+            result = results[p]
+            result.otp_id = issued[p].id
+            result.expires_at = issued[p].expires_at
+        OTP_SENT.labels(client.id).inc(len(delivered))
 
-            # Create new OTP
-            expires_at = datetime.utcnow() + timedelta(minutes=EXPIRATION_MINUTES)
-            
-            new_otp = OTP(
-                user_id=user.id,
-                client_id=client_id,
-                otp_code=otp_code,
-                expires_at=expires_at,
-                is_used=False
+        return [results[p] for p in phone_numbers]
+
+    @staticmethod
+    async def _get_client_with_business(
+        session: AsyncSession,
+        api_key: str
+    ) -> ClientCredentials:
+        """Validate client and business in a single (cached) query for efficiency."""
+        with span("client"):
+            client = await resolve_client_credentials(session, api_key)
+
+        if not client:
+            raise ValueError("Invalid API key")
+        
+        if not client.phone_number_id:
+            raise ValueError("No business associated with client")
+        return client
+
+    @staticmethod
+    async def _enforce_rate_limits(
+        client: Optional[ClientCredentials] = None,
+        phone_number: Optional[str] = None,
+        cost: int = 1
+    ) -> None:
+        """
+        Count a send against the phone number, client and business limits.
+        Raises OTPRateLimitError without counting anything if any scope is exhausted.
+        """
+        rules = send_rules()
+        keys = []
+        if phone_number is not None and "phone" in rules:
+            keys.append((f"phone:{phone_number}", rules["phone"]))
+        if client is not None and "client" in rules:
+            keys.append((f"client:{client.id}", rules["client"]))
+        if client is not None and "business" in rules:
+            keys.append((f"business:{client.business_id}", rules["business"]))
+
+        if not keys:
+            return
+
+        with span("rate_limit"):
+            exceeded = await get_rate_limiter().acquire(keys, cost)
+        if exceeded is not None:
+            raise OTPRateLimitError(exceeded.scope, exceeded.retry_after)
+
+    @staticmethod
+    def _is_stateless(client: ClientCredentials) -> bool:
+        return settings.stateless_otp_enabled and client.otp_secret is not None
+
+    @staticmethod
+    async def _send_stateless_otp(
+        client: ClientCredentials,
+        phone_number: str,
+        length: int
+    ) -> IssuedOTP:
+        """
+        Derive the code from the client secret and send it; nothing is stored.
+        Always sent synchronously, the outbox needs an otps row to deliver from.
+        """
+        otp_id, otp_code, expires_at = await stateless_otp.issue(
+            client.id, client.otp_secret, phone_number, length
+        )
+        try:
+            await OTPService._send_otp_via_whatsapp(
+                phone_number,
+                otp_code,
+                client.phone_number_id,
+                client.whatsapp_api_token,
+                business_id=client.business_id
             )
-            
-            session.add(new_otp)
-            await session.commit()
-            await session.refresh(new_otp)
-            
-            return new_otp
+        except WhatsAppUnavailableError:
+            raise
+        except Exception as wa_error:
+            raise ValueError(f"WhatsApp sending error: {wa_error}")
 
-        except IntegrityError:
-            await session.rollback()
-            raise ValueError("Failed to create OTP record due to database constraint")
-        except Exception as e:
-            await session.rollback()
-            raise ValueError(f"OTP record creation error: {e}")
+        OTP_SENT.labels(client.id).inc()
+        return IssuedOTP(id=otp_id, expires_at=expires_at)
+
+    @staticmethod
+    def _expires_at() -> datetime:
+        return datetime.utcnow() + timedelta(minutes=EXPIRATION_MINUTES)
 
     @staticmethod
     async def _validate_client(
         session: AsyncSession, 
         api_key: str
-    ) -> Client:
+    ) -> ClientCredentials:
         """Validate and retrieve client by API key."""
-        stmt = select(Client).where(Client.api_key == api_key)
-        result = await session.execute(stmt)
-        client = result.scalars().first()
+        with span("client"):
+            client = await resolve_client_credentials(session, api_key)
         
         if not client:
             raise ValueError("Invalid API key.")
@@ -176,66 +360,72 @@ class OTPService:
         phone_number: str, 
         otp_code: str, 
         phone_number_id: str, 
-        whatsapp_api_token: str
+        whatsapp_api_token: str,
+        business_id: Optional[int] = None,
+        priority: int = PRIORITY_OTP
     ) -> None:
-        """Send OTP via WhatsApp and handle potential errors."""
-        response = await send_whatsapp_template(
-            phone_number,
-            otp_code=otp_code,
-            phone_number_id=phone_number_id,
-            whatsapp_api_token=whatsapp_api_token
-        )
-        
-        if 'error' in response:
-            raise ValueError(f"WhatsApp OTP sending failed: {response['error']}")
+        """Send OTP via WhatsApp; raises WhatsAppSendError when the message is not accepted."""
+        with span("whatsapp", phone_number_id=phone_number_id):
+            await send_whatsapp_template(
+                phone_number,
+                otp_code=otp_code,
+                phone_number_id=phone_number_id,
+                whatsapp_api_token=whatsapp_api_token,
+                business_id=business_id,
+                priority=priority
+            )
 
     @staticmethod
     async def verify_otp(
         session: AsyncSession,
-        phone_number: str,
+        phone_number: Optional[str],
         otp_code: str,
-        client: Client
-    ) -> Optional[OTP]:
-        
-        try:
-            stmt = select(OTP).join(User).where(
-                User.phone_number == phone_number,
-                OTP.otp_code == otp_code,
-                OTP.client_id == client.id
-            )
-            result = await session.execute(stmt)
-            otp = result.scalar_one_or_none()
-
-            if not otp:
-                raise InvalidOTPError("No matching OTP found")
-
-            # Validate OTP expiration
-            if otp.expires_at < datetime.utcnow():
-                raise OTPExpiredError("OTP has expired")
-
-            # Validate OTP usage
-            if otp.is_used:
-                raise OTPAlreadyUsedError("OTP has already been used")
+        client: ClientCredentials,
+        otp_id: Optional[int] = None
+    ) -> int:
+        """
+        Atomically consume a matching OTP and mark its user as verified.
 
-            return otp
+        The OTP is located by otp_id when given, otherwise by phone number and
+        code. Returns the id of the consumed OTP. Stateless clients are checked
+        without touching the database.
+        """
+        try:
+            if OTPService._is_stateless(client):
+                with span("consume"):
+                    consumed_id = await stateless_otp.verify(
+                        client.id, client.otp_secret, phone_number, otp_code, otp_id=otp_id
+                    )
+                OTP_VERIFIED.labels(client.id).inc()
+                return consumed_id
 
-        except (InvalidOTPError, OTPExpiredError, OTPAlreadyUsedError):
+            with span("consume"):
+                consumed_id = await get_otp_store().consume(
+                    session,
+                    client.id,
+                    otp_code,
+                    phone_number=phone_number,
+                    otp_id=otp_id
+                )
+        except OTPExpiredError:
+            OTP_EXPIRED.labels(client.id).inc()
             raise
-        except Exception as e:
-            raise RuntimeError("An unexpected error occurred during OTP verification", e)
+
+        OTP_VERIFIED.labels(client.id).inc()
+        return consumed_id
 
     @staticmethod
     async def update_otp_status(
         session: AsyncSession, 
-        otp_code: str, 
+        otp_id: int, 
         is_used: bool
     ) -> None:
         """Update OTP usage status."""
         try:
             await session.execute(
-                update(OTP).where(OTP.otp_code == otp_code).values(is_used=is_used)
+                update(OTP).where(OTP.id == otp_id).values(is_used=is_used)
             )
             await session.commit()
         except Exception as e:
             await session.rollback()
-            raise ValueError(f"OTP status update failed: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"OTP status update failed: {str(e)}")
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import func, insert, update
+
+from src.database import async_session
+from src.database.models import OTP, User, UserStatus
+from src.services.user import get_or_create_users
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AuditEvent:
+    kind: str  # "issued" or "consumed"
+    otp_id: int
+    phone_number: str
+    client_id: Optional[int] = None
+    otp_code: Optional[str] = None
+    created_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+
+class OTPAuditSink:
+    """
+    Writes OTPs issued and consumed by a non-SQL OTP store to Postgres in the background.
+
+    Events are queued without awaiting the database and flushed in batches, one
+    transaction per batch. The queue is bounded; when it is full events are
+    dropped and logged rather than slowing down the request path.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, queue_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "asyncio.Queue[AuditEvent]" = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+    def record_issued(
+        self,
+        otp_id: int,
+        client_id: int,
+        phone_number: str,
+        otp_code: str,
+        created_at: datetime,
+        expires_at: datetime
+    ) -> None:
+        self._put(AuditEvent(
+            kind="issued",
+            otp_id=otp_id,
+            client_id=client_id,
+            phone_number=phone_number,
+            otp_code=otp_code,
+            created_at=created_at,
+            expires_at=expires_at
+        ))
+
+    def record_consumed(self, otp_id: int, phone_number: str) -> None:
+        self._put(AuditEvent(kind="consumed", otp_id=otp_id, phone_number=phone_number))
+
+    def _put(self, event: AuditEvent) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.error("OTP audit queue is full, dropping %s event for OTP %s", event.kind, event.otp_id)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the background task and flushes whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while not self._queue.empty():
+            await self._flush(self._drain())
+
+    def _drain(self) -> List[AuditEvent]:
+        events = []
+        while len(events) < self.batch_size and not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    async def _run(self) -> None:
+        while True:
+            event = await self._queue.get()
+            # Give the batch a moment to fill up before paying for a transaction
+            if self._queue.qsize() < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+            await self._flush([event] + self._drain())
+
+    async def _flush(self, events: List[AuditEvent]) -> None:
+        issued = [e for e in events if e.kind == "issued"]
+        consumed = [e for e in events if e.kind == "consumed"]
+        consumed_ids = {e.otp_id for e in consumed}
+
+        try:
+            async with async_session() as session:
+                if issued:
+                    user_ids = await get_or_create_users(session, [e.phone_number for e in issued])
+                    await session.execute(insert(OTP), [
+                        {
+                            "id": e.otp_id,
+                            "user_id": user_ids[e.phone_number],
+                            "client_id": e.client_id,
+                            "otp_code": e.otp_code,
+                            "created_at": e.created_at,
+                            "expires_at": e.expires_at,
+                            "is_used": e.otp_id in consumed_ids
+                        }
+                        for e in issued
+                    ])
+
+                if consumed:
+                    await session.execute(
+                        update(OTP)
+                        .where(OTP.id.in_(consumed_ids))
+                        .values(is_used=True)
+                        .execution_options(synchronize_session=False)
+                    )
+                    await session.execute(
+                        update(User)
+                        .where(User.phone_number.in_({e.phone_number for e in consumed}))
+                        .values(status=UserStatus.VERIFIED, updated_at=func.now())
+                        .execution_options(synchronize_session=False)
+                    )
+
+                await session.commit()
+        except Exception:
+            logger.exception("Failed to write %d OTP audit events", len(events))
@@ -0,0 +1,588 @@
+import asyncio
+import hmac
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, literal, text, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from src.config import settings
+from src.database import engine
+from src.database.models import OTP, OTPDelivery, User, UserStatus
+from src.services.otp_audit import OTPAuditSink
+from src.services.user import get_or_create_users, upsert_users
+from src.utils.cache import TTLCache
+from src.utils.redis import get_redis, start_redis
+from src.utils.tracing import span
+from src.exceptions.otp import *
+
+
+@dataclass(frozen=True)
+class IssuedOTP:
+    id: int
+    expires_at: datetime
+
+
+class OTPStore(ABC):
+    """
+    Where active OTPs live between send and verify.
+
+    Every method takes the request session; stores that do not keep OTPs in
+    Postgres simply ignore it.
+    """
+
+    @abstractmethod
+    async def issue(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        phone_number: str,
+        otp_code: str,
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> IssuedOTP:
+        """Store a new OTP. With enqueue_delivery, also queue it for the outbox dispatchers."""
+
+    @abstractmethod
+    async def issue_many(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        codes: Dict[str, str],
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> Dict[str, IssuedOTP]:
+        """Store one OTP per phone number (codes maps phone number to code)."""
+
+    @abstractmethod
+    async def consume(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        otp_code: str,
+        phone_number: Optional[str] = None,
+        otp_id: Optional[int] = None
+    ) -> int:
+        """
+        Atomically mark a matching OTP as used and its user as verified.
+
+        :return: int - Id of the consumed OTP.
+        :raises InvalidOTPError, OTPExpiredError, OTPAlreadyUsedError
+        """
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLAlchemyOTPStore(OTPStore):
+    """Keeps OTPs in the otps table; the reference implementation."""
+
+    # otps.id is a SERIAL (int4) column
+    MAX_ID = 2 ** 31 - 1
+
+    async def issue(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        phone_number: str,
+        otp_code: str,
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> IssuedOTP:
+        """
+        The user upsert, the OTP insert and the optional outbox row are one
+        statement made of data-modifying CTEs, so a send costs that statement
+        plus the COMMIT, and RETURNING hands back what a refresh would have read.
+        """
+        users = upsert_users([phone_number], User.id).cte("upserted_user")
+        new_otp = (
+            insert(OTP)
+            .from_select(
+                ["user_id", "client_id", "otp_code", "expires_at", "is_used"],
+                select(
+                    users.c.id,
+                    literal(client_id),
+                    literal(otp_code),
+                    literal(expires_at, OTP.expires_at.type),
+                    literal(False)
+                )
+            )
+            .returning(OTP.id, OTP.expires_at)
+            .cte("new_otp")
+        )
+        stmt = select(new_otp.c.id, new_otp.c.expires_at)
+
+        if enqueue_delivery:
+            delivery = insert(OTPDelivery).from_select(
+                ["otp_id", "next_attempt_at"],
+                select(new_otp.c.id, literal(datetime.utcnow(), OTPDelivery.next_attempt_at.type))
+            )
+            stmt = stmt.add_cte(delivery.cte("new_delivery"))
+
+        try:
+            with span("insert"):
+                row = (await session.execute(stmt)).one_or_none()
+                if row is None:
+                    # The user was created by a concurrent send after this
+                    # statement's snapshot; the next statement sees it
+                    row = (await session.execute(stmt)).one()
+            with span("commit"):
+                await session.commit()
+
+            return IssuedOTP(id=row.id, expires_at=row.expires_at)
+
+        except IntegrityError:
+            await session.rollback()
+            raise ValueError("Failed to create OTP record due to database constraint")
+        except Exception as e:
+            await session.rollback()
+            raise ValueError(f"OTP record creation error: {e}")
+
+    async def issue_many(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        codes: Dict[str, str],
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> Dict[str, IssuedOTP]:
+        """Bulk variant: a user upsert plus bulk INSERT ... RETURNING statements, one commit."""
+        try:
+            user_ids = await get_or_create_users(session, list(codes))
+
+            inserted = await session.execute(
+                insert(OTP).returning(OTP.id, OTP.user_id),
+                [
+                    {
+                        "user_id": user_ids[phone_number],
+                        "client_id": client_id,
+                        "otp_code": otp_code,
+                        "expires_at": expires_at,
+                        "is_used": False
+                    }
+                    for phone_number, otp_code in codes.items()
+                ]
+            )
+            otp_ids = {row.user_id: row.id for row in inserted}
+
+            if enqueue_delivery:
+                now = datetime.utcnow()
+                await session.execute(
+                    insert(OTPDelivery),
+                    [{"otp_id": otp_id, "next_attempt_at": now} for otp_id in otp_ids.values()]
+                )
+
+            await session.commit()
+        except SQLAlchemyError:
+            await session.rollback()
+            raise
+
+        return {
+            phone_number: IssuedOTP(id=otp_ids[user_ids[phone_number]], expires_at=expires_at)
+            for phone_number in codes
+        }
+
+    async def consume(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        otp_code: str,
+        phone_number: Optional[str] = None,
+        otp_id: Optional[int] = None
+    ) -> int:
+        """
+        The OTP is located by otp_id (primary key) when given, otherwise by phone
+        number and code; when both otp_id and phone_number are given the OTP must
+        belong to that number. The code check, the OTP update and the user update
+        run as one statement made of data-modifying CTEs, so only one of several
+        concurrent verifies can consume a given code.
+        """
+        if otp_id is not None and not 1 <= otp_id <= self.MAX_ID:
+            # e.g. a stateless otp_id after the client left stateless mode
+            raise InvalidOTPError("No matching OTP found")
+
+        now = datetime.utcnow()
+
+        if otp_id is not None:
+            target = select(OTP.id, OTP.is_used, OTP.expires_at).where(
+                OTP.id == otp_id,
+                OTP.client_id == client_id,
+                OTP.otp_code == otp_code
+            )
+            if phone_number is not None:
+                # Both sent: they must name the same OTP
+                target = target.join(User, User.id == OTP.user_id).where(User.phone_number == phone_number)
+            target = target.cte("target")
+        else:
+            # Prefer an unused, most recent code when the same code was issued twice
+            target = (
+                select(OTP.id, OTP.is_used, OTP.expires_at)
+                .join(User, User.id == OTP.user_id)
+                .where(
+                    User.phone_number == phone_number,
+                    OTP.otp_code == otp_code,
+                    OTP.client_id == client_id
+                )
+                .order_by(OTP.is_used, OTP.expires_at.desc())
+                .limit(1)
+                .cte("target")
+            )
+
+        try:
+            result = await session.execute(self._consume_statement(target, now))
+            row = result.one_or_none()
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            raise RuntimeError("An unexpected error occurred during OTP verification", e)
+
+        return self._check_consumed(row, now)
+
+    @staticmethod
+    def _consume_statement(target, now: datetime):
+        """
+        Build the single-round-trip consume statement for a `target` CTE exposing
+        id, is_used and expires_at of the candidate OTP.
+        """
+        otps = OTP.__table__
+        users = User.__table__
+
+        consumed = (
+            update(otps)
+            .where(
+                otps.c.id == target.c.id,
+                otps.c.is_used.is_not(True),
+                otps.c.expires_at > now
+            )
+            .values(is_used=True)
+            .returning(otps.c.id, otps.c.user_id)
+            .cte("consumed")
+        )
+        verified = (
+            update(users)
+            .where(users.c.id == consumed.c.user_id)
+            .values(status=UserStatus.VERIFIED, updated_at=func.now())
+            .returning(users.c.id)
+            .cte("verified")
+        )
+        return (
+            select(
+                target.c.id,
+                target.c.is_used,
+                target.c.expires_at,
+                consumed.c.id.label("consumed_id")
+            )
+            .select_from(
+                target
+                .outerjoin(consumed, consumed.c.id == target.c.id)
+                .outerjoin(verified, verified.c.id == consumed.c.user_id)
+            )
+        )
+
+    @staticmethod
+    def _check_consumed(row, now: datetime) -> int:
+        """Map the consume statement result to the consumed OTP id or a verification error."""
+        if row is None:
+            raise InvalidOTPError("No matching OTP found")
+
+        if row.consumed_id is not None:
+            return row.consumed_id
+
+        if row.expires_at <= now:
+            raise OTPExpiredError("OTP has expired")
+
+        # Either used before, or a concurrent verify consumed it first
+        raise OTPAlreadyUsedError("OTP has already been used")
+
+
+class SequenceIdAllocator:
+    """
+    Hands out otps ids reserved from the Postgres sequence in blocks, so stores
+    that do not insert synchronously still return ids that match the audit rows.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        if not self._ids:
+            async with self._lock:
+                if not self._ids:
+                    async with engine.connect() as conn:
+                        result = await conn.execute(
+                            text("SELECT nextval('otps_id_seq') FROM generate_series(1, :n)"),
+                            {"n": self.block_size}
+                        )
+                        self._ids.extend(row[0] for row in result)
+        return self._ids.popleft()
+
+
+class _AuditedOTPStore(OTPStore):
+    """
+    Common plumbing for stores that keep Postgres only as an asynchronous audit sink.
+
+    The audit sink is best effort, so these stores cannot queue outbox
+    deliveries: Settings refuses OTP_DELIVERY_MODE=outbox with them and
+    enqueue_delivery is never set.
+    """
+
+    def __init__(self, ids: SequenceIdAllocator, audit: OTPAuditSink):
+        self._ids = ids
+        self._audit = audit
+
+    async def start(self) -> None:
+        self._audit.start()
+
+    async def close(self) -> None:
+        await self._audit.stop()
+
+    def _ttl(self, expires_at: datetime) -> float:
+        # Keep codes past expiry for a while so verify can still report them as expired or used
+        return (expires_at - datetime.utcnow()).total_seconds() + settings.otp_store_grace_seconds
+
+    async def issue_many(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        codes: Dict[str, str],
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> Dict[str, IssuedOTP]:
+        issued = await asyncio.gather(*(
+            self.issue(session, client_id, phone_number, otp_code, expires_at, enqueue_delivery)
+            for phone_number, otp_code in codes.items()
+        ))
+        return dict(zip(codes, issued))
+
+
+@dataclass
+class _ActiveOTP:
+    id: int
+    client_id: int
+    phone_number: str
+    otp_code: str
+    expires_at: datetime
+    is_used: bool = False
+
+
+class MemoryOTPStore(_AuditedOTPStore):
+    """
+    In-process TTL store for single-node deployments.
+
+    Each worker process has its own store, so a code can only be verified by the
+    process that issued it; do not use it behind a multi-worker server.
+    """
+
+    def __init__(self, ids: SequenceIdAllocator, audit: OTPAuditSink, max_entries: int):
+        super().__init__(ids, audit)
+        self._by_id: TTLCache[int, _ActiveOTP] = TTLCache(max_entries, settings.otp_store_grace_seconds)
+        self._by_code: TTLCache[Tuple[int, str, str], int] = TTLCache(max_entries, settings.otp_store_grace_seconds)
+
+    async def issue(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        phone_number: str,
+        otp_code: str,
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> IssuedOTP:
+        otp_id = await self._ids.next_id()
+        ttl = self._ttl(expires_at)
+
+        self._by_id.set(otp_id, _ActiveOTP(otp_id, client_id, phone_number, otp_code, expires_at), ttl)
+        self._by_code.set((client_id, phone_number, otp_code), otp_id, ttl)
+        self._audit.record_issued(
+            otp_id, client_id, phone_number, otp_code, datetime.utcnow(), expires_at
+        )
+        return IssuedOTP(id=otp_id, expires_at=expires_at)
+
+    async def consume(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        otp_code: str,
+        phone_number: Optional[str] = None,
+        otp_id: Optional[int] = None
+    ) -> int:
+        if otp_id is None:
+            otp_id = self._by_code.get((client_id, phone_number, otp_code))
+        otp = self._by_id.get(otp_id) if otp_id is not None else None
+
+        if (
+            otp is None
+            or otp.client_id != client_id
+            or (phone_number is not None and otp.phone_number != phone_number)
+            or not hmac.compare_digest(otp.otp_code.encode(), otp_code.encode())
+        ):
+            raise InvalidOTPError("No matching OTP found")
+
+        # No await between the checks and the update, so this is atomic on the event loop
+        if otp.is_used:
+            raise OTPAlreadyUsedError("OTP has already been used")
+        if otp.expires_at <= datetime.utcnow():
+            raise OTPExpiredError("OTP has expired")
+
+        otp.is_used = True
+        self._audit.record_consumed(otp.id, otp.phone_number)
+        return otp.id
+
+
+# Runs server-side so check-and-mark is atomic across every worker.
+# KEYS[1] is either the OTP hash or, in "index" mode, the phone/code index key.
+# ARGV[6], when not empty, is the phone number the OTP must belong to.
+_CONSUME_SCRIPT = """
+local key = KEYS[1]
+if ARGV[1] == 'index' then
+    local otp_id = redis.call('GET', key)
+    if not otp_id then return {'invalid'} end
+    key = ARGV[5] .. otp_id
+end
+local otp = redis.call('HMGET', key, 'client_id', 'code', 'expires_at', 'used', 'phone')
+if not otp[1] or otp[1] ~= ARGV[2] or otp[2] ~= ARGV[3] then return {'invalid'} end
+if ARGV[6] ~= '' and otp[5] ~= ARGV[6] then return {'invalid'} end
+if otp[4] == '1' then return {'used'} end
+if tonumber(otp[3]) <= tonumber(ARGV[4]) then return {'expired'} end
+redis.call('HSET', key, 'used', '1')
+return {'ok', string.sub(key, string.len(ARGV[5]) + 1), otp[5]}
+"""
+
+
+def _epoch_ms(moment: datetime) -> int:
+    return int(moment.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class RedisOTPStore(_AuditedOTPStore):
+    """
+    Keeps active OTPs in a Redis-protocol server where they expire natively.
+
+    Consumption is a Lua script, so it is atomic across workers and hosts. The
+    script derives the OTP key from the index key, so it targets a single
+    Redis instance (not Redis Cluster).
+    """
+
+    OTP_PREFIX = "otp:"
+    INDEX_PREFIX = "otp:idx:"
+
+    def __init__(self, ids: SequenceIdAllocator, audit: OTPAuditSink):
+        super().__init__(ids, audit)
+        self._consume_script = None
+
+    async def start(self) -> None:
+        redis = await start_redis()
+        self._consume_script = redis.register_script(_CONSUME_SCRIPT)
+        await super().start()
+
+    def _index_key(self, client_id: int, phone_number: str, otp_code: str) -> str:
+        return f"{self.INDEX_PREFIX}{client_id}:{phone_number}:{otp_code}"
+
+    async def issue(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        phone_number: str,
+        otp_code: str,
+        expires_at: datetime,
+        enqueue_delivery: bool = False
+    ) -> IssuedOTP:
+        otp_id = await self._ids.next_id()
+        ttl_ms = int(self._ttl(expires_at) * 1000)
+        key = f"{self.OTP_PREFIX}{otp_id}"
+
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={
+                "client_id": client_id,
+                "phone": phone_number,
+                "code": otp_code,
+                "expires_at": _epoch_ms(expires_at),
+                "used": 0
+            })
+            pipe.pexpire(key, ttl_ms)
+            pipe.set(self._index_key(client_id, phone_number, otp_code), otp_id, px=ttl_ms)
+            await pipe.execute()
+
+        self._audit.record_issued(
+            otp_id, client_id, phone_number, otp_code, datetime.utcnow(), expires_at
+        )
+        return IssuedOTP(id=otp_id, expires_at=expires_at)
+
+    async def consume(
+        self,
+        session: AsyncSession,
+        client_id: int,
+        otp_code: str,
+        phone_number: Optional[str] = None,
+        otp_id: Optional[int] = None
+    ) -> int:
+        if otp_id is not None:
+            keys, mode = [f"{self.OTP_PREFIX}{otp_id}"], "id"
+        else:
+            keys, mode = [self._index_key(client_id, phone_number, otp_code)], "index"
+
+        result = await self._consume_script(
+            keys=keys,
+            args=[mode, client_id, otp_code, _epoch_ms(datetime.utcnow()), self.OTP_PREFIX, phone_number or ""]
+        )
+
+        status = result[0]
+        if status == "invalid":
+            raise InvalidOTPError("No matching OTP found")
+        if status == "used":
+            raise OTPAlreadyUsedError("OTP has already been used")
+        if status == "expired":
+            raise OTPExpiredError("OTP has expired")
+
+        consumed_id = int(result[1])
+        self._audit.record_consumed(consumed_id, result[2])
+        return consumed_id
+
+
+_store: Optional[OTPStore] = None
+
+
+def create_otp_store() -> OTPStore:
+    if settings.otp_store == "sql":
+        return SQLAlchemyOTPStore()
+
+    ids = SequenceIdAllocator(settings.otp_id_block_size)
+    audit = OTPAuditSink(
+        settings.otp_audit_batch_size,
+        settings.otp_audit_flush_interval,
+        settings.otp_audit_queue_size
+    )
+    if settings.otp_store == "memory":
+        return MemoryOTPStore(ids, audit, settings.otp_store_max_entries)
+    return RedisOTPStore(ids, audit)
+
+
+async def start_otp_store() -> OTPStore:
+    global _store
+
+    if _store is None:
+        _store = create_otp_store()
+        await _store.start()
+    return _store
+
+
+async def close_otp_store() -> None:
+    global _store
+
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+def get_otp_store() -> OTPStore:
+    if _store is None:
+        raise RuntimeError("OTP store is not started. Call start_otp_store() first.")
+    return _store
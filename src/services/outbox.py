@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from src.config import settings
+from src.database import async_session
+from src.database.models import OTP, OTPDelivery, DeliveryStatus, Client, Business, User
+from src.services.otp import OTPService
+
+logger = logging.getLogger(__name__)
+
+_workers: List[asyncio.Task] = []
+_stop_event: Optional[asyncio.Event] = None
+
+
+async def claim_deliveries(session: AsyncSession, batch_size: int) -> List[Row]:
+    """
+    Claims a batch of due deliveries for this worker.
+
+    Rows are picked with FOR UPDATE SKIP LOCKED so concurrent dispatchers never
+    claim the same delivery, and the claim pushes next_attempt_at forward by the
+    lease so a crashed worker's batch becomes due again instead of being lost.
+
+    :param session: AsyncSession - SQLAlchemy session.
+    :param batch_size: int - Maximum number of deliveries to claim.
+    :return: List[Row] - Claimed deliveries joined with everything needed to send them.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(OTPDelivery.id)
+        .where(
+            OTPDelivery.status == DeliveryStatus.PENDING,
+            OTPDelivery.next_attempt_at <= now
+        )
+        .order_by(OTPDelivery.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(OTPDelivery.__table__)
+        .where(
+            OTPDelivery.id.in_(due.scalar_subquery()),
+            OTP.id == OTPDelivery.otp_id,
+            User.id == OTP.user_id,
+            Client.id == OTP.client_id,
+            Business.id == Client.business_id
+        )
+        .values(
+            attempts=OTPDelivery.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=settings.outbox_lease_seconds)
+        )
+        .returning(
+            OTPDelivery.id,
+            OTPDelivery.attempts,
+            OTP.otp_code,
+            OTP.expires_at,
+            User.phone_number,
+            Business.id.label("business_id"),
+            Business.phone_number_id,
+            Business.whatsapp_api_token
+        )
+    )
+    result = await session.execute(stmt)
+    rows = result.all()
+    await session.commit()
+    return rows
+
+
+async def _deliver(delivery: Row) -> Optional[str]:
+    """Sends one claimed delivery and returns the error message, if any."""
+    if delivery.expires_at < datetime.utcnow():
+        return "OTP expired before it could be delivered"
+
+    try:
+        await OTPService._send_otp_via_whatsapp(
+            delivery.phone_number,
+            delivery.otp_code,
+            delivery.phone_number_id,
+            delivery.whatsapp_api_token,
+            business_id=delivery.business_id
+        )
+        return None
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+
+
+async def dispatch_batch(session: AsyncSession) -> int:
+    """
+    Claims, sends and records one batch of deliveries.
+
+    :param session: AsyncSession - SQLAlchemy session.
+    :return: int - Number of deliveries processed.
+    """
+    deliveries = await claim_deliveries(session, settings.outbox_batch_size)
+    if not deliveries:
+        return 0
+
+    errors = await asyncio.gather(*(_deliver(delivery) for delivery in deliveries))
+
+    now = datetime.utcnow()
+    updates = []
+    for delivery, error in zip(deliveries, errors):
+        if error is None:
+            updates.append({"id": delivery.id, "status": DeliveryStatus.SENT, "last_error": None})
+        elif delivery.attempts >= settings.outbox_max_attempts or delivery.expires_at < now:
+            updates.append({"id": delivery.id, "status": DeliveryStatus.FAILED, "last_error": error})
+        else:
+            # Linear backoff, the OTP expires long before this grows large
+            retry_at = now + timedelta(seconds=settings.outbox_retry_delay * delivery.attempts)
+            updates.append({"id": delivery.id, "last_error": error, "next_attempt_at": retry_at})
+
+    for status in (DeliveryStatus.SENT, DeliveryStatus.FAILED, None):
+        batch = [u for u in updates if u.get("status") is status]
+        if batch:
+            await session.execute(update(OTPDelivery), batch)
+    await session.commit()
+
+    return len(deliveries)
+
+
+async def run_dispatcher(stop_event: asyncio.Event) -> None:
+    """Drains the outbox until stop_event is set, sleeping only when it is empty."""
+    while not stop_event.is_set():
+        try:
+            async with async_session() as session:
+                processed = await dispatch_batch(session)
+        except Exception:
+            logger.exception("Outbox dispatch failed")
+            processed = 0
+
+        if processed == 0:
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=settings.outbox_poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def start_dispatchers(count: int) -> None:
+    global _stop_event
+
+    _stop_event = asyncio.Event()
+    for _ in range(count):
+        _workers.append(asyncio.create_task(run_dispatcher(_stop_event)))
+
+
+async def stop_dispatchers() -> None:
+    """Lets every worker finish its current batch, then waits for them to exit."""
+    if _stop_event is not None:
+        _stop_event.set()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,210 @@
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from src.config import settings
+from src.utils.redis import start_redis
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    scope: str
+    limit: int
+    window: float
+
+
+@dataclass(frozen=True)
+class RateLimitExceeded:
+    scope: str
+    retry_after: float
+
+
+def _retry_after(previous: float, current: float, cost: int, rule: RateLimitRule, offset: float) -> float:
+    """Seconds until the sliding-window estimate leaves room for `cost` more hits."""
+    room = rule.limit - cost
+    if current <= room:
+        # Fits in this window once the previous window's weight has dropped enough
+        if previous <= 0:
+            return 0.0
+        needed = 1 - (room - current) / previous
+        return max(0.0, needed * rule.window - offset)
+
+    # This window's count carries over as the previous one, at a weight that
+    # falls from 1 over the next window
+    needed = 1 - room / current if room >= 0 else 1.0
+    return rule.window - offset + needed * rule.window
+
+
+class RateLimiter(ABC):
+    """
+    Sliding-window counters (current + weighted previous fixed window).
+
+    acquire() checks every key first and only counts the hit when all of them
+    have room, so a request rejected by one scope does not use up the others.
+    """
+
+    @abstractmethod
+    async def acquire(
+        self, keys: List[Tuple[str, RateLimitRule]], cost: int = 1
+    ) -> Optional[RateLimitExceeded]:
+        """Count a hit of weight `cost` against every key, or return why it is refused."""
+
+    async def start(self) -> None:
+        pass
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Per-process limiter; each worker enforces the limits on its own traffic.
+
+    Keys are spread over shards and one shard is swept of stale counters per
+    call, so memory stays bounded without a background task.
+    """
+
+    def __init__(self, shards: int):
+        # key -> (window index, previous count, current count, stale at)
+        self._shards: List[Dict[str, Tuple[int, float, float, float]]] = [{} for _ in range(shards)]
+        self._sweep_cursor = 0
+
+    def _shard(self, key: str) -> Dict[str, Tuple[int, float, float, float]]:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _sweep(self, now: float) -> None:
+        shard = self._shards[self._sweep_cursor]
+        self._sweep_cursor = (self._sweep_cursor + 1) % len(self._shards)
+
+        stale = [key for key, entry in shard.items() if entry[3] <= now]
+        for key in stale:
+            del shard[key]
+
+    def _counts(self, key: str, rule: RateLimitRule, now: float) -> Tuple[int, float, float]:
+        index = int(now // rule.window)
+        entry = self._shard(key).get(key)
+
+        if entry is None or entry[0] < index - 1:
+            return index, 0.0, 0.0
+        if entry[0] == index - 1:
+            return index, entry[2], 0.0
+        return index, entry[1], entry[2]
+
+    async def acquire(
+        self, keys: List[Tuple[str, RateLimitRule]], cost: int = 1
+    ) -> Optional[RateLimitExceeded]:
+        now = time.time()
+        self._sweep(now)
+
+        updates = []
+        for key, rule in keys:
+            index, previous, current = self._counts(key, rule, now)
+            offset = now - index * rule.window
+            weight = 1 - offset / rule.window
+
+            if previous * weight + current + cost > rule.limit:
+                return RateLimitExceeded(rule.scope, _retry_after(previous, current, cost, rule, offset))
+            updates.append((key, (index, previous, current + cost, (index + 2) * rule.window)))
+
+        for key, entry in updates:
+            self._shard(key)[key] = entry
+        return None
+
+
+# Checks every key, then increments all of them; returns the index of the first
+# refused key with its counters, or 0 when the hit was counted.
+_ACQUIRE_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local n = #KEYS / 2
+for i = 1, n do
+    local limit = tonumber(ARGV[1 + (i - 1) * 3 + 1])
+    local weight = tonumber(ARGV[1 + (i - 1) * 3 + 2])
+    local current = tonumber(redis.call('GET', KEYS[i]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[n + i]) or '0')
+    if previous * weight + current + cost > limit then
+        return {i, tostring(previous), tostring(current)}
+    end
+end
+for i = 1, n do
+    redis.call('INCRBY', KEYS[i], cost)
+    redis.call('PEXPIRE', KEYS[i], tonumber(ARGV[1 + (i - 1) * 3 + 3]))
+end
+return {0}
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """Shared limiter for multi-worker deployments; one Lua call per acquire."""
+
+    PREFIX = "rl:"
+
+    def __init__(self):
+        self._script = None
+
+    async def start(self) -> None:
+        redis = await start_redis()
+        self._script = redis.register_script(_ACQUIRE_SCRIPT)
+
+    async def acquire(
+        self, keys: List[Tuple[str, RateLimitRule]], cost: int = 1
+    ) -> Optional[RateLimitExceeded]:
+        now = time.time()
+        current_keys, previous_keys, args = [], [], [cost]
+
+        for key, rule in keys:
+            index = int(now // rule.window)
+            offset = now - index * rule.window
+            current_keys.append(f"{self.PREFIX}{key}:{index}")
+            previous_keys.append(f"{self.PREFIX}{key}:{index - 1}")
+            args.extend([rule.limit, 1 - offset / rule.window, int(rule.window * 2000)])
+
+        result = await self._script(keys=current_keys + previous_keys, args=args)
+        if int(result[0]) == 0:
+            return None
+
+        key, rule = keys[int(result[0]) - 1]
+        offset = now - int(now // rule.window) * rule.window
+        return RateLimitExceeded(
+            rule.scope, _retry_after(float(result[1]), float(result[2]), cost, rule, offset)
+        )
+
+
+class NoopRateLimiter(RateLimiter):
+    async def acquire(
+        self, keys: List[Tuple[str, RateLimitRule]], cost: int = 1
+    ) -> Optional[RateLimitExceeded]:
+        return None
+
+
+def send_rules() -> Dict[str, RateLimitRule]:
+    """Configured per-scope limits for OTP sends; a limit of 0 disables the scope."""
+    rules = {
+        "phone": RateLimitRule("phone", settings.rate_limit_phone_limit, settings.rate_limit_phone_window),
+        "client": RateLimitRule("client", settings.rate_limit_client_limit, settings.rate_limit_client_window),
+        "business": RateLimitRule("business", settings.rate_limit_business_limit, settings.rate_limit_business_window),
+    }
+    return {scope: rule for scope, rule in rules.items() if rule.limit > 0}
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def create_rate_limiter() -> RateLimiter:
+    if settings.rate_limit_backend == "redis":
+        return RedisRateLimiter()
+    if settings.rate_limit_backend == "memory":
+        return MemoryRateLimiter(settings.rate_limit_shards)
+    return NoopRateLimiter()
+
+
+async def start_rate_limiter() -> RateLimiter:
+    global _limiter
+
+    if _limiter is None:
+        _limiter = create_rate_limiter()
+        await _limiter.start()
+    return _limiter
+
+
+def get_rate_limiter() -> RateLimiter:
+    if _limiter is None:
+        raise RuntimeError("Rate limiter is not started. Call start_rate_limiter() first.")
+    return _limiter
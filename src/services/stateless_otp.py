@@ -0,0 +1,210 @@
+"""
+Stateless OTPs for clients with an otp_secret.
+
+The code is derived TOTP-style from the client secret, the phone number, the
+code length and the current time step (STATELESS_OTP_STEP seconds), so nothing
+is written on send and verify only recomputes it: a code stays valid for
+STATELESS_OTP_VALID_STEPS steps. The only state is short-lived: the consumed
+(client, phone number, step) entries for replay protection and a per (client,
+phone number) count of verify attempts, kept in memory or in Redis (required
+with several workers). The users table is not touched in this mode.
+
+The otp_id returned on send encodes the time step and the code length, and
+verify requires it: only that one code is checked, at the length it was sent
+with, and at most STATELESS_OTP_MAX_ATTEMPTS failed guesses per number are
+accepted within a validity window (a successful verify starts the count over). Without this a short guess would match one of the
+codes that exist for every number at every step.
+"""
+import hashlib
+import hmac
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from src.config import settings
+from src.utils.cache import TTLCache
+from src.utils.redis import start_redis
+from src.exceptions.otp import *
+
+
+_LENGTH_FACTOR = 100
+
+
+def encode_otp_id(step: int, length: int) -> int:
+    return step * _LENGTH_FACTOR + length
+
+
+def decode_otp_id(otp_id: int) -> Tuple[int, int]:
+    """Splits an otp_id into (step, code length)."""
+    return divmod(otp_id, _LENGTH_FACTOR)
+
+
+def current_step(now: Optional[float] = None) -> int:
+    return int((time.time() if now is None else now) // settings.stateless_otp_step)
+
+
+def derive_code(secret: str, phone_number: str, step: int, length: int) -> str:
+    """HOTP dynamic truncation (RFC 4226) over HMAC-SHA256 of the number, length and step."""
+    message = f"{phone_number}:{length}:{step}".encode()
+    digest = hmac.new(bytes.fromhex(secret), message, hashlib.sha256).digest()
+    offset = digest[-1] & 0x0F
+    value = int.from_bytes(digest[offset:offset + 4], "big") & 0x7FFFFFFF
+    return str(value % 10 ** length).zfill(length)
+
+
+def expires_at(step: int) -> datetime:
+    """When a code from this step stops being accepted."""
+    return datetime.utcfromtimestamp((step + settings.stateless_otp_valid_steps) * settings.stateless_otp_step)
+
+
+class ReplaySet(ABC):
+    @abstractmethod
+    async def add(self, key: str, ttl: int) -> bool:
+        """Records a consumed code; False if it was already consumed."""
+
+    @abstractmethod
+    async def contains(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def hit(self, key: str, ttl: int) -> int:
+        """Increments a counter that expires ttl seconds after its first hit; returns the new count."""
+
+    @abstractmethod
+    async def reset(self, key: str) -> None:
+        """Drops a counter."""
+
+
+class MemoryReplaySet(ReplaySet):
+    def __init__(self, max_entries: int):
+        self._used: TTLCache[str, bool] = TTLCache(max_entries, settings.stateless_otp_step)
+        self._counters: TTLCache[str, List[int]] = TTLCache(max_entries, settings.stateless_otp_step)
+
+    async def add(self, key: str, ttl: int) -> bool:
+        if self._used.get(key):
+            return False
+        self._used.set(key, True, ttl)
+        return True
+
+    async def contains(self, key: str) -> bool:
+        return bool(self._used.get(key))
+
+    async def hit(self, key: str, ttl: int) -> int:
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = [0]
+            self._counters.set(key, counter, ttl)
+        counter[0] += 1
+        return counter[0]
+
+    async def reset(self, key: str) -> None:
+        self._counters.pop(key)
+
+
+class RedisReplaySet(ReplaySet):
+    PREFIX = "otp:used:"
+
+    async def add(self, key: str, ttl: int) -> bool:
+        redis = await start_redis()
+        return bool(await redis.set(self.PREFIX + key, 1, nx=True, ex=ttl))
+
+    async def contains(self, key: str) -> bool:
+        redis = await start_redis()
+        return bool(await redis.exists(self.PREFIX + key))
+
+    async def hit(self, key: str, ttl: int) -> int:
+        redis = await start_redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(self.PREFIX + key)
+            pipe.expire(self.PREFIX + key, ttl, nx=True)
+            count, _ = await pipe.execute()
+        return count
+
+    async def reset(self, key: str) -> None:
+        redis = await start_redis()
+        await redis.delete(self.PREFIX + key)
+
+
+def _replay_key(client_id: int, phone_number: str, step: int) -> str:
+    return f"{client_id}:{phone_number}:{step}"
+
+
+def _attempts_key(client_id: int, phone_number: str) -> str:
+    return f"attempts:{client_id}:{phone_number}"
+
+
+def _replay_ttl(step: int) -> int:
+    remaining = (step + settings.stateless_otp_valid_steps) * settings.stateless_otp_step - time.time()
+    return max(1, int(remaining) + 1)
+
+
+_replay_set: Optional[ReplaySet] = None
+
+
+def get_replay_set() -> ReplaySet:
+    global _replay_set
+
+    if _replay_set is None:
+        if settings.stateless_otp_replay_backend == "redis":
+            _replay_set = RedisReplaySet()
+        else:
+            _replay_set = MemoryReplaySet(settings.stateless_otp_replay_max_entries)
+    return _replay_set
+
+
+async def issue(client_id: int, secret: str, phone_number: str, length: int) -> Tuple[int, str, datetime]:
+    """
+    Derives the code for the current step.
+
+    :return: Tuple[int, str, datetime] - The otp_id, the code and its expiry.
+    :raises OTPRateLimitError: If this step's code was already consumed; the
+        same code would come out again, so the caller has to wait for the next step.
+    """
+    step = current_step()
+    if await get_replay_set().contains(_replay_key(client_id, phone_number, step)):
+        retry_after = (step + 1) * settings.stateless_otp_step - time.time()
+        raise OTPRateLimitError("stateless_otp", max(retry_after, 0.0))
+    return encode_otp_id(step, length), derive_code(secret, phone_number, step, length), expires_at(step)
+
+
+async def verify(
+    client_id: int,
+    secret: str,
+    phone_number: Optional[str],
+    otp_code: str,
+    otp_id: Optional[int] = None
+) -> int:
+    """
+    Checks a code against the one identified by otp_id and consumes it.
+
+    :return: int - The otp_id of the consumed code.
+    :raises InvalidOTPError, OTPExpiredError, OTPAlreadyUsedError
+    :raises OTPRateLimitError: If the number is out of verify attempts.
+    """
+    if phone_number is None or otp_id is None:
+        raise InvalidOTPError("phone_number and otp_id are required to verify this OTP")
+
+    # Counted before the check so concurrent guesses cannot overrun the limit;
+    # a successful verify resets it
+    window = settings.stateless_otp_valid_steps * settings.stateless_otp_step
+    attempts_key = _attempts_key(client_id, phone_number)
+    attempts = await get_replay_set().hit(attempts_key, window)
+    if attempts > settings.stateless_otp_max_attempts:
+        raise OTPRateLimitError("stateless_otp_verify", float(window))
+
+    step, length = decode_otp_id(otp_id)
+    if len(otp_code) != length or not otp_code.isdigit() or step > current_step():
+        raise InvalidOTPError("No matching OTP found")
+
+    expected = derive_code(secret, phone_number, step, length)
+    if not hmac.compare_digest(expected, otp_code):
+        raise InvalidOTPError("No matching OTP found")
+
+    if step < current_step() - settings.stateless_otp_valid_steps + 1:
+        raise OTPExpiredError("OTP has expired")
+    if not await get_replay_set().add(_replay_key(client_id, phone_number, step), _replay_ttl(step)):
+        raise OTPAlreadyUsedError("OTP has already been used")
+
+    await get_replay_set().reset(attempts_key)
+    return otp_id
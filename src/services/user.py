@@ -1,28 +1,73 @@
+from typing import Dict, List
+
 from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from src.database.models import User, UserStatus
 
+def upsert_users(phone_numbers: List[str], *columns):
+    """
+    SELECT of the given User columns for the given numbers, inserting the
+    missing users: INSERT ... ON CONFLICT DO NOTHING RETURNING in a CTE,
+    UNION ALL the rows that already existed. Existing users are only read,
+    so a send to a known number writes no tuple, WAL or row lock for them.
+
+    A user committed by a concurrent insert after the statement's snapshot
+    is neither inserted nor read; run the statement again for numbers that
+    did not come back (a new statement takes a new snapshot).
+    """
+    inserted = (
+        postgresql.insert(User)
+        .values([{"phone_number": p, "status": UserStatus.NOT_VERIFIED} for p in phone_numbers])
+        .on_conflict_do_nothing(index_elements=[User.phone_number])
+        .returning(*columns)
+        .cte("inserted_users")
+    )
+    # The same snapshot cannot see the rows inserted above, so nothing is returned twice
+    existing = select(*columns).where(User.phone_number.in_(phone_numbers))
+    return select(*inserted.c).union_all(existing)
+
 async def get_or_create_user(session: AsyncSession, phone_number: str) -> User:
+    """
+    Returns the user for a phone number, creating it if needed, in one
+    statement that is safe against concurrent creates.
 
-    stmt = select(User).where(User.phone_number == phone_number)
-    result = await session.execute(stmt)
-    user = result.scalar_one_or_none()
+    :param session: AsyncSession - SQLAlchemy session.
+    :param phone_number: str - Phone number of the user.
+    :return: User - The new or existing user.
+    """
+    stmt = select(User).from_statement(upsert_users([phone_number], *User.__table__.columns))
+    for _ in range(2):
+        result = await session.execute(stmt, execution_options={"populate_existing": True})
+        user = result.scalar_one_or_none()
+        if user is not None:
+            return user
+    raise RuntimeError(f"User for {phone_number} was neither created nor found")
 
-    if user:
-        return user
+async def get_or_create_users(session: AsyncSession, phone_numbers: List[str]) -> Dict[str, int]:
+    """
+    Resolves many phone numbers to user ids with one INSERT ... ON CONFLICT.
 
-    new_user = User(phone_number=phone_number, status=UserStatus.NOT_VERIFIED)
-    session.add(new_user)
-    
-    try:
-        await session.flush()
-        return new_user
-    except IntegrityError:
-        await session.rollback()
-        raise ValueError("User creation failed due to a unique constraint violation.")
+    :param session: AsyncSession - SQLAlchemy session.
+    :param phone_numbers: List[str] - Phone numbers to resolve.
+    :return: Dict[str, int] - User id per phone number.
+    """
+    # A number may only appear once per statement; sorting keeps the row lock
+    # order consistent between concurrent batches
+    unique = sorted(set(phone_numbers))
+    user_ids: Dict[str, int] = {}
+
+    for _ in range(2):
+        missing = [p for p in unique if p not in user_ids]
+        if not missing:
+            break
+        result = await session.execute(upsert_users(missing, User.id, User.phone_number))
+        user_ids.update((row.phone_number, row.id) for row in result)
+
+    return user_ids
 
 async def update_user_status(session: AsyncSession, user_id: int, new_status: UserStatus) -> User:
     result = await session.execute(select(User).filter(User.id == user_id))
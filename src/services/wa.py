@@ -1,49 +1,282 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
 import httpx
 
 from src.config import settings
+from src.exceptions.whatsapp import WhatsAppSendError, WhatsAppUnavailableError
+from src.services.wa_scheduler import (
+    PRIORITY_OTP,
+    get_delivery_scheduler,
+    start_delivery_scheduler,
+    stop_delivery_scheduler,
+)
+from src.utils.metrics import WHATSAPP_CIRCUIT_REJECTIONS, WHATSAPP_REQUEST_DURATION, WHATSAPP_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Worth another attempt; anything else 4xx is a problem with the request itself
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Count towards the breaker: the sender is throttled, Meta is failing, or the token is broken
+BREAKER_STATUSES = RETRYABLE_STATUSES | {401, 403}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_whatsapp_client() -> httpx.AsyncClient:
+    """
+    Builds the pooled Graph API client.
+
+    Connections are kept alive and, when HTTP/2 is enabled, multiplexed so that
+    consecutive sends reuse the same TLS session instead of paying a new handshake.
+    """
+    return httpx.AsyncClient(
+        base_url=f"{settings.whatsapp_api_url}/{settings.whatsapp_api_version}",
+        http2=settings.whatsapp_http2,
+        limits=httpx.Limits(
+            max_connections=settings.whatsapp_max_connections,
+            max_keepalive_connections=settings.whatsapp_max_keepalive_connections,
+            keepalive_expiry=settings.whatsapp_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings.whatsapp_connect_timeout,
+            read=settings.whatsapp_read_timeout,
+            write=settings.whatsapp_write_timeout,
+            pool=settings.whatsapp_pool_timeout,
+        ),
+    )
+
+
+async def start_whatsapp_client() -> httpx.AsyncClient:
+    global _client
+
+    if _client is None:
+        _client = create_whatsapp_client()
+        start_delivery_scheduler()
+    return _client
+
+
+async def close_whatsapp_client() -> None:
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        stop_delivery_scheduler()
+
+
+def get_whatsapp_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("WhatsApp client is not started. Call start_whatsapp_client() first.")
+    return _client
+
+
+@dataclass
+class CircuitBreaker:
+    """
+    Per-sender breaker. Opens after `threshold` consecutive failures, or at once
+    on a 429 for as long as Retry-After asks, then lets a single probe through
+    once `reset_timeout` has passed.
+    """
+    threshold: int
+    reset_timeout: float
+    failures: int = 0
+    open_until: float = 0.0
+    probing: bool = False
+
+    def allow(self, now: float) -> bool:
+        if self.failures < self.threshold and now >= self.open_until:
+            return True
+        if now < self.open_until or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def record_failure(self, now: float, retry_after: Optional[float] = None) -> None:
+        self.failures += 1
+        self.probing = False
+        if retry_after is not None:
+            self.open_until = max(self.open_until, now + retry_after)
+        if self.failures >= self.threshold:
+            self.open_until = max(self.open_until, now + self.reset_timeout)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
 
-async def send_whatsapp_template(phone_number, otp_code, phone_number_id, whatsapp_api_token, language="en_US"):
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{settings.whatsapp_api_url}/{settings.whatsapp_api_version}/{phone_number_id}/messages",
-            json={ 
-                "messaging_product": "whatsapp", 
-                "to": phone_number, 
-                "type": "template", 
-                "template": { 
-                    "name": "verify_template", 
-                    "language": { "code": language },
-                    "components": [
+def get_breaker(phone_number_id: str) -> CircuitBreaker:
+    breaker = _breakers.get(phone_number_id)
+    if breaker is None:
+        breaker = CircuitBreaker(settings.whatsapp_breaker_threshold, settings.whatsapp_breaker_reset_timeout)
+        _breakers[phone_number_id] = breaker
+    return breaker
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given (1-based) failed attempt."""
+    return random.uniform(0, min(settings.whatsapp_backoff_max, settings.whatsapp_backoff_base * 2 ** (attempt - 1)))
+
+
+def _response_body(response: httpx.Response) -> Dict[str, Any]:
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        body = {"error": {"message": response.text[:200] or f"HTTP {response.status_code}"}}
+    return body
+
+
+def _template_payload(phone_number: str, otp_code: str, language: str) -> Dict[str, Any]:
+    return {
+        "messaging_product": "whatsapp", 
+        "to": phone_number, 
+        "type": "template", 
+        "template": { 
+            "name": "verify_template", 
+            "language": { "code": language },
+            "components": [
+                {
+                    "type": "body", 
+                    "parameters": [
                         {
-                            "type": "body", 
-                            "parameters": [
-                                {
-                                    "type": "text",
-                                    "text": otp_code
-                                }
-                            ]
-                        },
+                            "type": "text",
+                            "text": otp_code
+                        }
+                    ]
+                },
+                {
+                    "type": "button",
+                    "sub_type": "url",
+                    "index": 0,
+                    "parameters": [
                         {
-                            "type": "button",
-                            "sub_type": "url",
-                            "index": 0,
-                            "parameters": [
-                                {
-                                    "type": "text",
-                                    "text": otp_code
-                                }
-                            ]
+                            "type": "text",
+                            "text": otp_code
                         }
                     ]
                 }
-            },
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {whatsapp_api_token}",
-            }
-        )
-
-        if response.status_code != 200:
-            print(f"Failed to send message, status code: {response.status_code}, response: {response.text}")
-        
-        return response.json()
+            ]
+        }
+    }
+
+
+async def send_whatsapp_template(
+    phone_number,
+    otp_code,
+    phone_number_id,
+    whatsapp_api_token,
+    language="en_US",
+    business_id=None,
+    priority=PRIORITY_OTP
+):
+    """
+    Sends the OTP template message.
+
+    429, 5xx and transport errors are retried with jittered exponential backoff
+    (or the Retry-After the Graph API asks for) up to WHATSAPP_MAX_ATTEMPTS, all
+    within WHATSAPP_DEADLINE seconds. Each sender has a circuit breaker so a
+    throttled or broken number fails fast instead of tying up requests. Every
+    attempt goes through the delivery scheduler (per-number rate limit, fair
+    share across businesses, OTP before bulk).
+
+    :return: dict - The Graph API response body.
+    :raises WhatsAppUnavailableError: If the sender's circuit breaker is open.
+    :raises WhatsAppSendError: If the message was not accepted.
+    """
+    client = get_whatsapp_client()
+    scheduler = get_delivery_scheduler()
+    breaker = get_breaker(phone_number_id)
+    payload = _template_payload(phone_number, otp_code, language)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {whatsapp_api_token}",
+    }
+    deadline = time.monotonic() + settings.whatsapp_deadline
+
+    attempt = 0
+    while True:
+        attempt += 1
+        now = time.monotonic()
+        if not breaker.allow(now):
+            WHATSAPP_CIRCUIT_REJECTIONS.labels(phone_number_id).inc()
+            raise WhatsAppUnavailableError(phone_number_id, max(breaker.open_until - now, 1.0))
+
+        # Waiting for a slot is local backlog, not a failure of the sender
+        try:
+            await asyncio.wait_for(
+                scheduler.acquire(business_id, phone_number_id, priority), timeout=max(deadline - now, 0.001)
+            )
+        except BaseException as e:
+            breaker.probing = False
+            if isinstance(e, asyncio.TimeoutError):
+                raise WhatsAppSendError(f"Timed out waiting for a send slot for {phone_number_id}")
+            raise
+
+        status = "error"
+        retry_after = None
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                client.post(f"/{phone_number_id}/messages", json=payload, headers=headers),
+                timeout=max(deadline - time.monotonic(), 0.001)
+            )
+            status = str(response.status_code)
+        except (httpx.TransportError, asyncio.TimeoutError) as e:
+            response = None
+            error = WhatsAppSendError(f"Graph API request failed: {e.__class__.__name__}")
+        except BaseException:
+            # Cancelled mid-probe: let the next request probe instead
+            breaker.probing = False
+            raise
+        finally:
+            scheduler.release()
+            WHATSAPP_REQUEST_DURATION.labels(phone_number_id, status).observe(time.perf_counter() - started)
+
+        if response is not None:
+            body = _response_body(response)
+            if response.status_code == 200 and "error" not in body:
+                breaker.record_success()
+                return body
+
+            logger.warning(
+                "WhatsApp send via %s failed with status %s: %s", phone_number_id, response.status_code, response.text
+            )
+            error = WhatsAppSendError(
+                f"Graph API returned {response.status_code}: {body.get('error')}", status_code=response.status_code
+            )
+            if response.status_code not in BREAKER_STATUSES:
+                breaker.record_success()
+                raise error
+            if response.status_code == 429:
+                retry_after = _retry_after(response)
+
+        breaker.record_failure(time.monotonic(), retry_after)
+        if response is not None and response.status_code not in RETRYABLE_STATUSES:
+            raise error
+
+        delay = retry_after if retry_after is not None else _backoff(attempt)
+        if attempt >= settings.whatsapp_max_attempts or time.monotonic() + delay >= deadline:
+            raise error
+
+        WHATSAPP_RETRIES.labels(phone_number_id).inc()
+        await asyncio.sleep(delay)
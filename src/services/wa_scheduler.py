@@ -0,0 +1,248 @@
+"""
+Fair-share scheduling of Graph API calls.
+
+Every send waits for a slot before it goes out. A slot needs:
+
+- a token from the sender's bucket (WHATSAPP_RATE_PER_NUMBER messages per
+  second per phone_number_id, bursts of WHATSAPP_RATE_BURST), so one number
+  never bursts past Meta's throughput limit; and
+- one of WHATSAPP_SCHEDULER_CONCURRENCY in-flight calls, handed out by
+  priority (OTP before bulk) and then by weighted fair queuing across
+  businesses, so one tenant's campaign cannot crowd out everyone else.
+
+Buckets are per process, so each process gets an equal share of the provider
+limit: WHATSAPP_RATE_PER_NUMBER (and the burst) divided by
+WHATSAPP_RATE_PROCESSES, which defaults to the number of web workers. Set it
+explicitly when standalone dispatcher.py processes send for the same numbers.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from src.config import settings, worker_count
+from src.utils.metrics import WHATSAPP_QUEUE_DEPTH, WHATSAPP_QUEUE_WAIT
+
+PRIORITY_OTP = 0
+PRIORITY_BULK = 1
+
+_PRIORITY_NAMES = {PRIORITY_OTP: "otp", PRIORITY_BULK: "bulk"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until the next token is available."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    finish: float
+    seq: int
+    business_id: Optional[int] = field(compare=False)
+    phone_number_id: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    removed: bool = field(default=False, compare=False)
+
+
+class DeliveryScheduler:
+    """
+    Start-time fair queuing: each business's sends get virtual finish tags
+    spaced 1 / weight apart, and the lowest tag whose sender has a token goes
+    next. A waiter whose number is out of tokens does not hold up the others.
+
+    Waiters are kept in one heap per sender, and the first waiter of every
+    sender in a heap of heads, so granting a slot costs O(log n) however long
+    the backlog is. Waiters that give up are only marked, and dropped when
+    they reach the front of their sender's heap.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        concurrency: int,
+        weights: Optional[Dict[int, float]] = None
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.weights = weights or {}
+
+        # Waiters per sender, and each sender's first waiter in a heap of heads
+        self._queues: Dict[str, List[_Waiter]] = {}
+        self._head_of: Dict[str, _Waiter] = {}
+        self._heads: List[_Waiter] = []
+        self._queued = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last_finish: Dict[Optional[int], float] = {}
+        self._virtual_time = 0.0
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    async def acquire(self, business_id: Optional[int], phone_number_id: str, priority: int = PRIORITY_OTP) -> None:
+        """Waits for a send slot for this sender; the caller must release() it once the call is done."""
+        start = max(self._virtual_time, self._last_finish.get(business_id, 0.0))
+        finish = start + 1 / self.weights.get(business_id, 1.0)
+        self._last_finish[business_id] = finish
+
+        waiter = _Waiter(
+            priority, finish, next(self._seq), business_id, phone_number_id,
+            asyncio.get_running_loop().create_future(), time.monotonic()
+        )
+        self._push(waiter)
+        WHATSAPP_QUEUE_DEPTH.labels(_PRIORITY_NAMES[priority]).inc()
+        self._pump()
+
+        try:
+            await waiter.future
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up; hand the slot back
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._pump()
+
+    def _push(self, waiter: _Waiter) -> None:
+        heapq.heappush(self._queues.setdefault(waiter.phone_number_id, []), waiter)
+        self._queued += 1
+        self._refresh(waiter.phone_number_id)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter.removed:
+            return
+        waiter.removed = True
+        self._queued -= 1
+        WHATSAPP_QUEUE_DEPTH.labels(_PRIORITY_NAMES[waiter.priority]).dec()
+        if self._head_of.get(waiter.phone_number_id) is waiter:
+            self._refresh(waiter.phone_number_id)
+
+    def _refresh(self, phone_number_id: str) -> None:
+        """
+        Makes the sender's first live waiter its entry in the heap of heads.
+        Entries left behind are stale and skipped when popped.
+        """
+        queue = self._queues[phone_number_id]
+        while queue and queue[0].removed:
+            heapq.heappop(queue)
+        if not queue:
+            del self._queues[phone_number_id]
+            self._head_of.pop(phone_number_id, None)
+        elif self._head_of.get(phone_number_id) is not queue[0]:
+            self._head_of[phone_number_id] = queue[0]
+            heapq.heappush(self._heads, queue[0])
+
+    def _bucket(self, phone_number_id: str) -> TokenBucket:
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[phone_number_id] = bucket
+        return bucket
+
+    def _pump(self) -> None:
+        """Grants every slot that can be granted now and arms a timer for the next token."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        now = time.monotonic()
+        next_token: Optional[float] = None
+        blocked: List[_Waiter] = []
+
+        while self._heads and self._in_flight < self.concurrency:
+            head = heapq.heappop(self._heads)
+            if self._head_of.get(head.phone_number_id) is not head:
+                continue
+
+            bucket = self._bucket(head.phone_number_id)
+            if not bucket.take(now):
+                # Later waiters for the same number must not jump ahead of this one
+                blocked.append(head)
+                wait = bucket.wait_time(now)
+                next_token = wait if next_token is None else min(next_token, wait)
+                continue
+
+            heapq.heappop(self._queues[head.phone_number_id])
+            self._refresh(head.phone_number_id)
+
+            self._in_flight += 1
+            self._queued -= 1
+            self._virtual_time = max(self._virtual_time, head.finish - 1 / self.weights.get(head.business_id, 1.0))
+            name = _PRIORITY_NAMES[head.priority]
+            WHATSAPP_QUEUE_DEPTH.labels(name).dec()
+            WHATSAPP_QUEUE_WAIT.labels(name).observe(now - head.enqueued_at)
+            head.future.set_result(None)
+
+        for head in blocked:
+            heapq.heappush(self._heads, head)
+
+        if next_token is not None and self._in_flight < self.concurrency:
+            self._timer = asyncio.get_running_loop().call_later(next_token, self._pump)
+
+
+_scheduler: Optional[DeliveryScheduler] = None
+
+
+def rate_share() -> int:
+    """Number of processes the per-number limit is split between."""
+    return settings.whatsapp_rate_processes or worker_count()
+
+
+def start_delivery_scheduler() -> DeliveryScheduler:
+    global _scheduler
+
+    if _scheduler is None:
+        processes = rate_share()
+        _scheduler = DeliveryScheduler(
+            rate=settings.whatsapp_rate_per_number / processes,
+            burst=max(1.0, settings.whatsapp_rate_burst / processes),
+            concurrency=settings.whatsapp_scheduler_concurrency,
+            weights=settings.whatsapp_business_weights,
+        )
+    return _scheduler
+
+
+def stop_delivery_scheduler() -> None:
+    global _scheduler
+
+    if _scheduler is not None and _scheduler._timer is not None:
+        _scheduler._timer.cancel()
+    _scheduler = None
+
+
+def get_delivery_scheduler() -> DeliveryScheduler:
+    if _scheduler is None:
+        raise RuntimeError("Delivery scheduler is not started. Call start_delivery_scheduler() first.")
+    return _scheduler
@@ -0,0 +1,156 @@
+"""
+Admission control for the OTP endpoints.
+
+Each route listed in ADMISSION_ROUTE_LIMITS gets at most that many requests in
+flight; extra requests wait in a queue for up to ADMISSION_QUEUE_TIMEOUT
+seconds (ADMISSION_PRIORITY_QUEUE_TIMEOUT for priority routes) and are then
+answered with an immediate 503 and Retry-After instead of piling up behind a
+saturated dependency.
+
+Before queueing, requests are checked against live overload signals:
+
+- the database pool has no free connection (checkouts would have to wait);
+- the WhatsApp delivery scheduler has ADMISSION_WHATSAPP_QUEUE_LIMIT or more
+  sends waiting for a slot.
+
+While a signal is up, requests to non-priority routes are shed straight away,
+so routes in ADMISSION_PRIORITY_ROUTES (verify, which finishes journeys whose
+send was already paid for) keep the capacity that is left.
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from src.config import settings
+from src.database import engine
+from src.services.wa_scheduler import get_delivery_scheduler
+from src.utils.metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTIONS
+
+
+class RouteGate:
+    """Bounded number of concurrent requests for one route, with a FIFO wait queue."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiting: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Waits up to timeout seconds for a slot; False if none became free in time."""
+        if self.in_flight < self.limit and not self._waiting:
+            self.in_flight += 1
+            return True
+        if timeout <= 0:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Granted just as the deadline passed
+                return True
+            self._waiting.remove(waiter)
+            return False
+        except BaseException:
+            if waiter.done():
+                self.release()
+            else:
+                self._waiting.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        while self._waiting and self.in_flight < self.limit:
+            waiter = self._waiting.popleft()
+            self.in_flight += 1
+            waiter.set_result(None)
+
+
+def _pool_saturated() -> bool:
+    pool = engine.sync_engine.pool
+    if not hasattr(pool, "checkedout"):
+        # NullPool (pgbouncer profile): pooling happens in PgBouncer
+        return False
+    return pool.checkedout() >= settings.db_pool_size + settings.db_max_overflow
+
+
+def _whatsapp_backlogged() -> bool:
+    if settings.admission_whatsapp_queue_limit <= 0:
+        return False
+    try:
+        scheduler = get_delivery_scheduler()
+    except RuntimeError:
+        return False
+    return scheduler.queued >= settings.admission_whatsapp_queue_limit
+
+
+def overload_reason() -> Optional[str]:
+    """Name of the first overload signal that is up, or None."""
+    if _pool_saturated():
+        return "db_pool"
+    if _whatsapp_backlogged():
+        return "whatsapp_queue"
+    return None
+
+
+class AdmissionMiddleware:
+    """Admits, queues or sheds requests to the configured routes (see the module docstring)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.gates: Dict[str, RouteGate] = {
+            path: RouteGate(limit) for path, limit in settings.admission_route_limits.items()
+        }
+        self.priority_routes = set(settings.admission_priority_routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"].rstrip("/") or "/"
+        gate = self.gates.get(path)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        priority = path in self.priority_routes
+        if not priority:
+            reason = overload_reason()
+            if reason is not None:
+                await self._reject(path, reason, send)
+                return
+
+        timeout = settings.admission_priority_queue_timeout if priority else settings.admission_queue_timeout
+        if not await gate.acquire(timeout):
+            await self._reject(path, "queue_timeout", send)
+            return
+
+        ADMISSION_IN_FLIGHT.labels(path).inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ADMISSION_IN_FLIGHT.labels(path).dec()
+            gate.release()
+
+    async def _reject(self, path: str, reason: str, send) -> None:
+        ADMISSION_REJECTIONS.labels(path, reason).inc()
+        body = json.dumps({"detail": "Service is overloaded, retry later."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.admission_retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
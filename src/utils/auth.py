@@ -1,3 +1,8 @@
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Optional
+
 from fastapi import Depends, HTTPException, Security
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -5,33 +10,91 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_session
 from src.database.models import Admin
 from src.config import settings
-from src.services.admin import get_admin
+from src.services.admin import get_admin_token_version
+from src.utils.cache import TTLCache
 
 from datetime import datetime, timedelta
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/token")
 
+ADMIN_ROLE = "admin"
+
+
+@dataclass(frozen=True)
+class AuthenticatedAdmin:
+    """The admin a request is authenticated as, built from verified token claims."""
+    id: int
+    email: str
+    role: str
+    token_version: int
+
+
+# Verified tokens, keyed by SHA-256 of the token and kept until the token expires
+_token_cache: TTLCache[str, AuthenticatedAdmin] = TTLCache(
+    settings.admin_token_cache_size, settings.access_token_expire_minutes * 60
+)
+# Current token version per admin id; the only thing that needs the database,
+# re-read at most every admin_token_revalidate_seconds per admin
+_token_versions: TTLCache[int, int] = TTLCache(
+    settings.admin_token_cache_size, settings.admin_token_revalidate_seconds
+)
+
+
 async def create_jwt_token(admin: Admin) -> str:
-    expiration = datetime.now() + timedelta(seconds=settings.access_token_expire_minutes * 60)
+    expiration = datetime.utcnow() + timedelta(seconds=settings.access_token_expire_minutes * 60)
     payload = {
         "sub": admin.email,
+        "aid": admin.id,
+        "role": ADMIN_ROLE,
+        "ver": admin.token_version,
         "exp": expiration
     }
     return jwt.encode(payload, settings.jwt_secret, algorithm="HS256")
 
+
+def invalidate_admin_tokens(admin_id: int) -> None:
+    """Forgets the cached token version of an admin, e.g. after revoking its tokens."""
+    _token_versions.pop(admin_id)
+
+
+def _decode_token(token: str) -> Optional[AuthenticatedAdmin]:
+    payload = jwt.decode(token, settings.jwt_secret, algorithms=["HS256"])
+    admin_id, email = payload.get("aid"), payload.get("sub")
+    if admin_id is None or email is None or payload.get("role") != ADMIN_ROLE:
+        return None
+
+    admin = AuthenticatedAdmin(
+        id=admin_id, email=email, role=ADMIN_ROLE, token_version=payload.get("ver", 0)
+    )
+    _token_cache.set(hashlib.sha256(token.encode()).hexdigest(), admin, ttl=payload["exp"] - time.time())
+    return admin
+
+
+async def _current_token_version(session: AsyncSession, admin_id: int) -> Optional[int]:
+    version = _token_versions.get(admin_id)
+    if version is None:
+        version = await get_admin_token_version(session, admin_id)
+        if version is not None:
+            _token_versions.set(admin_id, version)
+    return version
+
+
 async def get_current_admin(
     token: str = Security(oauth2_scheme), session: AsyncSession = Depends(get_session)
-):
+) -> AuthenticatedAdmin:
 
     try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=["HS256"])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication token")
-        
-        admin = await get_admin(session, email)
+        admin = _token_cache.get(hashlib.sha256(token.encode()).hexdigest())
+        if admin is None:
+            admin = _decode_token(token)
         if admin is None:
-            raise HTTPException(status_code=401, detail="Admin not found")
-        return admin
+            raise HTTPException(status_code=401, detail="Invalid authentication token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
+
+    version = await _current_token_version(session, admin.id)
+    if version is None:
+        raise HTTPException(status_code=401, detail="Admin not found")
+    if version != admin.token_version:
+        raise HTTPException(status_code=401, detail="Authentication token has been revoked")
+    return admin
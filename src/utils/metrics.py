@@ -0,0 +1,175 @@
+"""
+Prometheus metrics.
+
+With several workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory
+(main.py does this automatically) so every worker writes its samples there and
+/metrics aggregates all of them, whichever worker serves the scrape.
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+WHATSAPP_REQUEST_DURATION = Histogram(
+    "whatsapp_request_duration_seconds",
+    "Graph API call latency by sending phone number and response status",
+    ["phone_number_id", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+WHATSAPP_RETRIES = Counter(
+    "whatsapp_retries_total", "Graph API calls retried after a 429, 5xx or transport error", ["phone_number_id"]
+)
+WHATSAPP_CIRCUIT_REJECTIONS = Counter(
+    "whatsapp_circuit_rejections_total", "Sends refused because the sender's circuit breaker is open", ["phone_number_id"]
+)
+WHATSAPP_QUEUE_DEPTH = Gauge(
+    "whatsapp_queue_depth", "Sends waiting for a delivery scheduler slot", ["priority"],
+    multiprocess_mode="livesum",
+)
+WHATSAPP_QUEUE_WAIT = Histogram(
+    "whatsapp_queue_wait_seconds", "Time sends waited for a delivery scheduler slot", ["priority"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Database connections currently checked out of the pool",
+    multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections open beyond DB_POOL_SIZE",
+    multiprocess_mode="livesum",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight_requests", "Requests admitted and in progress per admission-controlled route", ["route"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total", "Requests shed with a 503 by admission control", ["route", "reason"]
+)
+OTP_SENT = Counter("otp_sent_total", "OTPs issued", ["client_id"])
+OTP_VERIFIED = Counter("otp_verified_total", "OTPs successfully verified", ["client_id"])
+OTP_EXPIRED = Counter("otp_expired_total", "Verifications rejected because the OTP had expired", ["client_id"])
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between a scheduled event loop wake-up and when it actually ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+def render_metrics() -> bytes:
+    """Serializes all metrics, aggregated over workers in multiprocess mode."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_worker_dead() -> None:
+    """Drops the live gauges of this worker from the multiprocess aggregate."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    Records request latency labelled with the route template (e.g.
+    /api/v1/otp/send) rather than the raw path, to keep cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Tracks pool checkouts through pool events, so it also works without a QueuePool."""
+    pool = engine.sync_engine.pool
+
+    def update_overflow() -> None:
+        if hasattr(pool, "overflow"):
+            DB_POOL_OVERFLOW.set(max(pool.overflow(), 0))
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+        update_overflow()
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+        update_overflow()
+
+
+async def _measure_event_loop_lag(interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - scheduled, 0.0))
+
+
+def start_event_loop_monitor(interval: float) -> None:
+    global _lag_task
+
+    if _lag_task is None:
+        _lag_task = asyncio.create_task(_measure_event_loop_lag(interval))
+
+
+async def stop_event_loop_monitor() -> None:
+    global _lag_task
+
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
@@ -0,0 +1,113 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (hundreds of milliseconds at the default cost) and
+would stall every in-flight request on the worker if called directly from a
+coroutine. Hashing runs in a small dedicated thread pool instead (the bcrypt
+library releases the GIL), with a bounded queue so that a burst of logins is
+refused with PasswordHasherBusyError rather than piling up.
+
+Pick BCRYPT_ROUNDS for your hardware with::
+
+    python -m src.utils.passwords benchmark --target-ms 250
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from passlib.context import CryptContext
+
+from src.config import settings
+from src.exceptions.auth import PasswordHasherBusyError
+
+T = TypeVar("T")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_in_flight = 0
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.password_hash_workers, thread_name_prefix="password-hash"
+        )
+    return _executor
+
+
+async def _run(func: Callable[..., T], *args) -> T:
+    global _in_flight
+
+    if _in_flight >= settings.password_hash_workers + settings.password_hash_queue_size:
+        raise PasswordHasherBusyError("Password hashing capacity exhausted, try again shortly")
+
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        _in_flight -= 1
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hashes a password with bcrypt in the hashing pool.
+
+    :raises PasswordHasherBusyError: If the pool and its queue are full.
+    """
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """
+    Checks a password against its bcrypt hash in the hashing pool.
+
+    :raises PasswordHasherBusyError: If the pool and its queue are full.
+    """
+    return await _run(pwd_context.verify, password, hashed_password)
+
+
+def shutdown_password_hasher() -> None:
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def benchmark(target_ms: float, min_rounds: int = 10, max_rounds: int = 15, samples: int = 3) -> int:
+    """Prints the hashing time per bcrypt cost and returns the highest cost within target_ms."""
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        started = time.perf_counter()
+        for _ in range(samples):
+            context.hash("benchmark-password")
+        elapsed_ms = (time.perf_counter() - started) * 1000 / samples
+
+        print(f"rounds={rounds}: {elapsed_ms:.0f} ms")
+        if elapsed_ms <= target_ms:
+            best = rounds
+        else:
+            break
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.utils.passwords", description="Password hashing tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    benchmark_parser = subparsers.add_parser("benchmark", help="Find the bcrypt cost that fits a latency budget")
+    benchmark_parser.add_argument("--target-ms", type=float, default=250.0, help="Latency budget per hash")
+
+    args = parser.parse_args()
+    if args.command == "benchmark":
+        rounds = benchmark(args.target_ms)
+        print(f"Recommended: BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == "__main__":
+    main()
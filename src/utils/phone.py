@@ -0,0 +1,183 @@
+"""
+Phone number normalization to E.164 (+<country code><national number>).
+
+Numbers are matched against a compiled table of ITU country calling codes,
+with national number lengths for the countries where they are fixed enough to
+check and national trunk prefixes where one is used. No network or metadata
+download is involved. Input may contain the usual separators (spaces, dashes,
+dots, parentheses) and is read as:
+
+- ``+<digits>`` or ``00<digits>``: international;
+- other ``<digits>`` with PHONE_DEFAULT_COUNTRY_CODE set: national (after
+  dropping that country's trunk prefix) if they have a valid national length;
+- otherwise ``<digits>`` that form a valid international number are read as
+  one, so ``14155550123`` and ``+14155550123`` are the same user.
+
+A trunk prefix written after the country code (``+44 (0)20 ...``) is dropped.
+Results are kept in a bounded LRU (PHONE_CACHE_SIZE entries), so hot numbers
+skip the parsing altogether.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from src.config import settings
+from src.exceptions.phone import InvalidPhoneNumberError
+
+MAX_DIGITS = 15
+MIN_NATIONAL_DIGITS = 4
+
+_SEPARATORS = re.compile(r"[\s\-.()/]")
+_RAW = re.compile(r"^\+?\d+$")
+
+
+@dataclass(frozen=True)
+class CountryRule:
+    code: str
+    min_length: int
+    max_length: int
+    trunk_prefix: Optional[str] = None
+
+
+# Assigned country calling codes (ITU-T E.164). Codes are prefix-free, so a
+# number matches at most one of them.
+_CALLING_CODES = (
+    "1 7 20 27 30 31 32 33 34 36 39 40 41 43 44 45 46 47 48 49 51 52 53 54 55 56 57 58 "
+    "60 61 62 63 64 65 66 81 82 84 86 90 91 92 93 94 95 98 "
+    "211 212 213 216 218 220 221 222 223 224 225 226 227 228 229 230 231 232 233 234 235 "
+    "236 237 238 239 240 241 242 243 244 245 246 247 248 249 250 251 252 253 254 255 256 "
+    "257 258 260 261 262 263 264 265 266 267 268 269 290 291 297 298 299 "
+    "350 351 352 353 354 355 356 357 358 359 370 371 372 373 374 375 376 377 378 379 380 "
+    "381 382 383 385 386 387 389 420 421 423 "
+    "500 501 502 503 504 505 506 507 508 509 590 591 592 593 594 595 596 597 598 599 "
+    "670 672 673 674 675 676 677 678 679 680 681 682 683 685 686 687 688 689 690 691 692 "
+    "800 808 850 852 853 855 856 870 878 880 881 882 883 886 888 "
+    "960 961 962 963 964 965 966 967 968 970 971 972 973 974 975 976 977 979 "
+    "992 993 994 995 996 998"
+).split()
+
+# (min, max national number length, trunk prefix) where known; other codes
+# accept anything that fits in 15 digits
+_KNOWN_RULES: Dict[str, Tuple[int, int, Optional[str]]] = {
+    "1": (10, 10, "1"),
+    "7": (10, 10, "8"),
+    "20": (8, 10, "0"),
+    "27": (9, 9, "0"),
+    "30": (10, 10, None),
+    "31": (9, 9, "0"),
+    "32": (8, 9, "0"),
+    "33": (9, 9, "0"),
+    "34": (9, 9, None),
+    "36": (8, 9, "06"),
+    "39": (6, 11, None),
+    "40": (9, 9, "0"),
+    "41": (9, 9, "0"),
+    "43": (4, 13, "0"),
+    "44": (7, 10, "0"),
+    "45": (8, 8, None),
+    "46": (7, 13, "0"),
+    "47": (8, 8, None),
+    "48": (9, 9, None),
+    "49": (6, 13, "0"),
+    "52": (10, 10, None),
+    "54": (10, 11, "0"),
+    "55": (10, 11, "0"),
+    "56": (9, 9, None),
+    "57": (10, 10, None),
+    "60": (8, 10, "0"),
+    "61": (9, 9, "0"),
+    "62": (8, 12, "0"),
+    "63": (8, 10, "0"),
+    "64": (8, 10, "0"),
+    "65": (8, 8, None),
+    "66": (8, 9, "0"),
+    "81": (9, 10, "0"),
+    "82": (8, 10, "0"),
+    "84": (9, 10, "0"),
+    "86": (9, 11, "0"),
+    "90": (10, 10, "0"),
+    "91": (10, 10, "0"),
+    "92": (9, 10, "0"),
+    "98": (10, 10, "0"),
+    "234": (8, 10, "0"),
+    "254": (9, 9, "0"),
+    "966": (9, 9, "0"),
+    "971": (8, 9, "0"),
+    "972": (8, 9, "0"),
+}
+
+
+def _compile_rules() -> Dict[str, CountryRule]:
+    rules = {}
+    for code in _CALLING_CODES:
+        min_length, max_length, trunk_prefix = _KNOWN_RULES.get(
+            code, (MIN_NATIONAL_DIGITS, MAX_DIGITS - len(code), None)
+        )
+        rules[code] = CountryRule(code, min_length, max_length, trunk_prefix)
+    return rules
+
+
+RULES: Dict[str, CountryRule] = _compile_rules()
+_CODE_LENGTHS = sorted({len(code) for code in RULES})
+
+
+def _split(digits: str) -> Optional[Tuple[CountryRule, str]]:
+    """Splits international digits into (country rule, national number) if they form a valid number."""
+    if len(digits) > MAX_DIGITS:
+        return None
+
+    for size in _CODE_LENGTHS:
+        rule = RULES.get(digits[:size])
+        if rule is None:
+            continue
+
+        national = digits[size:]
+        if rule.trunk_prefix and national.startswith(rule.trunk_prefix):
+            stripped = national[len(rule.trunk_prefix):]
+            if rule.min_length <= len(stripped) <= rule.max_length:
+                national = stripped
+        if rule.min_length <= len(national) <= rule.max_length:
+            return rule, national
+        return None
+    return None
+
+
+def _normalize(raw: str, default_country_code: Optional[str]) -> str:
+    number = _SEPARATORS.sub("", raw)
+    if not _RAW.match(number):
+        raise InvalidPhoneNumberError("Phone number may only contain digits, separators and a leading +")
+
+    default = RULES.get(default_country_code) if default_country_code else None
+
+    if number.startswith("+"):
+        parsed = _split(number[1:])
+    elif number.startswith("00"):
+        parsed = _split(number[2:])
+    else:
+        parsed = None
+        if default is not None:
+            national = number
+            if default.trunk_prefix and national.startswith(default.trunk_prefix):
+                national = national[len(default.trunk_prefix):]
+            parsed = _split(default.code + national)
+        if parsed is None:
+            parsed = _split(number)
+
+    if parsed is None:
+        raise InvalidPhoneNumberError("Phone number is not a valid international number")
+
+    rule, national = parsed
+    return f"+{rule.code}{national}"
+
+
+@lru_cache(maxsize=settings.phone_cache_size)
+def normalize_phone_number(raw: str) -> str:
+    """
+    Canonicalizes a phone number to E.164.
+
+    :param raw: str - Phone number as entered.
+    :return: str - The number as +<country code><national number>.
+    :raises InvalidPhoneNumberError: If the number cannot be read as a valid number.
+    """
+    return _normalize(raw, settings.phone_default_country_code)
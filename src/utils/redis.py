@@ -0,0 +1,40 @@
+from typing import Optional
+
+import redis.asyncio as redis
+
+from src.config import settings
+
+_client: Optional[redis.Redis] = None
+
+
+async def start_redis() -> redis.Redis:
+    """
+    Creates the shared Redis client on first use.
+
+    Any server speaking the Redis protocol works (Redis, Valkey, KeyDB, or a
+    local stand-in for development).
+    """
+    global _client
+
+    if _client is None:
+        _client = redis.from_url(
+            settings.redis_url,
+            decode_responses=True,
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout,
+        )
+    return _client
+
+
+async def close_redis() -> None:
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_redis() -> redis.Redis:
+    if _client is None:
+        raise RuntimeError("Redis client is not started. Call start_redis() first.")
+    return _client
@@ -0,0 +1,357 @@
+"""
+Lightweight request tracing.
+
+Every request gets a trace; code wraps its phases in ``with span("name"):``.
+Phase durations are summed per name into a Server-Timing response header, which
+costs a couple of clock reads per phase. A sampled fraction of traces
+(TRACING_SAMPLE_RATE) is exported as OTLP/JSON spans, either appended to a file (one ExportTraceServiceRequest
+per line) or POSTed to a local collector's OTLP/HTTP endpoint. An incoming W3C
+traceparent always supplies the trace id and parent span, but its sampled flag
+is only followed with TRACING_TRUST_UPSTREAM_SAMPLING, i.e. when the app is
+reachable only through a proxy that sets it; otherwise any client could force
+every one of its requests to be exported.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    kind: int = SPAN_KIND_INTERNAL
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: bool = False
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    sampled: bool
+    remote_parent_id: Optional[str] = None
+    spans: List[Span] = field(default_factory=list)
+    # name -> (total seconds, count), for Server-Timing
+    phases: Dict[str, Tuple[float, int]] = field(default_factory=dict)
+
+    def record_phase(self, name: str, seconds: float) -> None:
+        total, count = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + seconds, count + 1)
+
+    def server_timing(self) -> str:
+        entries = []
+        for name, (total, count) in self.phases.items():
+            entry = f"{name};dur={total * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count}x"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span_id: ContextVar[Optional[str]] = ContextVar("current_span_id", default=None)
+
+_exporter: Optional["SpanExporter"] = None
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def _parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """Parses a W3C traceparent header into (trace id, parent span id, sampled)."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """
+    Times a phase of the current request. Outside a request this does nothing.
+    Spans are only materialized for sampled traces.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    record = None
+    token = None
+    if trace.sampled:
+        record = Span(name, _new_id(8), _current_span_id.get(), time.time_ns(), attributes=attributes)
+        token = _current_span_id.set(record.span_id)
+
+    try:
+        yield
+    except BaseException:
+        if record is not None:
+            record.error = True
+        raise
+    finally:
+        trace.record_phase(name, time.perf_counter() - started)
+        if record is not None:
+            record.end_ns = time.time_ns()
+            trace.spans.append(record)
+            _current_span_id.reset(token)
+
+
+class TracingMiddleware:
+    """Starts a trace per HTTP request and adds the Server-Timing header to the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = _parse_traceparent(dict(scope["headers"]).get(b"traceparent", b"").decode("latin-1"))
+        if incoming is not None and settings.tracing_trust_upstream_sampling:
+            sampled = incoming[2]
+        else:
+            sampled = random.random() < settings.tracing_sample_rate
+        sampled = sampled and _exporter is not None
+
+        if incoming is not None:
+            trace = Trace(trace_id=incoming[0], sampled=sampled, remote_parent_id=incoming[1])
+        else:
+            trace = Trace(trace_id=_new_id(16), sampled=sampled)
+
+        root = Span(
+            f"{scope['method']} {scope['path']}", _new_id(8), trace.remote_parent_id, time.time_ns(),
+            kind=SPAN_KIND_SERVER
+        )
+        started = time.perf_counter()
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span_id.set(root.span_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                if settings.tracing_server_timing:
+                    trace.record_phase("total", time.perf_counter() - started)
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            root.error = True
+            raise
+        finally:
+            _current_span_id.reset(span_token)
+            _current_trace.reset(trace_token)
+
+            if sampled:
+                route = scope.get("route")
+                if route is not None:
+                    root.name = f"{scope['method']} {route.path}"
+                    root.attributes["http.route"] = route.path
+                root.attributes["http.method"] = scope["method"]
+                root.end_ns = time.time_ns()
+                root.error = root.error or root.attributes.get("http.status_code", 500) >= 500
+                trace.spans.append(root)
+                _exporter.submit(trace)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Counts every statement executed on behalf of a request towards its "db" phase."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is not None:
+            conn.info.setdefault("trace_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current_trace.get()
+        starts = conn.info.get("trace_query_start")
+        if trace is not None and starts:
+            trace.record_phase("db", time.perf_counter() - starts.pop())
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(traces: List[Trace]) -> Dict[str, Any]:
+    """Builds an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": s.kind,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [{"key": k, "value": _attribute_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2 if s.error else 0},
+            }
+            if s.parent_id:
+                otlp_span["parentSpanId"] = s.parent_id
+            spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": settings.tracing_service_name}}
+            ]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]
+    }
+
+
+class SpanExporter(ABC):
+    """
+    Buffers sampled traces and exports them in batches from a background task,
+    so requests never wait on the exporter. Traces are dropped when the buffer is full.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 2.0, queue_size: int = 2048):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "asyncio.Queue[Trace]" = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, trace: Trace) -> None:
+        try:
+            self._queue.put_nowait(trace)
+        except asyncio.QueueFull:
+            pass
+
+    @abstractmethod
+    async def export(self, payload: Dict[str, Any]) -> None:
+        """Sends one OTLP/JSON ExportTraceServiceRequest."""
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        while not self._queue.empty():
+            await self._export(self._drain())
+
+    def _drain(self) -> List[Trace]:
+        batch = []
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            while not self._queue.empty():
+                await self._export(self._drain())
+
+    async def _export(self, batch: List[Trace]) -> None:
+        try:
+            await self.export(to_otlp(batch))
+        except Exception:
+            logger.exception("Failed to export %d traces", len(batch))
+
+
+class FileSpanExporter(SpanExporter):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def _append(self, line: str) -> None:
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    async def export(self, payload: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._append, json.dumps(payload, separators=(",", ":")))
+
+
+class OTLPHttpSpanExporter(SpanExporter):
+    def __init__(self, endpoint: str, **kwargs):
+        super().__init__(**kwargs)
+        self.endpoint = endpoint
+        self._client = httpx.AsyncClient(timeout=5.0)
+
+    async def export(self, payload: Dict[str, Any]) -> None:
+        response = await self._client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self._client.aclose()
+
+
+def create_span_exporter() -> Optional[SpanExporter]:
+    if settings.tracing_exporter == "file":
+        return FileSpanExporter(settings.tracing_file)
+    if settings.tracing_exporter == "otlp":
+        return OTLPHttpSpanExporter(settings.tracing_otlp_endpoint)
+    return None
+
+
+def start_span_exporter() -> None:
+    global _exporter
+
+    if _exporter is None:
+        _exporter = create_span_exporter()
+        if _exporter is not None:
+            _exporter.start()
+
+
+async def stop_span_exporter() -> None:
+    global _exporter
+
+    if _exporter is not None:
+        await _exporter.stop()
+        _exporter = None
@@ -0,0 +1,92 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.utils import admission
+from src.utils.admission import RouteGate
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_admits_up_to_the_limit():
+    gate = RouteGate(limit=2)
+
+    assert await gate.acquire(timeout=0)
+    assert await gate.acquire(timeout=0)
+    assert not await gate.acquire(timeout=0)
+    assert gate.in_flight == 2
+
+
+async def test_waiter_gets_a_released_slot():
+    gate = RouteGate(limit=1)
+    await gate.acquire(timeout=0)
+
+    waiter = asyncio.ensure_future(gate.acquire(timeout=1))
+    await asyncio.sleep(0)
+    assert gate.queued == 1
+
+    gate.release()
+    assert await waiter
+    assert gate.in_flight == 1
+    assert gate.queued == 0
+
+
+async def test_wait_times_out():
+    gate = RouteGate(limit=1)
+    await gate.acquire(timeout=0)
+
+    assert not await gate.acquire(timeout=0.05)
+    assert gate.queued == 0
+    assert gate.in_flight == 1
+
+
+async def test_waiters_are_served_in_order():
+    gate = RouteGate(limit=1)
+    await gate.acquire(timeout=0)
+    admitted = []
+
+    async def wait(name):
+        await gate.acquire(timeout=1)
+        admitted.append(name)
+
+    waiters = [asyncio.ensure_future(wait(name)) for name in "abc"]
+    await asyncio.sleep(0)
+
+    # A newcomer does not overtake the queue even when a slot is free
+    gate.release()
+    assert not await gate.acquire(timeout=0)
+
+    for _ in "abc":
+        await asyncio.sleep(0)
+        gate.release()
+    await asyncio.gather(*waiters)
+    assert admitted == ["a", "b", "c"]
+
+
+async def test_cancelled_waiter_leaves_the_queue():
+    gate = RouteGate(limit=1)
+    await gate.acquire(timeout=0)
+
+    waiter = asyncio.ensure_future(gate.acquire(timeout=1))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert gate.queued == 0
+    gate.release()
+    assert gate.in_flight == 0
+
+
+async def test_shed_requests_carry_cors_headers(monkeypatch):
+    from src.app import app
+
+    monkeypatch.setattr(admission, "overload_reason", lambda: "db_pool")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/api/v1/otp/send", headers={"Origin": "https://example.com"})
+
+    assert response.status_code == 503
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from src.config import settings
+from src.utils import auth
+from src.utils.auth import create_jwt_token, get_current_admin, invalidate_admin_tokens
+
+pytestmark = pytest.mark.anyio
+
+ADMIN = SimpleNamespace(id=3, email="admin@example.com", token_version=0)
+
+
+class Versions(dict):
+    lookups: list
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    """Token versions as stored in the admins table, with a log of the lookups."""
+    versions = Versions({ADMIN.id: 0})
+    versions.lookups = lookups = []
+
+    async def get_admin_token_version(session, admin_id):
+        lookups.append(admin_id)
+        return versions.get(admin_id)
+
+    monkeypatch.setattr(auth, "get_admin_token_version", get_admin_token_version)
+    auth._token_cache.clear()
+    auth._token_versions.clear()
+    yield versions
+    auth._token_cache.clear()
+    auth._token_versions.clear()
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    calls = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth.jwt, "decode", counting_decode)
+    return calls
+
+
+async def rejection(token):
+    with pytest.raises(HTTPException) as raised:
+        await get_current_admin(token, session=None)
+    assert raised.value.status_code == 401
+    return raised.value.detail
+
+
+async def test_token_is_verified_once_and_version_read_once(versions, decodes):
+    token = await create_jwt_token(ADMIN)
+
+    for _ in range(3):
+        admin = await get_current_admin(token, session=None)
+
+    assert (admin.id, admin.email, admin.token_version) == (3, "admin@example.com", 0)
+    assert len(decodes) == 1
+    assert versions.lookups == [3]
+
+
+async def test_revoking_takes_effect_immediately_in_this_process(versions):
+    token = await create_jwt_token(ADMIN)
+    await get_current_admin(token, session=None)
+
+    versions[ADMIN.id] = 1
+    invalidate_admin_tokens(ADMIN.id)
+
+    assert await rejection(token) == "Authentication token has been revoked"
+
+
+async def test_other_processes_see_revocation_after_revalidating(versions):
+    token = await create_jwt_token(ADMIN)
+    await get_current_admin(token, session=None)
+
+    # Revoked elsewhere: the cached version still holds until it expires
+    versions[ADMIN.id] = 1
+    await get_current_admin(token, session=None)
+
+    auth._token_versions.clear()
+    assert await rejection(token) == "Authentication token has been revoked"
+
+
+async def test_new_token_after_revocation_is_accepted(versions):
+    versions[ADMIN.id] = 1
+    token = await create_jwt_token(SimpleNamespace(id=ADMIN.id, email=ADMIN.email, token_version=1))
+
+    assert (await get_current_admin(token, session=None)).token_version == 1
+
+
+async def test_deleted_admin_is_rejected(versions):
+    token = await create_jwt_token(ADMIN)
+    del versions[ADMIN.id]
+
+    assert await rejection(token) == "Admin not found"
+
+
+async def test_forged_and_foreign_tokens_are_rejected(versions):
+    forged = jwt.encode({"sub": ADMIN.email, "aid": ADMIN.id, "role": "admin"}, "other-secret", algorithm="HS256")
+    not_admin = jwt.encode({"sub": ADMIN.email, "aid": ADMIN.id, "role": "client"}, settings.jwt_secret, algorithm="HS256")
+
+    assert await rejection(forged) == "Invalid authentication token"
+    assert await rejection(not_admin) == "Invalid authentication token"
+    assert len(auth._token_cache) == 0
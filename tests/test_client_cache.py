@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.services import client as client_service
+from src.services.client import delete_client, resolve_client_credentials, update_client
+
+pytestmark = pytest.mark.anyio
+
+
+class Result:
+    def __init__(self, row):
+        self.row = row
+
+    def one_or_none(self):
+        return self.row
+
+    def scalar_one_or_none(self):
+        return self.row
+
+
+class Database:
+    """Session stand-in over a dict of api_key -> client row; counts the queries it answers."""
+
+    def __init__(self, **clients):
+        self.clients = clients
+        self.queries = 0
+        self.selecting = None
+
+    def row(self, api_key):
+        return self.clients.get(api_key)
+
+    async def execute(self, statement):
+        self.queries += 1
+        if self.selecting is not None:
+            return Result(self.selecting)
+        api_key = statement.compile().params["api_key_1"]
+        return Result(self.row(api_key))
+
+    async def commit(self):
+        pass
+
+    async def delete(self, row):
+        self.clients.pop(row.api_key)
+
+
+def client_row(api_key, scopes="otp:send", otp_secret=None):
+    return SimpleNamespace(
+        id=1,
+        business_id=7,
+        scopes=scopes,
+        otp_secret=otp_secret,
+        api_key=api_key,
+        phone_number_id="1000",
+        whatsapp_api_token="token",
+    )
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    client_service._credentials_cache.clear()
+    client_service._unknown_keys_cache.clear()
+    yield
+    client_service._credentials_cache.clear()
+    client_service._unknown_keys_cache.clear()
+
+
+async def test_known_key_is_resolved_once():
+    db = Database(key=client_row("key"))
+
+    first = await resolve_client_credentials(db, "key")
+    second = await resolve_client_credentials(db, "key")
+
+    assert first == second and first.business_id == 7
+    assert db.queries == 1
+
+
+async def test_unknown_key_is_remembered_separately():
+    db = Database()
+
+    assert await resolve_client_credentials(db, "guess") is None
+    assert await resolve_client_credentials(db, "guess") is None
+    assert db.queries == 1
+    assert len(client_service._credentials_cache) == 0
+
+
+async def test_updating_a_client_drops_old_and_new_keys():
+    row = client_row("old", scopes="otp:send")
+    db = Database(old=row)
+    await resolve_client_credentials(db, "old")
+    # "new" was probed before it existed, so it sits in the negative cache
+    await resolve_client_credentials(db, "new")
+
+    db.selecting = row
+    await update_client(db, client_id=1, scopes="otp:send otp:verify", api_key="new")
+    db.selecting = None
+    db.clients = {"new": row}
+
+    assert await resolve_client_credentials(db, "old") is None
+    credentials = await resolve_client_credentials(db, "new")
+    assert credentials is not None and credentials.scopes == "otp:send otp:verify"
+
+
+async def test_deleted_client_stops_resolving():
+    row = client_row("key")
+    db = Database(key=row)
+    assert await resolve_client_credentials(db, "key") is not None
+
+    db.selecting = row
+    await delete_client(db, client_id=1)
+    db.selecting = None
+
+    assert await resolve_client_credentials(db, "key") is None
+
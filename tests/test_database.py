@@ -0,0 +1,22 @@
+from sqlalchemy.pool import NullPool
+
+from src.config import settings
+from src.database.core import engine_options
+
+
+def test_direct_profile_pools_and_disables_jit(monkeypatch):
+    monkeypatch.setattr(settings, "db_profile", "direct")
+
+    options = engine_options()
+    assert options["pool_size"] == settings.db_pool_size
+    assert options["connect_args"]["server_settings"]["jit"] == "off"
+
+
+def test_pgbouncer_profile_sends_only_tracked_parameters(monkeypatch):
+    monkeypatch.setattr(settings, "db_profile", "pgbouncer")
+
+    options = engine_options()
+    assert options["poolclass"] is NullPool
+    assert options["connect_args"]["statement_cache_size"] == 0
+    # Stock PgBouncer rejects untracked startup parameters such as jit
+    assert set(options["connect_args"]["server_settings"]) == {"application_name"}
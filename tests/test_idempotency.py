@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from src.config import settings
+from src.exceptions.idempotency import IdempotencyInProgressError, IdempotencyKeyReusedError
+from src.services import idempotency
+from src.services.idempotency import (
+    IdempotentResponse,
+    MemoryIdempotencyStore,
+    RedisIdempotencyStore,
+    idempotent,
+    request_fingerprint,
+    scoped_key,
+)
+
+pytestmark = pytest.mark.anyio
+
+FINGERPRINT = request_fingerprint("+14155550123", 6)
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def store(request, monkeypatch):
+    if request.param == "memory":
+        store = MemoryIdempotencyStore(max_entries=100, ttl=60)
+    else:
+        request.getfixturevalue("redis")
+        store = RedisIdempotencyStore(ttl=60, pending_ttl=5)
+    await store.start()
+    monkeypatch.setattr(idempotency, "_store", store)
+    return store
+
+
+class Handler:
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self) -> IdempotentResponse:
+        self.calls += 1
+        await self.gate.wait()
+        if self.fail:
+            raise RuntimeError("send failed")
+        return IdempotentResponse(FINGERPRINT, 200, {"otp_id": self.calls})
+
+
+def test_fingerprint_depends_on_every_part():
+    assert request_fingerprint("+14155550123", 6) == FINGERPRINT
+    assert request_fingerprint("+14155550123", 4) != FINGERPRINT
+    assert request_fingerprint("+1415555012", 36) != FINGERPRINT
+
+
+def test_keys_are_scoped_per_api_key():
+    assert scoped_key("key-a", "k1") == scoped_key("key-a", "k1")
+    assert scoped_key("key-a", "k1") != scoped_key("key-b", "k1")
+
+
+async def test_repeat_is_replayed(store):
+    handler = Handler()
+
+    first, replayed = await idempotent("k1", FINGERPRINT, handler)
+    assert not replayed
+
+    again, replayed = await idempotent("k1", FINGERPRINT, handler)
+    assert replayed
+    assert again == first
+    assert handler.calls == 1
+
+
+async def test_key_reused_for_another_request(store):
+    await idempotent("k1", FINGERPRINT, Handler())
+
+    with pytest.raises(IdempotencyKeyReusedError):
+        await idempotent("k1", request_fingerprint("+447700900123", 6), Handler())
+
+
+async def test_concurrent_duplicates_run_once(store):
+    handler = Handler()
+    handler.gate.clear()
+
+    first = asyncio.ensure_future(idempotent("k1", FINGERPRINT, handler))
+    second = asyncio.ensure_future(idempotent("k1", FINGERPRINT, handler))
+    await asyncio.sleep(0.01)
+    handler.gate.set()
+
+    results = await asyncio.gather(first, second)
+    assert handler.calls == 1
+    assert results[0][0] == results[1][0]
+    assert sorted(replayed for _, replayed in results) == [False, True]
+
+
+async def test_failure_is_not_stored(store):
+    with pytest.raises(RuntimeError):
+        await idempotent("k1", FINGERPRINT, Handler(fail=True))
+
+    handler = Handler()
+    _, replayed = await idempotent("k1", FINGERPRINT, handler)
+    assert not replayed
+    assert handler.calls == 1
+
+
+async def test_waits_for_another_worker(redis, monkeypatch):
+    store = RedisIdempotencyStore(ttl=60, pending_ttl=5)
+    await store.start()
+    monkeypatch.setattr(idempotency, "_store", store)
+
+    # Another worker holds the key and finishes a moment later
+    assert await store.reserve("k1")
+    stored = IdempotentResponse(FINGERPRINT, 200, {"otp_id": 7})
+    asyncio.get_running_loop().call_later(0.1, lambda: asyncio.ensure_future(store.save("k1", stored)))
+
+    handler = Handler()
+    assert await idempotent("k1", FINGERPRINT, handler) == (stored, True)
+    assert handler.calls == 0
+
+
+async def test_gives_up_on_a_stuck_worker(redis, monkeypatch):
+    store = RedisIdempotencyStore(ttl=60, pending_ttl=5)
+    await store.start()
+    monkeypatch.setattr(idempotency, "_store", store)
+    monkeypatch.setattr(settings, "idempotency_wait_timeout", 0.2)
+
+    await store.reserve("k1")
+    with pytest.raises(IdempotencyInProgressError):
+        await idempotent("k1", FINGERPRINT, Handler())
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from itertools import count
+
+import pytest
+from pydantic import ValidationError
+
+from src.config import Settings
+from src.exceptions.otp import InvalidOTPError, OTPAlreadyUsedError, OTPExpiredError
+from src.schemas.otp import OTPVerifyRequest
+from src.services.otp_audit import OTPAuditSink
+from src.services.otp_store import MemoryOTPStore, RedisOTPStore, SQLAlchemyOTPStore
+from src.services.stateless_otp import encode_otp_id
+
+pytestmark = pytest.mark.anyio
+
+PHONE = "+14155550123"
+
+
+class CountingIds:
+    def __init__(self):
+        self._ids = count(1)
+
+    async def next_id(self) -> int:
+        return next(self._ids)
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def store(request):
+    audit = OTPAuditSink(batch_size=10, flush_interval=1.0, queue_size=100)
+    if request.param == "memory":
+        yield MemoryOTPStore(CountingIds(), audit, max_entries=100)
+    else:
+        store = RedisOTPStore(CountingIds(), audit)
+        request.getfixturevalue("redis")
+        await store.start()
+        yield store
+        await store.close()
+
+
+def in_minutes(minutes: float) -> datetime:
+    return datetime.utcnow() + timedelta(minutes=minutes)
+
+
+async def test_consume_by_phone_number(store):
+    issued = await store.issue(None, 1, PHONE, "123456", in_minutes(5))
+
+    assert await store.consume(None, 1, "123456", phone_number=PHONE) == issued.id
+
+
+async def test_consume_by_otp_id(store):
+    issued = await store.issue(None, 1, PHONE, "123456", in_minutes(5))
+
+    assert await store.consume(None, 1, "123456", otp_id=issued.id) == issued.id
+
+
+async def test_code_is_consumed_once(store):
+    issued = await store.issue(None, 1, PHONE, "123456", in_minutes(5))
+    await store.consume(None, 1, "123456", otp_id=issued.id)
+
+    with pytest.raises(OTPAlreadyUsedError):
+        await store.consume(None, 1, "123456", otp_id=issued.id)
+
+
+async def test_expired_code(store):
+    issued = await store.issue(None, 1, PHONE, "123456", in_minutes(-1))
+
+    with pytest.raises(OTPExpiredError):
+        await store.consume(None, 1, "123456", otp_id=issued.id)
+
+
+@pytest.mark.parametrize("client_id, otp_code, phone_number", [
+    (1, "654321", None),
+    (2, "123456", None),
+    (1, "123456", "+447700900123"),
+])
+async def test_mismatch_is_invalid(store, client_id, otp_code, phone_number):
+    issued = await store.issue(None, 1, PHONE, "123456", in_minutes(5))
+
+    with pytest.raises(InvalidOTPError):
+        await store.consume(None, client_id, otp_code, phone_number=phone_number, otp_id=issued.id)
+    # A failed attempt does not use the code up
+    assert await store.consume(None, 1, "123456", phone_number=PHONE, otp_id=issued.id) == issued.id
+
+
+@pytest.mark.parametrize("otp_store", ["memory", "redis"])
+def test_outbox_requires_the_sql_store(otp_store):
+    # Their audit sink may drop rows, so an outbox delivery could be lost
+    with pytest.raises(ValidationError):
+        Settings(otp_delivery_mode="outbox", otp_store=otp_store)
+
+
+class UnusedSession:
+    async def execute(self, *args, **kwargs):
+        raise AssertionError("no statement should run")
+
+
+@pytest.mark.parametrize("otp_id", [2 ** 31, encode_otp_id(56_666_666, 6)])
+async def test_sql_store_rejects_ids_beyond_int4(otp_id):
+    with pytest.raises(InvalidOTPError):
+        await SQLAlchemyOTPStore().consume(UnusedSession(), 1, "123456", otp_id=otp_id)
+
+
+def test_verify_request_admits_stateless_ids():
+    otp_id = encode_otp_id(56_666_666, 6)
+
+    assert OTPVerifyRequest(otp_id=otp_id, otp_code="123456").otp_id == otp_id
+    with pytest.raises(ValidationError):
+        OTPVerifyRequest(otp_id=2 ** 63, otp_code="123456")
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import settings
+from src.database.models import DeliveryStatus, OTPDelivery
+from src.services.otp import OTPService
+from src.services.otp_store import SQLAlchemyOTPStore
+from src.services.outbox import claim_deliveries, dispatch_batch
+
+pytestmark = pytest.mark.anyio
+
+
+async def enqueue(session, client_id, phone_number="+15551234567", code="123456", ttl=300):
+    issued = await SQLAlchemyOTPStore().issue(
+        session, client_id, phone_number, code, datetime.utcnow() + timedelta(seconds=ttl), enqueue_delivery=True
+    )
+    return issued.id
+
+
+async def delivery_of(session, otp_id):
+    session.expire_all()
+    return (await session.execute(select(OTPDelivery).where(OTPDelivery.otp_id == otp_id))).scalar_one()
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Records the WhatsApp sends; set sent.error to make them fail."""
+    class Sent(list):
+        error = None
+
+    sent = Sent()
+
+    async def send(phone_number, otp_code, phone_number_id, whatsapp_api_token, business_id=None):
+        sent.append((phone_number, otp_code, phone_number_id, whatsapp_api_token))
+        if sent.error:
+            raise sent.error
+
+    monkeypatch.setattr(OTPService, "_send_otp_via_whatsapp", staticmethod(send))
+    return sent
+
+
+async def test_claim_returns_everything_needed_to_send(db_session, client_id):
+    otp_id = await enqueue(db_session, client_id)
+
+    [claimed] = await claim_deliveries(db_session, batch_size=10)
+
+    assert claimed.otp_code == "123456"
+    assert claimed.phone_number == "+15551234567"
+    assert (claimed.phone_number_id, claimed.whatsapp_api_token) == ("1000", "token")
+    assert claimed.attempts == 1
+
+    delivery = await delivery_of(db_session, otp_id)
+    assert delivery.next_attempt_at > datetime.utcnow() + timedelta(seconds=settings.outbox_lease_seconds - 5)
+
+
+async def test_claimed_rows_are_leased(db_session, client_id):
+    await enqueue(db_session, client_id)
+
+    assert len(await claim_deliveries(db_session, batch_size=10)) == 1
+    assert await claim_deliveries(db_session, batch_size=10) == []
+
+
+async def test_claim_respects_batch_size_and_due_order(db_session, client_id):
+    otp_ids = [await enqueue(db_session, client_id, f"+1555000000{i}") for i in range(3)]
+    # The last one has been waiting longest
+    await db_session.execute(
+        update(OTPDelivery)
+        .where(OTPDelivery.otp_id == otp_ids[-1])
+        .values(next_attempt_at=datetime.utcnow() - timedelta(minutes=1))
+    )
+    await db_session.commit()
+
+    [oldest] = await claim_deliveries(db_session, batch_size=1)
+    assert oldest.phone_number == "+15550000002"
+
+    assert len(await claim_deliveries(db_session, batch_size=1)) == 1
+    assert len(await claim_deliveries(db_session, batch_size=5)) == 1
+
+
+async def test_rows_locked_by_another_dispatcher_are_skipped(db_engine, db_session, client_id):
+    locked = await enqueue(db_session, client_id, "+15550000001")
+    await enqueue(db_session, client_id, "+15550000002")
+
+    async with AsyncSession(db_engine) as other:
+        async with other.begin():
+            await other.execute(select(OTPDelivery).where(OTPDelivery.otp_id == locked).with_for_update())
+
+            claimed = await claim_deliveries(db_session, batch_size=10)
+
+    assert [row.phone_number for row in claimed] == ["+15550000002"]
+
+
+async def test_dispatch_marks_sent(db_session, client_id, sent):
+    otp_id = await enqueue(db_session, client_id)
+
+    assert await dispatch_batch(db_session) == 1
+    assert sent == [("+15551234567", "123456", "1000", "token")]
+
+    delivery = await delivery_of(db_session, otp_id)
+    assert delivery.status == DeliveryStatus.SENT
+    assert delivery.last_error is None
+
+
+async def test_failed_send_is_retried_later(db_session, client_id, sent):
+    otp_id = await enqueue(db_session, client_id)
+    sent.error = RuntimeError("Graph API returned 503")
+
+    await dispatch_batch(db_session)
+
+    delivery = await delivery_of(db_session, otp_id)
+    assert delivery.status == DeliveryStatus.PENDING
+    assert delivery.last_error == "Graph API returned 503"
+    assert delivery.next_attempt_at > datetime.utcnow()
+    assert await dispatch_batch(db_session) == 0
+
+
+async def test_gives_up_after_max_attempts(db_session, client_id, sent, monkeypatch):
+    monkeypatch.setattr(settings, "outbox_max_attempts", 2)
+    monkeypatch.setattr(settings, "outbox_retry_delay", 0)
+    otp_id = await enqueue(db_session, client_id)
+    sent.error = RuntimeError("Graph API returned 503")
+
+    await dispatch_batch(db_session)
+    await dispatch_batch(db_session)
+
+    delivery = await delivery_of(db_session, otp_id)
+    assert (delivery.status, delivery.attempts) == (DeliveryStatus.FAILED, 2)
+    assert len(sent) == 2
+
+
+async def test_expired_otp_is_not_sent(db_session, client_id, sent):
+    otp_id = await enqueue(db_session, client_id, ttl=-1)
+
+    await dispatch_batch(db_session)
+
+    assert sent == []
+    delivery = await delivery_of(db_session, otp_id)
+    assert delivery.status == DeliveryStatus.FAILED
+    assert delivery.last_error == "OTP expired before it could be delivered"
@@ -0,0 +1,122 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from src.database import partitions
+from src.database.partitions import DEFAULT_PARTITION, drop_expired_partitions, ensure_partitions
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 3, 10, 12, 30)
+
+
+class FakeConnection:
+    """
+    Answers the catalog queries of the partition helpers and records the
+    statements they run.
+    """
+
+    def __init__(self, partitions=(), default_rows=()):
+        self.partitions = list(partitions)
+        self.default_rows = list(default_rows)
+        self.statements = []
+
+    async def scalar(self, statement, params=None):
+        sql = str(statement)
+        if "localtimestamp" in sql:
+            return NOW
+        if "to_regclass" in sql:
+            return DEFAULT_PARTITION
+        if "EXISTS" in sql:
+            start, end = params["start"], params["end"]
+            return any((start is None or start <= row) and row < end for row in self.default_rows)
+        raise AssertionError(sql)
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        if "pg_inherits" in sql:
+            return [
+                (name, f"FOR VALUES FROM ('{lower}') TO ('{upper}')")
+                for name, lower, upper in self.partitions
+            ]
+        return SimpleNamespace(rowcount=0)
+
+    async def exec_driver_sql(self, sql):
+        self.statements.append(sql)
+
+
+@pytest.fixture
+def transactions(monkeypatch):
+    """Statements run on the separate transactional connection."""
+    tx = FakeConnection()
+
+    @asynccontextmanager
+    async def begin():
+        yield tx
+
+    monkeypatch.setattr(partitions, "engine", SimpleNamespace(begin=begin))
+    return tx.statements
+
+
+async def test_creates_missing_partitions_ahead(transactions):
+    conn = FakeConnection(partitions=[("otps_p20260310", NOW.replace(hour=0, minute=0), datetime(2026, 3, 11))])
+
+    created = await ensure_partitions(conn, "daily", ahead=2)
+
+    assert created == ["otps_p20260311", "otps_p20260312"]
+    assert all("PARTITION OF otps" in sql for sql in conn.statements[1:])
+    assert transactions == []
+
+
+async def test_rows_in_the_default_partition_are_moved_to_the_new_one(transactions):
+    conn = FakeConnection(default_rows=[datetime(2026, 3, 11, 8)])
+
+    await ensure_partitions(conn, "daily", ahead=1)
+
+    # Today's partition has nothing to move; tomorrow's is built around the default
+    assert any("otps_p20260310 PARTITION OF" in sql for sql in conn.statements)
+    assert [sql.split(" PARTITION")[0] for sql in transactions] == [
+        "ALTER TABLE otps DETACH",
+        "CREATE TABLE otps_p20260311",
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end "
+        "RETURNING *) INSERT INTO otps_p20260311 SELECT * FROM moved",
+        "ALTER TABLE otps ATTACH",
+    ]
+
+
+async def test_retention_covers_the_default_partition():
+    day = datetime(2026, 3, 5)
+    conn = FakeConnection(
+        partitions=[("otps_p20260305", day, day + timedelta(days=1))],
+        default_rows=[day + timedelta(hours=12)],
+    )
+
+    dropped = await drop_expired_partitions(conn, timedelta(hours=72))
+
+    assert dropped == ["otps_p20260305"]
+    assert f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff" in conn.statements
+
+
+async def test_migration_converts_only_with_an_interval(monkeypatch):
+    from src.database.migrations import v0007_partition_otps as migration
+
+    converted = []
+
+    async def convert(conn, interval):
+        converted.append(interval)
+
+    async def not_partitioned(conn):
+        return False
+
+    monkeypatch.setattr(migration, "convert_to_partitioned", convert)
+    monkeypatch.setattr(migration, "is_partitioned", not_partitioned)
+
+    monkeypatch.setattr(migration.settings, "otp_partition_interval", "none")
+    await migration.partition_otps(None)
+    monkeypatch.setattr(migration.settings, "otp_partition_interval", "hourly")
+    await migration.partition_otps(None)
+
+    assert converted == ["hourly"]
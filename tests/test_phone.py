@@ -0,0 +1,65 @@
+import pytest
+
+from src.exceptions.phone import InvalidPhoneNumberError
+from src.services.otp import OTPService
+from src.utils.phone import _normalize, normalize_phone_number
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("+14155550123", "+14155550123"),
+    ("14155550123", "+14155550123"),
+    ("+1 (415) 555-0123", "+14155550123"),
+    ("001.415.555.0123", "+14155550123"),
+    ("+44 7700 900123", "+447700900123"),
+    ("+44 (0)7700 900123", "+447700900123"),
+    ("+49 30 123456", "+4930123456"),
+    ("+380 44 123 4567", "+380441234567"),
+])
+def test_international_numbers(raw, expected):
+    assert normalize_phone_number(raw) == expected
+
+
+@pytest.mark.parametrize("raw", [
+    "",
+    "+",
+    "4155550123x",
+    "++14155550123",
+    "+1 415 555 012",
+    "+1415555012345",
+    "+999123456789",
+    "+1234567890123456",
+    "12345",
+])
+def test_invalid_numbers(raw):
+    with pytest.raises(InvalidPhoneNumberError):
+        normalize_phone_number(raw)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("07700 900123", "+447700900123"),
+    ("7700900123", "+447700900123"),
+    ("+14155550123", "+14155550123"),
+    # Not a valid UK national number, but a valid international one
+    ("14155550123", "+14155550123"),
+])
+def test_default_country_reads_national_numbers(raw, expected):
+    assert _normalize(raw, "44") == expected
+
+
+def test_national_number_without_default_country():
+    with pytest.raises(InvalidPhoneNumberError):
+        _normalize("07700 900123", None)
+
+
+@pytest.mark.anyio
+async def test_short_valid_numbers_can_be_sent_to(monkeypatch):
+    async def client_lookup(session, api_key):
+        raise ValueError("looked up the client")
+
+    monkeypatch.setattr(OTPService, "_get_client_with_business", staticmethod(client_lookup))
+    number = normalize_phone_number("+683 1234")
+    assert number == "+6831234"
+
+    # Got past input validation
+    with pytest.raises(ValueError, match="looked up the client"):
+        await OTPService.send_otp(None, "key", number)
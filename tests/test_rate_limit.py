@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.config import settings
+from src.exceptions.otp import OTPRateLimitError
+from src.services import rate_limit
+from src.services.client import ClientCredentials
+from src.services.otp import OTPService
+from src.services.rate_limit import MemoryRateLimiter, RateLimitRule, RedisRateLimiter
+
+pytestmark = pytest.mark.anyio
+
+RULE = RateLimitRule("phone", limit=4, window=10)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time.time() as seen by the limiters; starts on a window boundary."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def limiter(request):
+    if request.param == "memory":
+        return MemoryRateLimiter(shards=4)
+    request.getfixturevalue("redis")
+    limiter = RedisRateLimiter()
+    await limiter.start()
+    return limiter
+
+
+async def hits(limiter, keys, n):
+    return [await limiter.acquire(keys) for _ in range(n)]
+
+
+async def test_limit_within_a_window(limiter, clock):
+    assert await hits(limiter, [("p", RULE)], 4) == [None] * 4
+
+    refused = await limiter.acquire([("p", RULE)])
+    assert refused.scope == "phone"
+    # In the next window these 4 hits still weigh 4 * (1 - offset / window)
+    assert refused.retry_after == pytest.approx(12.5)
+
+    clock.value = 1012.4
+    assert await limiter.acquire([("p", RULE)]) is not None
+    clock.value = 1012.5
+    assert await limiter.acquire([("p", RULE)]) is None
+
+
+async def test_previous_window_is_weighted_by_overlap(limiter, clock):
+    await hits(limiter, [("p", RULE)], 4)
+
+    # Half way through the next window the previous one still counts for half
+    clock.value = 1015.0
+    assert await hits(limiter, [("p", RULE)], 2) == [None, None]
+
+    refused = await limiter.acquire([("p", RULE)])
+    assert refused.retry_after == pytest.approx(2.5)
+
+    clock.value = 1017.5
+    assert await limiter.acquire([("p", RULE)]) is None
+
+
+async def test_cost_counts_as_several_hits(limiter, clock):
+    await hits(limiter, [("p", RULE)], 2)
+
+    assert await limiter.acquire([("p", RULE)], cost=3) is not None
+    assert await limiter.acquire([("p", RULE)], cost=2) is None
+
+
+async def test_refused_hit_is_not_counted_in_other_scopes(limiter, clock):
+    client = RateLimitRule("client", limit=2, window=10)
+    business = RateLimitRule("business", limit=1, window=10)
+
+    assert await limiter.acquire([("c", client), ("b", business)]) is None
+    refused = await limiter.acquire([("c", client), ("b", business)])
+    assert refused.scope == "business"
+
+    # Only the first, accepted hit was counted against the client
+    assert await limiter.acquire([("c", client)]) is None
+    assert (await limiter.acquire([("c", client)])).scope == "client"
+
+
+async def test_keys_are_independent(limiter, clock):
+    await hits(limiter, [("p", RULE)], 4)
+
+    assert await limiter.acquire([("q", RULE)]) is None
+
+
+@pytest.fixture
+def batch_client(monkeypatch):
+    """Runs send_otp_batch up to delivery with a memory limiter; every WhatsApp send fails."""
+    client = ClientCredentials(id=1, business_id=1, scopes="", phone_number_id="pn", whatsapp_api_token="t")
+    limiter = MemoryRateLimiter(shards=4)
+
+    async def get_client(session, api_key):
+        return client
+
+    async def send_fails(*args, **kwargs):
+        raise RuntimeError("not sent")
+
+    monkeypatch.setattr(rate_limit, "_limiter", limiter)
+    monkeypatch.setattr(OTPService, "_get_client_with_business", staticmethod(get_client))
+    monkeypatch.setattr(OTPService, "_send_otp_via_whatsapp", staticmethod(send_fails))
+    monkeypatch.setattr(settings, "otp_delivery_mode", "sync")
+    monkeypatch.setattr(settings, "rate_limit_client_limit", 3)
+    return limiter
+
+
+class IdleSession:
+    def in_transaction(self) -> bool:
+        return False
+
+
+async def test_batch_charges_the_tenant_only_for_numbers_that_pass(batch_client, clock):
+    phone = rate_limit.send_rules()["phone"]
+    await hits(batch_client, [("phone:+14155550100", phone)], phone.limit)
+
+    results = await OTPService.send_otp_batch(IdleSession(), "key", ["+14155550100", "+14155550101"])
+    assert results[0].error == "Rate limit exceeded for phone"
+
+    # One of the client's 3 sends went to the second number, two are left
+    assert await OTPService.send_otp_batch(IdleSession(), "key", ["+14155550102", "+14155550103"])
+    with pytest.raises(OTPRateLimitError) as refused:
+        await OTPService.send_otp_batch(IdleSession(), "key", ["+14155550104"])
+    assert refused.value.scope == "client"
@@ -0,0 +1,161 @@
+"""The Postgres statements behind SQLAlchemyOTPStore; needs TEST_DATABASE_URL."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.exceptions.otp import InvalidOTPError, OTPAlreadyUsedError, OTPExpiredError
+from src.services.otp_store import SQLAlchemyOTPStore
+
+pytestmark = pytest.mark.anyio
+
+PHONE = "+14155550123"
+OTHER_PHONE = "+14155550199"
+
+store = SQLAlchemyOTPStore()
+
+
+def in_minutes(minutes: float) -> datetime:
+    return datetime.utcnow() + timedelta(minutes=minutes)
+
+
+async def otp_state(session, otp_id):
+    row = (await session.execute(
+        text("SELECT o.is_used, u.status FROM otps o JOIN users u ON u.id = o.user_id WHERE o.id = :id"),
+        {"id": otp_id}
+    )).one()
+    return row.is_used, row.status
+
+
+async def user_row(session, phone_number):
+    """The user's id, status and xmin; xmin changes whenever the row is rewritten."""
+    return (await session.execute(
+        text("SELECT id, status, xmin::text AS xmin FROM users WHERE phone_number = :phone"),
+        {"phone": phone_number}
+    )).one_or_none()
+
+
+class TestConsume:
+    async def test_marks_the_otp_used_and_the_user_verified(self, db_session, client_id):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+        assert await otp_state(db_session, issued.id) == (False, "NOT_VERIFIED")
+
+        assert await store.consume(db_session, client_id, "123456", phone_number=PHONE) == issued.id
+        assert await otp_state(db_session, issued.id) == (True, "VERIFIED")
+
+    async def test_by_otp_id(self, db_session, client_id):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+
+        assert await store.consume(db_session, client_id, "123456", otp_id=issued.id) == issued.id
+
+    async def test_second_consume_is_rejected(self, db_session, client_id):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+        await store.consume(db_session, client_id, "123456", otp_id=issued.id)
+
+        with pytest.raises(OTPAlreadyUsedError):
+            await store.consume(db_session, client_id, "123456", otp_id=issued.id)
+        with pytest.raises(OTPAlreadyUsedError):
+            await store.consume(db_session, client_id, "123456", phone_number=PHONE)
+
+    async def test_expired_code_is_left_unused(self, db_session, client_id):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(-1))
+
+        with pytest.raises(OTPExpiredError):
+            await store.consume(db_session, client_id, "123456", phone_number=PHONE)
+        assert await otp_state(db_session, issued.id) == (False, "NOT_VERIFIED")
+
+    @pytest.mark.parametrize("code, phone_number, other_client", [
+        ("654321", PHONE, False),
+        ("123456", OTHER_PHONE, False),
+        ("123456", PHONE, True),
+    ])
+    async def test_mismatch_is_invalid(self, db_session, client_id, code, phone_number, other_client):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+        await store.issue(db_session, client_id, OTHER_PHONE, "999999", in_minutes(5))
+        client = client_id + 1 if other_client else client_id
+
+        with pytest.raises(InvalidOTPError):
+            await store.consume(db_session, client, code, phone_number=phone_number)
+        with pytest.raises(InvalidOTPError):
+            await store.consume(db_session, client, code, phone_number=phone_number, otp_id=issued.id)
+        assert await otp_state(db_session, issued.id) == (False, "NOT_VERIFIED")
+
+    async def test_prefers_the_unused_code_when_a_code_repeats(self, db_session, client_id):
+        first = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+        await store.consume(db_session, client_id, "123456", otp_id=first.id)
+        second = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(4))
+
+        assert await store.consume(db_session, client_id, "123456", phone_number=PHONE) == second.id
+
+    async def test_concurrent_verifies_consume_once(self, db_engine, db_session, client_id):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+
+        async def verify():
+            async with AsyncSession(db_engine) as session:
+                return await store.consume(session, client_id, "123456", phone_number=PHONE)
+
+        results = await asyncio.gather(*(verify() for _ in range(5)), return_exceptions=True)
+
+        assert results.count(issued.id) == 1
+        assert all(isinstance(r, OTPAlreadyUsedError) for r in results if r != issued.id)
+
+
+class TestIssue:
+    async def test_creates_the_user_and_returns_the_otp(self, db_session, client_id):
+        expires_at = in_minutes(5).replace(microsecond=0)
+
+        issued = await store.issue(db_session, client_id, PHONE, "123456", expires_at)
+
+        assert issued.expires_at == expires_at
+        assert (await user_row(db_session, PHONE)).status == "NOT_VERIFIED"
+        code = await db_session.scalar(text("SELECT otp_code FROM otps WHERE id = :id"), {"id": issued.id})
+        assert code == "123456"
+
+    async def test_existing_user_is_read_not_rewritten(self, db_session, client_id):
+        first = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5))
+        await store.consume(db_session, client_id, "123456", otp_id=first.id)
+        before = await user_row(db_session, PHONE)
+
+        second = await store.issue(db_session, client_id, PHONE, "654321", in_minutes(5))
+
+        assert second.id != first.id
+        # Same row version, and a verified user stays verified
+        assert await user_row(db_session, PHONE) == before
+        assert before.status == "VERIFIED"
+
+    async def test_enqueues_a_delivery_in_the_same_statement(self, db_session, client_id):
+        issued = await store.issue(db_session, client_id, PHONE, "123456", in_minutes(5), enqueue_delivery=True)
+
+        count = await db_session.scalar(text("SELECT count(*) FROM otp_deliveries WHERE otp_id = :id"), {"id": issued.id})
+        assert count == 1
+
+    async def test_concurrent_first_sends_share_one_user(self, db_engine, client_id):
+        async def send(code):
+            async with AsyncSession(db_engine) as session:
+                return await store.issue(session, client_id, PHONE, code, in_minutes(5))
+
+        issued = await asyncio.gather(*(send(f"{i:06d}") for i in range(5)))
+
+        async with AsyncSession(db_engine) as session:
+            user_ids = (await session.execute(
+                text("SELECT DISTINCT user_id FROM otps WHERE id = ANY(:ids)"), {"ids": [i.id for i in issued]}
+            )).scalars().all()
+        assert len(user_ids) == 1
+
+    async def test_issue_many_mixes_new_and_existing_users(self, db_session, client_id):
+        await store.issue(db_session, client_id, PHONE, "111111", in_minutes(5))
+        existing = await user_row(db_session, PHONE)
+
+        issued = await store.issue_many(
+            db_session, client_id, {PHONE: "222222", OTHER_PHONE: "333333"}, in_minutes(5)
+        )
+
+        rows = (await db_session.execute(
+            text("SELECT o.id, o.otp_code, u.phone_number FROM otps o JOIN users u ON u.id = o.user_id WHERE o.id = ANY(:ids)"),
+            {"ids": [i.id for i in issued.values()]}
+        )).all()
+        assert {(row.phone_number, row.otp_code) for row in rows} == {(PHONE, "222222"), (OTHER_PHONE, "333333")}
+        assert {row.phone_number: row.id for row in rows} == {phone: i.id for phone, i in issued.items()}
+        assert await user_row(db_session, PHONE) == existing
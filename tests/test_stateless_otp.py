@@ -0,0 +1,148 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.config import settings
+from src.exceptions.otp import InvalidOTPError, OTPAlreadyUsedError, OTPExpiredError, OTPRateLimitError
+from src.services import stateless_otp
+from src.services.stateless_otp import (
+    MemoryReplaySet,
+    RedisReplaySet,
+    decode_otp_id,
+    derive_code,
+    encode_otp_id,
+    issue,
+    verify,
+)
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "00112233445566778899aabbccddeeff"
+PHONE = "+14155550123"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1_700_000_000.0)
+    monkeypatch.setattr(stateless_otp, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture(params=["memory", "redis"], autouse=True)
+def replay_set(request, monkeypatch):
+    if request.param == "memory":
+        replay_set = MemoryReplaySet(max_entries=100)
+    else:
+        request.getfixturevalue("redis")
+        replay_set = RedisReplaySet()
+    monkeypatch.setattr(stateless_otp, "_replay_set", replay_set)
+    return replay_set
+
+
+def test_derived_code_is_stable_and_bound_to_its_inputs():
+    code = derive_code(SECRET, PHONE, 100, 6)
+
+    assert len(code) == 6 and code.isdigit()
+    assert derive_code(SECRET, PHONE, 100, 6) == code
+    assert derive_code(SECRET, PHONE, 101, 6) != code
+    assert derive_code(SECRET, "+447700900123", 100, 6) != code
+    assert derive_code("ff" * 16, PHONE, 100, 6) != code
+    # The length is part of the message, not just a truncation of the same value
+    assert derive_code(SECRET, PHONE, 100, 4) != code[-4:]
+
+
+def test_otp_id_round_trip():
+    assert decode_otp_id(encode_otp_id(56_666_666, 6)) == (56_666_666, 6)
+    assert decode_otp_id(encode_otp_id(56_666_666, 10)) == (56_666_666, 10)
+
+
+async def test_issue_then_verify(clock):
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+
+    assert await verify(1, SECRET, PHONE, code, otp_id=otp_id) == otp_id
+
+
+async def test_code_is_consumed_once(clock):
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+    await verify(1, SECRET, PHONE, code, otp_id=otp_id)
+
+    with pytest.raises(OTPAlreadyUsedError):
+        await verify(1, SECRET, PHONE, code, otp_id=otp_id)
+    # Sending again within the same step would hand out the consumed code
+    with pytest.raises(OTPRateLimitError):
+        await issue(1, SECRET, PHONE, 6)
+
+
+async def test_length_is_fixed_at_issue_time(clock):
+    otp_id, _, _ = await issue(1, SECRET, PHONE, 6)
+    step, _ = decode_otp_id(otp_id)
+    short_code = derive_code(SECRET, PHONE, step, 4)
+
+    # A correct 4-digit code does not verify a 6-digit send
+    with pytest.raises(InvalidOTPError):
+        await verify(1, SECRET, PHONE, short_code, otp_id=otp_id)
+
+
+async def test_otp_id_and_phone_number_are_required(clock):
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+
+    with pytest.raises(InvalidOTPError):
+        await verify(1, SECRET, PHONE, code)
+    with pytest.raises(InvalidOTPError):
+        await verify(1, SECRET, None, code, otp_id=otp_id)
+
+
+async def test_code_from_a_future_step_is_rejected(clock):
+    otp_id, _, _ = await issue(1, SECRET, PHONE, 6)
+    step, length = decode_otp_id(otp_id)
+    future_code = derive_code(SECRET, PHONE, step + 1, length)
+
+    with pytest.raises(InvalidOTPError):
+        await verify(1, SECRET, PHONE, future_code, otp_id=encode_otp_id(step + 1, length))
+
+
+async def test_code_expires_after_the_valid_steps(clock):
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+
+    clock.value += settings.stateless_otp_valid_steps * settings.stateless_otp_step
+    with pytest.raises(OTPExpiredError):
+        await verify(1, SECRET, PHONE, code, otp_id=otp_id)
+
+
+async def test_verify_attempts_are_capped_per_number(clock):
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+    wrong = str((int(code) + 1) % 10 ** 6).zfill(6)
+
+    for _ in range(settings.stateless_otp_max_attempts):
+        with pytest.raises(InvalidOTPError):
+            await verify(1, SECRET, PHONE, wrong, otp_id=otp_id)
+
+    # Out of attempts: even the right code is refused
+    with pytest.raises(OTPRateLimitError):
+        await verify(1, SECRET, PHONE, code, otp_id=otp_id)
+    # Other clients and numbers keep their own budget
+    other_id, other_code, _ = await issue(2, SECRET, PHONE, 6)
+    assert await verify(2, SECRET, PHONE, other_code, otp_id=other_id) == other_id
+
+
+async def test_successful_verifies_do_not_use_up_attempts(clock):
+    for _ in range(settings.stateless_otp_max_attempts + 1):
+        otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+        assert await verify(1, SECRET, PHONE, code, otp_id=otp_id) == otp_id
+        clock.value += settings.stateless_otp_step
+
+
+async def test_success_starts_the_failure_count_over(clock):
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+    wrong = str((int(code) + 1) % 10 ** 6).zfill(6)
+
+    for _ in range(settings.stateless_otp_max_attempts - 1):
+        with pytest.raises(InvalidOTPError):
+            await verify(1, SECRET, PHONE, wrong, otp_id=otp_id)
+    await verify(1, SECRET, PHONE, code, otp_id=otp_id)
+
+    clock.value += settings.stateless_otp_step
+    otp_id, code, _ = await issue(1, SECRET, PHONE, 6)
+    with pytest.raises(InvalidOTPError):
+        await verify(1, SECRET, PHONE, wrong, otp_id=otp_id)
+    assert await verify(1, SECRET, PHONE, code, otp_id=otp_id) == otp_id
@@ -0,0 +1,187 @@
+import httpx
+import pytest
+
+from src.config import settings
+from src.exceptions.whatsapp import WhatsAppSendError, WhatsAppUnavailableError
+from src.services import wa, wa_scheduler
+from src.services.wa import CircuitBreaker, send_whatsapp_template
+
+SENDER = "1000"
+
+
+class Graph:
+    """Scripted Graph API: each request gets the next reply, the last one repeats."""
+
+    def __init__(self):
+        self.replies = []
+        self.requests = []
+
+    def reply(self, *replies):
+        self.replies.extend(replies)
+
+    def __call__(self, request):
+        self.requests.append(request)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    monkeypatch.setattr(settings, "whatsapp_max_attempts", 3)
+    monkeypatch.setattr(settings, "whatsapp_backoff_base", 0.001)
+    monkeypatch.setattr(settings, "whatsapp_backoff_max", 0.001)
+    monkeypatch.setattr(settings, "whatsapp_breaker_threshold", 5)
+    monkeypatch.setattr(wa, "_breakers", {})
+
+    graph = Graph()
+    monkeypatch.setattr(wa, "_client", httpx.AsyncClient(base_url="http://graph.test", transport=httpx.MockTransport(graph)))
+    wa_scheduler.stop_delivery_scheduler()
+    wa_scheduler.start_delivery_scheduler()
+    yield graph
+    wa_scheduler.stop_delivery_scheduler()
+
+
+def accepted():
+    return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+
+
+def send():
+    return send_whatsapp_template("+15551234567", "123456", SENDER, "token")
+
+
+def test_breaker_opens_after_threshold_and_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+
+    breaker.record_failure(now=0)
+    assert breaker.allow(1)
+    breaker.record_failure(now=1)
+    assert not breaker.allow(2)
+
+    # After the reset timeout exactly one caller probes
+    assert breaker.allow(31)
+    assert not breaker.allow(31)
+
+    breaker.record_success()
+    assert breaker.allow(32) and breaker.allow(32)
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+    breaker.record_failure(now=0)
+    assert breaker.allow(30)
+
+    breaker.record_failure(now=30)
+    assert not breaker.allow(59)
+    assert breaker.allow(60)
+
+
+def test_retry_after_opens_the_breaker_before_the_threshold():
+    breaker = CircuitBreaker(threshold=5, reset_timeout=30)
+    breaker.record_failure(now=0, retry_after=10)
+
+    assert not breaker.allow(9.9)
+    assert breaker.allow(10)
+
+
+@pytest.mark.anyio
+async def test_server_errors_are_retried(graph):
+    graph.reply(httpx.Response(503), httpx.Response(500), accepted())
+
+    body = await send()
+
+    assert body["messages"][0]["id"] == "wamid.1"
+    assert len(graph.requests) == 3
+    assert wa.get_breaker(SENDER).failures == 0
+
+
+@pytest.mark.anyio
+async def test_transport_errors_are_retried(graph):
+    graph.reply(httpx.ConnectError("refused"), accepted())
+
+    await send()
+
+    assert len(graph.requests) == 2
+
+
+@pytest.mark.anyio
+async def test_gives_up_after_max_attempts(graph):
+    graph.reply(httpx.Response(502, json={"error": {"message": "bad gateway"}}))
+
+    with pytest.raises(WhatsAppSendError) as raised:
+        await send()
+
+    assert raised.value.status_code == 502
+    assert len(graph.requests) == settings.whatsapp_max_attempts
+
+
+@pytest.mark.anyio
+async def test_request_errors_are_not_retried_or_counted(graph):
+    graph.reply(httpx.Response(400, json={"error": {"message": "invalid parameter"}}))
+
+    with pytest.raises(WhatsAppSendError) as raised:
+        await send()
+
+    assert raised.value.status_code == 400
+    assert len(graph.requests) == 1
+    assert wa.get_breaker(SENDER).failures == 0
+
+
+@pytest.mark.anyio
+async def test_error_body_with_200_is_a_failure(graph):
+    graph.reply(httpx.Response(200, json={"error": {"message": "template paused"}}))
+
+    with pytest.raises(WhatsAppSendError):
+        await send()
+
+    assert len(graph.requests) == 1
+
+
+@pytest.mark.anyio
+async def test_retry_after_past_the_deadline_fails_fast(graph, monkeypatch):
+    monkeypatch.setattr(settings, "whatsapp_deadline", 5.0)
+    graph.reply(httpx.Response(429, headers={"Retry-After": "60"}))
+
+    with pytest.raises(WhatsAppSendError) as raised:
+        await send()
+    assert raised.value.status_code == 429
+    assert len(graph.requests) == 1
+
+    # The sender stays paused for the Retry-After without calling Meta again
+    with pytest.raises(WhatsAppUnavailableError) as paused:
+        await send()
+    assert paused.value.retry_after > 50
+    assert len(graph.requests) == 1
+
+
+@pytest.mark.anyio
+async def test_open_breaker_rejects_without_calling_meta(graph, monkeypatch):
+    monkeypatch.setattr(settings, "whatsapp_max_attempts", 1)
+    monkeypatch.setattr(settings, "whatsapp_breaker_threshold", 2)
+    graph.reply(httpx.Response(500))
+
+    for _ in range(2):
+        with pytest.raises(WhatsAppSendError):
+            await send()
+
+    with pytest.raises(WhatsAppUnavailableError):
+        await send()
+    assert len(graph.requests) == 2
+
+
+@pytest.mark.anyio
+async def test_successful_probe_closes_the_breaker(graph, monkeypatch):
+    monkeypatch.setattr(settings, "whatsapp_max_attempts", 1)
+    monkeypatch.setattr(settings, "whatsapp_breaker_threshold", 1)
+    graph.reply(httpx.Response(503), accepted())
+
+    with pytest.raises(WhatsAppSendError):
+        await send()
+
+    # Pretend the reset timeout has passed
+    breaker = wa.get_breaker(SENDER)
+    breaker.open_until = 0.0
+
+    await send()
+    assert breaker.failures == 0 and not breaker.probing
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from src.config import settings
+from src.services import wa_scheduler
+from src.services.wa_scheduler import PRIORITY_BULK, PRIORITY_OTP, DeliveryScheduler, TokenBucket
+
+
+def test_bucket_starts_full_and_empties():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+
+    assert [bucket.take(now) for _ in range(4)] == [True, True, True, False]
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_rate_up_to_burst():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    for _ in range(3):
+        bucket.take(now)
+
+    assert bucket.take(now + 0.5)
+    assert not bucket.take(now + 0.5)
+
+    # A long pause refills to the burst, not beyond
+    later = now + 60
+    assert [bucket.take(later) for _ in range(4)] == [True, True, True, False]
+
+
+def test_rate_is_split_between_processes(monkeypatch):
+    monkeypatch.setattr(settings, "whatsapp_rate_per_number", 80)
+    monkeypatch.setattr(settings, "whatsapp_rate_burst", 10)
+    monkeypatch.setattr(settings, "whatsapp_rate_processes", 4)
+    wa_scheduler.stop_delivery_scheduler()
+    try:
+        scheduler = wa_scheduler.start_delivery_scheduler()
+        assert scheduler.rate == 20
+        assert scheduler.burst == 2.5
+    finally:
+        wa_scheduler.stop_delivery_scheduler()
+
+
+@pytest.mark.anyio
+async def test_throttled_number_does_not_hold_up_others():
+    scheduler = DeliveryScheduler(rate=10, burst=1, concurrency=10)
+    await scheduler.acquire(1, "number-a")
+
+    second = asyncio.ensure_future(scheduler.acquire(1, "number-a"))
+    await asyncio.sleep(0)
+    assert not second.done()
+
+    # Another number gets its slot straight away
+    await asyncio.wait_for(scheduler.acquire(2, "number-b"), 0.1)
+
+    # The throttled one is granted once its bucket has a token again
+    await asyncio.wait_for(second, 1)
+
+
+async def granted_order(scheduler, requests):
+    """Queues (name, business_id, number, priority) behind a held slot and returns the order they are granted in."""
+    order = []
+
+    async def send(name, business_id, number, priority):
+        await scheduler.acquire(business_id, number, priority)
+        order.append(name)
+
+    await scheduler.acquire(0, "warm-up")
+    tasks = [asyncio.ensure_future(send(*request)) for request in requests]
+    await asyncio.sleep(0)
+    for _ in requests:
+        scheduler.release()
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.anyio
+async def test_otp_sends_go_before_bulk_for_the_same_number():
+    scheduler = DeliveryScheduler(rate=1000, burst=1000, concurrency=1)
+
+    order = await granted_order(scheduler, [
+        ("bulk-1", 1, "n", PRIORITY_BULK),
+        ("bulk-2", 1, "n", PRIORITY_BULK),
+        ("otp", 2, "n", PRIORITY_OTP),
+    ])
+    assert order == ["otp", "bulk-1", "bulk-2"]
+
+
+@pytest.mark.anyio
+async def test_businesses_take_turns():
+    scheduler = DeliveryScheduler(rate=1000, burst=1000, concurrency=1)
+
+    order = await granted_order(scheduler, [
+        ("a1", 1, "n1", PRIORITY_BULK),
+        ("a2", 1, "n1", PRIORITY_BULK),
+        ("a3", 1, "n1", PRIORITY_BULK),
+        ("b1", 2, "n2", PRIORITY_BULK),
+        ("b2", 2, "n2", PRIORITY_BULK),
+    ])
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_is_skipped():
+    scheduler = DeliveryScheduler(rate=1000, burst=1000, concurrency=1)
+    await scheduler.acquire(1, "n")
+
+    gone = asyncio.ensure_future(scheduler.acquire(1, "n"))
+    stays = asyncio.ensure_future(scheduler.acquire(1, "n"))
+    await asyncio.sleep(0)
+    assert scheduler.queued == 2
+
+    gone.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.queued == 1
+
+    scheduler.release()
+    await asyncio.wait_for(stays, 1)
+    assert scheduler.queued == 0